@@ -0,0 +1,308 @@
+import argparse
+import contextlib
+import io
+import json
+import numba
+import os
+import platform
+from ply import Ply
+import shutil
+import tempfile
+import time
+import tracemalloc
+from tsdf import *
+
+
+# (center, radius, rgb) of the spheres of the synthetic scene, standing on the z = 0 ground plane
+SCENE_SPHERES = (
+    ((0., 0., 0.25), 0.25, (200, 60, 60)),
+    ((0.45, 0.3, 0.15), 0.15, (60, 200, 60)),
+    ((-0.35, 0.4, 0.2), 0.2, (60, 60, 200)),
+    ((-0.3, -0.45, 0.1), 0.1, (200, 200, 60)),
+)
+
+# world space bounds of the synthetic scene
+SCENE_BOUNDS = np.array([[-0.8, 0.8], [-0.8, 0.8], [-0.05, 0.55]])
+
+
+def look_at(eye, target, up=(0., 0., 1.)):
+    """Build the pose of a camera at eye looking at target.
+
+    Args:
+        eye (numpy.array [3, ]): camera center in world coordinates.
+        target (numpy.array [3, ]): point the optical axis goes through.
+        up (numpy.array [3, ], optional): world direction shown upwards in the image.
+            Defaults to +z.
+
+    Returns:
+        numpy.array [4, 4]: SE3 transform representing pose (camera to world), with x
+            pointing right, y down and z forward in the image.
+    """
+    eye = np.asarray(eye, dtype=np.float64)
+    z = np.asarray(target, dtype=np.float64) - eye
+    z /= np.linalg.norm(z)
+    x = np.cross(z, up)
+    x /= np.linalg.norm(x)
+    camera_pose = np.eye(4)
+    camera_pose[:3, :3] = np.stack([x, np.cross(z, x), z], axis=1)
+    camera_pose[:3, 3] = eye
+    return camera_pose
+
+
+def render_scene(camera_intrinsics, image_height, image_width, camera_pose, spheres=SCENE_SPHERES):
+    """Ray cast depth and color images of spheres standing on a checkered ground plane.
+
+    Args:
+        camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        image_height (int): height of the images in pixels.
+        image_width (int): width of the images in pixels.
+        camera_pose (numpy.array [4, 4]): SE3 transform representing pose (camera to world)
+        spheres (iterable, optional): (center, radius, rgb) of every sphere. Defaults to
+            SCENE_SPHERES.
+
+    Returns:
+        numpy.array [h, w, 3]: An rgb image.
+        numpy.array [h, w]: A z depth image, 0 where the ray hits nothing.
+    """
+    camera_pose = Pose(camera_pose)
+    ray_x, ray_y = camera_rays(camera_intrinsics, image_height, image_width)
+
+    # ray directions with a z of 1 in camera coordinates, so the ray parameter is the z depth
+    directions = np.stack(np.broadcast_arrays(ray_x[None, :], ray_y[:, None], 1.), axis=-1)
+    directions = directions @ camera_pose.rotation.T
+    origin = camera_pose.translation
+
+    # checkered ground plane at z = 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        depth_image = -origin[2] / directions[..., 2]
+    depth_image[~(depth_image > 0)] = np.inf
+    hits = origin + directions * np.where(np.isfinite(depth_image), depth_image, 0)[..., None]
+    checker = (np.floor(hits[..., 0] / 0.1) + np.floor(hits[..., 1] / 0.1)) % 2
+    color_image = np.repeat(np.where(checker > 0, 180, 90)[..., None], 3, axis=2).astype(np.uint8)
+
+    for center, radius, rgb in spheres:
+        offset = origin - np.asarray(center)
+        a = np.einsum('ijk,ijk->ij', directions, directions)
+        b = 2 * directions @ offset
+        discriminant = b * b - 4 * a * (offset @ offset - radius * radius)
+        with np.errstate(invalid='ignore'):
+            depth = (-b - np.sqrt(discriminant)) / (2 * a)
+        hit = (discriminant >= 0) & (depth > 0) & (depth < depth_image)
+        depth_image[hit] = depth[hit]
+        color_image[hit] = rgb
+
+    depth_image[np.isinf(depth_image)] = 0
+    return color_image, depth_image
+
+
+def synthetic_frames(frame_count, image_height=240, image_width=320, radius=1.2, height=0.8):
+    """Render frames of the synthetic scene seen from cameras orbiting around it.
+
+    Args:
+        frame_count (int): number of frames.
+        image_height (int, optional): height of the images in pixels. Defaults to 240.
+        image_width (int, optional): width of the images in pixels. Defaults to 320.
+        radius (float, optional): distance of the cameras to the vertical axis of the scene
+            in meters. Defaults to 1.2.
+        height (float, optional): height of the cameras above the ground in meters.
+            Defaults to 0.8.
+
+    Returns:
+        numpy.array [3, 3]: camera intrinsics, with a horizontal field of view of about 64 degrees.
+        list: (color_image, depth_image, camera_pose) of every frame.
+    """
+    focal = 0.8 * image_width
+    camera_intrinsics = np.array([[focal, 0., (image_width - 1) / 2.],
+                                  [0., focal, (image_height - 1) / 2.],
+                                  [0., 0., 1.]])
+    frames = []
+    for angle in np.linspace(0., 2 * np.pi, frame_count, endpoint=False):
+        camera_pose = look_at([radius * np.cos(angle), radius * np.sin(angle), height], [0., 0., 0.15])
+        frames.append(render_scene(camera_intrinsics, image_height, image_width, camera_pose) + (camera_pose,))
+    return camera_intrinsics, frames
+
+
+def measure(name, function, work, unit, repeat=3):
+    """Time a function and record the peak memory it allocates.
+
+    The function is called once untimed first, so kernel compilation and caches are not
+    measured. Peak memory is recorded with tracemalloc on a separate call, as tracing
+    slows allocations down.
+
+    Args:
+        name (str): name of the benchmark.
+        function (callable): function to measure, called without arguments.
+        work (float): amount of work done by one call, in units of unit.
+        unit (str): unit of the throughput, e.g. 'frames'.
+        repeat (int, optional): number of timed calls. Defaults to 3.
+
+    Returns:
+        dict: name, median and min seconds per call, throughput in unit per second and peak
+            memory allocated by a call in bytes.
+    """
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    seconds = float(np.median(times))
+    return {
+        'name': name,
+        'seconds': seconds,
+        'min_seconds': min(times),
+        'throughput': work / seconds,
+        'unit': unit + '/s',
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run_benchmarks(frame_count=10, image_height=240, image_width=320, voxel_size=0.01, repeat=3):
+    """Benchmark fusion, meshing, ply I/O and projection on the synthetic scene.
+
+    Args:
+        frame_count (int, optional): number of frames fused. Defaults to 10.
+        image_height (int, optional): height of the images in pixels. Defaults to 240.
+        image_width (int, optional): width of the images in pixels. Defaults to 320.
+        voxel_size (float, optional): The side length of each voxel in meters. Defaults to 0.01.
+        repeat (int, optional): number of timed calls per benchmark. Defaults to 3.
+
+    Returns:
+        dict: the configuration, the environment and the list of benchmark results.
+    """
+    camera_intrinsics, frames = synthetic_frames(frame_count, image_height, image_width)
+    color_images = np.stack([frame[0] for frame in frames])
+    depth_images = np.stack([frame[1] for frame in frames])
+    camera_poses = np.stack([frame[2] for frame in frames])
+    pixel_count = frame_count * image_height * image_width
+    warmup()
+
+    with contextlib.redirect_stdout(io.StringIO()):  # silence the volume size report
+        volume = TSDFVolume(SCENE_BOUNDS.copy(), voxel_size)
+    voxel_count = int(np.prod(volume._voxel_bounds))
+    volume_bytes = volume._tsdf_volume.nbytes + volume._weight_volume.nbytes + volume._color_volume.nbytes
+
+    def integrate():
+        for color_image, depth_image, camera_pose in frames:
+            volume.integrate(color_image, depth_image, camera_intrinsics, camera_pose)
+
+    def integrate_batch():
+        volume.integrate_batch(color_images, depth_images, camera_intrinsics, camera_poses)
+
+    def get_mesh():
+        # extract every block, not only the ones changed since the previous call
+        volume._dirty_blocks[:] = True
+        volume._block_meshes = {}
+        return volume.get_mesh()
+
+    results = [
+        dict(measure('integrate', integrate, frame_count, 'frames', repeat),
+             voxel_count=voxel_count, volume_bytes=volume_bytes),
+        dict(measure('integrate_batch', integrate_batch, frame_count, 'frames', repeat),
+             voxel_count=voxel_count, volume_bytes=volume_bytes),
+        dict(measure('get_mesh', get_mesh, voxel_count / 1e6, 'Mvoxels', repeat),
+             triangle_count=len(get_mesh()[1])),
+    ]
+
+    # ply files of the mesh, written and read back in both formats
+    points, triangles, normals, colors = get_mesh()
+    mesh = Ply(triangles=triangles, points=points, normals=normals, colors=colors)
+    directory = tempfile.mkdtemp()
+    try:
+        for file_format in ['ascii', 'binary_little_endian']:
+            ply_path = os.path.join(directory, file_format + '.ply')
+            mesh.write(ply_path, file_format)
+            megabytes = os.path.getsize(ply_path) / 1e6
+            results.append(measure('ply_write_' + file_format, lambda: mesh.write(ply_path, file_format),
+                                   megabytes, 'MB', repeat))
+            results.append(measure('ply_read_' + file_format, lambda: Ply(ply_path=ply_path),
+                                   megabytes, 'MB', repeat))
+    finally:
+        shutil.rmtree(directory)
+
+    # projection, on every frame
+    camera_points = [depth_to_point_cloud(camera_intrinsics, depth_image) for depth_image in depth_images]
+    point_count = sum(len(points) for points in camera_points) / 1e6
+    results += [
+        measure('depth_to_point_cloud',
+                lambda: [depth_to_point_cloud(camera_intrinsics, depth_image) for depth_image in depth_images],
+                pixel_count / 1e6, 'Mpixels', repeat),
+        measure('camera_to_image', lambda: [camera_to_image(camera_intrinsics, points) for points in camera_points],
+                point_count, 'Mpoints', repeat),
+        measure('transform_point3s', lambda: [transform_point3s(camera_pose, points)
+                                              for camera_pose, points in zip(camera_poses, camera_points)],
+                point_count, 'Mpoints', repeat),
+    ]
+
+    return {
+        'config': {
+            'frame_count': frame_count,
+            'image_height': image_height,
+            'image_width': image_width,
+            'voxel_size': voxel_size,
+            'repeat': repeat,
+        },
+        'environment': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'numba': numba.__version__,
+            'cpu_count': os.cpu_count(),
+            'numba_threads': numba.get_num_threads(),
+        },
+        'results': results,
+    }
+
+
+def compare_results(baseline, current):
+    """Compare the results of two runs benchmark by benchmark.
+
+    Args:
+        baseline (dict): results of the reference run, as returned by run_benchmarks.
+        current (dict): results of the new run, as returned by run_benchmarks.
+
+    Returns:
+        dict: speedup (baseline seconds over current seconds) of every benchmark present in
+            both runs, above 1 when the current run is faster.
+    """
+    baseline_seconds = {result['name']: result['seconds'] for result in baseline['results']}
+    return {result['name']: baseline_seconds[result['name']] / result['seconds']
+            for result in current['results'] if result['name'] in baseline_seconds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark TSDF fusion on a synthetic scene.')
+    parser.add_argument('--frames', type=int, default=10, help='number of frames fused')
+    parser.add_argument('--height', type=int, default=240, help='image height in pixels')
+    parser.add_argument('--width', type=int, default=320, help='image width in pixels')
+    parser.add_argument('--voxel-size', type=float, default=0.01, help='voxel size in meters')
+    parser.add_argument('--repeat', type=int, default=3, help='timed calls per benchmark')
+    parser.add_argument('--output', help='json file to write the results to')
+    parser.add_argument('--baseline', help='json file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    run = run_benchmarks(args.frames, args.height, args.width, args.voxel_size, args.repeat)
+    speedups = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            speedups = compare_results(json.load(f), run)
+
+    for result in run['results']:
+        line = '{:<32} {:>10.4f} s {:>12.2f} {:<10} {:>10.1f} MB peak'.format(
+            result['name'], result['seconds'], result['throughput'], result['unit'],
+            result['peak_memory_bytes'] / 1e6)
+        if result['name'] in speedups:
+            line += ' {:>6.2f}x'.format(speedups[result['name']])
+        print(line)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
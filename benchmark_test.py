@@ -0,0 +1,53 @@
+import json
+import unittest
+import numpy as np
+from benchmark import *
+
+
+class TestBenchmark(unittest.TestCase):
+    """Unit test benchmark.py.
+    """
+
+    def test_render_scene(self):
+        """Test benchmark.render_scene against the analytic depth of the ground plane and a sphere.
+        """
+        camera_intrinsics = np.array([[40., 0., 20.],
+                                      [0., 40., 15.],
+                                      [0., 0., 1.]])
+        camera_pose = look_at([0., 0., 2.], [0., 0., 0.], up=(0., 1., 0.))
+        self.assertTrue(transform_is_valid(camera_pose))
+
+        # looking straight down, the ground is 2m away and the top of the sphere 1.5m away
+        color_image, depth_image = render_scene(camera_intrinsics, 30, 40, camera_pose,
+                                                spheres=[((0., 0., 0.), 0.5, (255, 0, 0))])
+        self.assertTrue(np.allclose(depth_image[0], 2.))
+        self.assertAlmostEqual(depth_image[15, 20], 1.5)
+        self.assertTrue(np.array_equal(color_image[15, 20], [255, 0, 0]))
+
+        # the sphere surface is at its radius from the center
+        points = depth_to_point_cloud(camera_intrinsics, depth_image, camera_pose=camera_pose)
+        on_sphere = points[:, 2] > 1e-6
+        self.assertTrue(np.allclose(np.linalg.norm(points[on_sphere], axis=1), 0.5))
+
+    def test_run_benchmarks(self):
+        """Test benchmark.run_benchmarks and benchmark.compare_results on a tiny configuration.
+        """
+        run = run_benchmarks(frame_count=2, image_height=24, image_width=32, voxel_size=0.05, repeat=1)
+        names = [result['name'] for result in run['results']]
+        self.assertIn('integrate', names)
+        self.assertIn('get_mesh', names)
+        self.assertIn('ply_read_binary_little_endian', names)
+        self.assertIn('transform_point3s', names)
+        for result in run['results']:
+            self.assertGreater(result['throughput'], 0)
+            self.assertGreaterEqual(result['peak_memory_bytes'], 0)
+
+        # results are machine readable and comparable
+        run = json.loads(json.dumps(run))
+        speedups = compare_results(run, run)
+        self.assertEqual(sorted(speedups), sorted(names))
+        self.assertTrue(np.allclose(list(speedups.values()), 1.))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import glob
+from image import read_rgb, read_depth
+import multiprocessing
+import numpy as np
+import os
+
+
+def read_frame(data_dir, index):
+    """Read the color image, depth image and camera pose of a frame.
+
+    Args:
+        data_dir (str): directory holding the frame-%06d.* files.
+        index (int): index of the frame.
+
+    Returns:
+        numpy.array [h, w, 3]: An rgb image.
+        numpy.array [h, w]: A z depth image in meters.
+        numpy.array [4, 4]: SE3 transform representing pose (camera to world)
+    """
+    prefix = os.path.join(data_dir, 'frame-%06d' % index)
+    color_image = read_rgb(prefix + '.color.png')
+    depth_image = read_depth(prefix + '.depth.png')
+    camera_pose = np.loadtxt(prefix + '.pose.txt')
+    return color_image, depth_image, camera_pose
+
+
+class RGBDDataset(object):
+    """RGB-D sequence stored as frame-%06d.color.png, frame-%06d.depth.png and
+    frame-%06d.pose.txt files next to a camera-intrinsics.txt.
+
+    Iterating over the dataset decodes frames on a background pool, keeping up to
+    prefetch frames ready ahead of the consumer so that file I/O overlaps with fusion.
+    """
+
+    def __init__(self, data_dir, frame_count=None, prefetch=4, num_workers=2, use_processes=False):
+        """Initialize the dataset.
+
+        Args:
+            data_dir (str): directory holding the sequence.
+            frame_count (int, optional): number of frames to read. Defaults to None, meaning
+                every frame-%06d.color.png in data_dir.
+            prefetch (int, optional): maximum number of frames read ahead. Defaults to 4.
+            num_workers (int, optional): number of background workers. Defaults to 2.
+            use_processes (bool, optional): read frames in worker processes instead of
+                threads. Defaults to False.
+
+        Raises:
+            NameError: If data_dir is not a directory.
+            ValueError: If prefetch or num_workers is not positive.
+        """
+        if not os.path.isdir(data_dir):
+            raise NameError('Invalid path')
+        if prefetch < 1 or num_workers < 1:
+            raise ValueError('prefetch and num_workers must be positive.')
+
+        self._data_dir = data_dir
+        if frame_count is None:
+            frame_count = len(glob.glob(os.path.join(data_dir, 'frame-*.color.png')))
+        self._frame_count = int(frame_count)
+        self._prefetch = int(prefetch)
+        self._num_workers = int(num_workers)
+        self._use_processes = use_processes
+        self._camera_intrinsics = np.loadtxt(os.path.join(data_dir, 'camera-intrinsics.txt'), delimiter=' ')
+
+    def __len__(self):
+        return self._frame_count
+
+    def __getitem__(self, index):
+        """Read a frame synchronously.
+
+        Args:
+            index (int): index of the frame.
+
+        Raises:
+            IndexError: If index is out of range.
+
+        Returns:
+            numpy.array [h, w, 3]: An rgb image.
+            numpy.array [h, w]: A z depth image in meters.
+            numpy.array [4, 4]: SE3 transform representing pose (camera to world)
+        """
+        if not 0 <= index < self._frame_count:
+            raise IndexError('frame index out of range')
+        return read_frame(self._data_dir, index)
+
+    def __iter__(self):
+        """Iterate over the frames in order, reading ahead on the background pool.
+
+        Yields:
+            (numpy.array [h, w, 3], numpy.array [h, w], numpy.array [4, 4]): color image,
+                depth image and camera pose of the next frame.
+        """
+        if self._use_processes:
+            # forking is not safe once numba has started its worker threads
+            pool = ProcessPoolExecutor(max_workers=self._num_workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            pool = ThreadPoolExecutor(max_workers=self._num_workers)
+        with pool:
+            pending = deque()
+            next_index = 0
+            try:
+                while pending or next_index < self._frame_count:
+                    while next_index < self._frame_count and len(pending) < self._prefetch:
+                        pending.append(pool.submit(read_frame, self._data_dir, next_index))
+                        next_index += 1
+                    yield pending.popleft().result()
+            finally:
+                # the consumer stopped early, drop the frames that were not started yet
+                for future in pending:
+                    future.cancel()
+
+    def get_camera_intrinsics(self):
+        """Get the camera intrinsics of the sequence.
+
+        Returns:
+            numpy.array [3, 3]: given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        """
+        return self._camera_intrinsics
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import numpy as np
+import dataset
+from dataset import *
+from image import write_depth, write_rgb
+
+
+class TestRGBDDataset(unittest.TestCase):
+    """Unit test dataset.py.
+    """
+
+    def setUp(self):
+        # a few 12x16 frames, each with its own color, depth and pose
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.camera_intrinsics = np.array([[20., 0., 8.],
+                                           [0., 20., 6.],
+                                           [0., 0., 1.]])
+        np.savetxt(os.path.join(self.data_dir, 'camera-intrinsics.txt'), self.camera_intrinsics, delimiter=' ')
+        self.frames = []
+        for index in range(6):
+            color_image = np.full((12, 16, 3), [index * 10, 100, 200], dtype=np.uint8)
+            depth_image = np.full((12, 16), 0.5 + index * 0.125)
+            camera_pose = np.eye(4)
+            camera_pose[:3, 3] = [index * 0.1, 0., 0.]
+            prefix = os.path.join(self.data_dir, 'frame-%06d' % index)
+            write_rgb(color_image, prefix + '.color.png')
+            write_depth(depth_image, prefix + '.depth.png')
+            np.savetxt(prefix + '.pose.txt', camera_pose)
+            self.frames.append((color_image, depth_image, camera_pose))
+
+    def assertFrameEqual(self, actual, expected):
+        self.assertTrue(np.array_equal(actual[0], expected[0]))
+        self.assertTrue(np.allclose(actual[1], expected[1]))
+        self.assertTrue(np.allclose(actual[2], expected[2]))
+
+    def test_read_frame(self):
+        """Test dataset.read_frame and RGBDDataset.__getitem__.
+        """
+        self.assertFrameEqual(read_frame(self.data_dir, 3), self.frames[3])
+
+        data = RGBDDataset(self.data_dir)
+        self.assertEqual(len(data), 6)
+        self.assertTrue(np.allclose(data.get_camera_intrinsics(), self.camera_intrinsics))
+        self.assertFrameEqual(data[5], self.frames[5])
+        for index in [-1, 6]:
+            with self.assertRaises(IndexError):
+                data[index]
+
+        with self.assertRaises(NameError):
+            RGBDDataset(os.path.join(self.data_dir, 'missing'))
+        with self.assertRaises(ValueError):
+            RGBDDataset(self.data_dir, prefetch=0)
+
+    def test_iter(self):
+        """Test RGBDDataset.__iter__ yields the frames in order, with threads and processes.
+        """
+        for use_processes in [False, True]:
+            data = RGBDDataset(self.data_dir, frame_count=5, prefetch=2, num_workers=2, use_processes=use_processes)
+            frames = list(data)
+            self.assertEqual(len(frames), 5)
+            for actual, expected in zip(frames, self.frames):
+                self.assertFrameEqual(actual, expected)
+
+    def test_iter_stop_early(self):
+        """Test RGBDDataset.__iter__ stops reading and shuts its pool down when the consumer stops.
+        """
+        thread_count = threading.active_count()
+        with mock.patch.object(dataset, 'read_frame', wraps=read_frame) as read:
+            frames = iter(RGBDDataset(self.data_dir, prefetch=2, num_workers=1))
+            self.assertFrameEqual(next(frames), self.frames[0])
+            frames.close()
+
+            # only the frames prefetched before closing were read, and the workers are gone
+            read_count = read.call_count
+            self.assertLessEqual(read_count, 3)
+            self.assertEqual(threading.active_count(), thread_count)
+            self.assertEqual(read.call_count, read_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import cv2
+from numba import njit, prange
 import numpy as np
 
 
@@ -77,3 +78,119 @@ def read_depth(file_path):
     depth_image /= 1000.
 
     return depth_image
+
+
+def scale_intrinsics(intrinsics, scale):
+    """Scale pinhole intrinsics to an image resized by a factor.
+
+    Pixel (u, v) is the center of the pixel, so the principal point moves by half a pixel
+    on both sides of the scaling.
+
+    Args:
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        scale (float): size of the new image over the size of the original one, e.g. 0.5
+            for an image downsampled once by build_pyramid.
+
+    Returns:
+        numpy.array [3, 3]: intrinsics of the resized image.
+    """
+    intrinsics = np.array(intrinsics, dtype=np.float64)
+    intrinsics[0, 0] *= scale
+    intrinsics[1, 1] *= scale
+    intrinsics[:2, 2] = (intrinsics[:2, 2] + 0.5) * scale - 0.5
+    return intrinsics
+
+
+def downsample_rgbd(color_image, depth_image, max_depth_difference=0.03):
+    """Halve the resolution of an RGB-D image pair without blending across depth edges.
+
+    Every output pixel covers 2x2 input pixels. Its depth is the average of the valid depths
+    within max_depth_difference of the nearest one, so a foreground and a background are
+    never averaged into a depth that belongs to neither, and its color is the average of
+    the colors of the same pixels. Odd trailing rows and columns are dropped.
+
+    Args:
+        color_image (numpy.array [h, w, 3]): An rgb image.
+        depth_image (numpy.array [h, w]): A z depth image, 0 where the depth is missing.
+        max_depth_difference (float, optional): largest depth difference (in meters) to the
+            nearest depth of a 2x2 block for a pixel to be averaged in. Defaults to 0.03.
+
+    Returns:
+        numpy.array [h // 2, w // 2, 3]: the downsampled rgb image, in the type of color_image.
+        numpy.array [h // 2, w // 2]: the downsampled depth image, 0 where the whole block
+            is missing.
+    """
+    height, width = depth_image.shape[0] // 2, depth_image.shape[1] // 2
+    color = np.empty((height, width, 3), dtype=np.float64)
+    depth = np.empty((height, width), dtype=np.float64)
+    downsample_rgbd_kernel(color_image, depth_image, float(max_depth_difference), color, depth)
+    if np.issubdtype(color_image.dtype, np.integer):
+        color = np.round(color)
+    return color.astype(color_image.dtype), depth.astype(depth_image.dtype)
+
+
+@njit(parallel=True, cache=True)
+def downsample_rgbd_kernel(color_image, depth_image, max_depth_difference, color_out, depth_out):
+    """Fill the downsampled images of downsample_rgbd, one output row per thread.
+
+    Args:
+        color_image (numpy.array [h, w, 3]): An rgb image.
+        depth_image (numpy.array [h, w]): A z depth image, 0 where the depth is missing.
+        max_depth_difference (float): largest depth difference to the nearest depth of a block.
+        color_out (numpy.array [h // 2, w // 2, 3]): float64 output colors.
+        depth_out (numpy.array [h // 2, w // 2]): float64 output depths.
+    """
+    height, width = depth_out.shape
+    for v in prange(0, height):
+        for u in range(width):
+            nearest = np.inf
+            for dv in range(2):
+                for du in range(2):
+                    depth = depth_image[2 * v + dv, 2 * u + du]
+                    if 0 < depth < nearest:
+                        nearest = depth
+
+            depth_sum = 0.
+            count = 0
+            red, green, blue = 0., 0., 0.
+            for dv in range(2):
+                for du in range(2):
+                    depth = depth_image[2 * v + dv, 2 * u + du]
+                    # blocks without depth keep the average of all their colors
+                    if nearest == np.inf or (depth > 0 and depth <= nearest + max_depth_difference):
+                        depth_sum += max(depth, 0.)
+                        count += 1
+                        red += color_image[2 * v + dv, 2 * u + du, 0]
+                        green += color_image[2 * v + dv, 2 * u + du, 1]
+                        blue += color_image[2 * v + dv, 2 * u + du, 2]
+
+            depth_out[v, u] = 0. if nearest == np.inf else depth_sum / count
+            color_out[v, u, 0] = red / count
+            color_out[v, u, 1] = green / count
+            color_out[v, u, 2] = blue / count
+
+
+def build_pyramid(color_image, depth_image, intrinsics, level_count, max_depth_difference=0.03):
+    """Build an RGB-D image pyramid, each level half the resolution of the previous one.
+
+    Args:
+        color_image (numpy.array [h, w, 3]): An rgb image.
+        depth_image (numpy.array [h, w]): A z depth image, 0 where the depth is missing.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        level_count (int): number of levels, including the full resolution one.
+        max_depth_difference (float, optional): see downsample_rgbd. Defaults to 0.03.
+
+    Raises:
+        ValueError: If level_count is not positive.
+
+    Returns:
+        list: (color_image, depth_image, intrinsics) of every level, level 0 being the input.
+    """
+    if level_count < 1:
+        raise ValueError('level_count must be positive.')
+
+    levels = [(color_image, depth_image, np.asarray(intrinsics, dtype=np.float64))]
+    for level in range(1, level_count):
+        color_image, depth_image = downsample_rgbd(color_image, depth_image, max_depth_difference)
+        levels.append((color_image, depth_image, scale_intrinsics(intrinsics, 0.5 ** level)))
+    return levels
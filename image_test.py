@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+from image import *
+from transforms import depth_to_point_cloud
+
+
+class TestImage(unittest.TestCase):
+    """Unit test image.py.
+    """
+
+    def test_downsample_rgbd(self):
+        """Test image.downsample_rgbd does not average depths across an edge or missing depths.
+        """
+        depth_image = np.array([[1., 1.01, 2., 2.],
+                                [0., 1.02, 2., 0.],
+                                [0., 0., 3., 1.],
+                                [0., 0., 3., 3.]])
+        color_image = np.zeros((4, 4, 3), dtype=np.uint8)
+        color_image[..., 0] = [[10, 20, 0, 0],
+                               [90, 30, 0, 0],
+                               [40, 50, 0, 100],
+                               [60, 70, 0, 0]]
+
+        color, depth = downsample_rgbd(color_image, depth_image)
+        self.assertTrue(np.allclose(depth, [[1.01, 2.], [0., 1.]]))
+        self.assertTrue(np.array_equal(color[..., 0], [[20, 0], [55, 100]]))
+        self.assertEqual(color.dtype, np.uint8)
+
+    def test_build_pyramid(self):
+        """Test image.build_pyramid keeps the surface of a plane where the scaled intrinsics project it.
+        """
+        intrinsics = np.array([[60., 0., 31.5],
+                               [0., 60., 23.5],
+                               [0., 0., 1.]])
+        angle = 0.3
+        pose = np.eye(4)
+        pose[1:3, 1:3] = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+
+        # the depth image of the plane z = 2 seen by a camera tilted around x
+        rays = depth_to_point_cloud(intrinsics, np.ones((48, 64)), camera_pose=pose)
+        depth_image = (2. / rays[:, 2]).reshape(48, 64)
+        color_image = np.zeros((48, 64, 3), dtype=np.uint8)
+
+        levels = build_pyramid(color_image, depth_image, intrinsics, 3)
+        self.assertEqual([level[1].shape for level in levels], [(48, 64), (24, 32), (12, 16)])
+        self.assertTrue(np.allclose(levels[2][2], [[15., 0., 7.5], [0., 15., 5.5], [0., 0., 1.]]))
+        for _, depth, level_intrinsics in levels:
+            points = depth_to_point_cloud(level_intrinsics, depth, camera_pose=pose)
+            self.assertTrue(np.allclose(points[:, 2], 2., atol=0.01))
+
+        with self.assertRaises(ValueError):
+            build_pyramid(color_image, depth_image, intrinsics, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
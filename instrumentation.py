@@ -0,0 +1,144 @@
+import time
+
+
+class FrameStats(object):
+    """Timings and voxel counts of one TSDFVolume.integrate or integrate_batch call.
+
+    Attributes:
+        mode (str): 'frustum', 'band' or 'batch', the integration path that was taken.
+        frame_count (int): number of frames integrated by the call.
+        stage_seconds (dict): wall time of every stage in seconds, in the order they ran.
+        frustum_voxel_count (int): voxels visited, the frustum bounding boxes of the frames
+            or the truncation band voxels in band mode.
+        valid_voxel_count (int): voxels that project onto a valid depth and are updated.
+    """
+
+    def __init__(self, mode, frame_count=1):
+        """Start timing a call.
+
+        Args:
+            mode (str): 'frustum', 'band' or 'batch'.
+            frame_count (int, optional): number of frames integrated by the call. Defaults to 1.
+        """
+        self.mode = mode
+        self.frame_count = frame_count
+        self.stage_seconds = {}
+        self.frustum_voxel_count = 0
+        self.valid_voxel_count = 0
+        self._lap_start = time.perf_counter()
+
+    def lap(self, stage):
+        """Attribute the time since the previous lap (or the start) to a stage.
+
+        Args:
+            stage (str): name of the stage that just finished.
+        """
+        now = time.perf_counter()
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.) + now - self._lap_start
+        self._lap_start = now
+
+    @property
+    def total_seconds(self):
+        """float: wall time of all the stages in seconds."""
+        return sum(self.stage_seconds.values())
+
+    def as_dict(self):
+        """Get the stats as plain python types, e.g. to write them as json.
+
+        Returns:
+            dict: every attribute and the total time.
+        """
+        return {
+            'mode': self.mode,
+            'frame_count': self.frame_count,
+            'stage_seconds': dict(self.stage_seconds),
+            'total_seconds': self.total_seconds,
+            'frustum_voxel_count': self.frustum_voxel_count,
+            'valid_voxel_count': self.valid_voxel_count,
+        }
+
+
+class IntegrationStats(object):
+    """Timings and voxel counts accumulated over the integrate calls of a TSDFVolume.
+
+    Callbacks subscribed with subscribe receive the FrameStats of every call as soon as
+    it returns.
+
+    Attributes:
+        call_count (int): number of integrate and integrate_batch calls recorded.
+        frame_count (int): number of frames integrated by those calls.
+        stage_seconds (dict): total wall time of every stage in seconds.
+        frustum_voxel_count (int): total number of voxels visited.
+        valid_voxel_count (int): total number of voxel updates.
+        last_frame (FrameStats): stats of the last call, None before the first one.
+        memory_bytes (dict): bytes used by every array of the volume, refreshed by
+            TSDFVolume.get_stats.
+    """
+
+    def __init__(self):
+        """Initialize empty stats without subscribers.
+        """
+        self._callbacks = []
+        self.memory_bytes = {}
+        self.reset()
+
+    def reset(self):
+        """Clear the accumulated timings and counters, keeping the subscribers.
+        """
+        self.call_count = 0
+        self.frame_count = 0
+        self.stage_seconds = {}
+        self.frustum_voxel_count = 0
+        self.valid_voxel_count = 0
+        self.last_frame = None
+
+    def subscribe(self, callback):
+        """Call a function with the FrameStats of every following integrate call.
+
+        Args:
+            callback (callable): called as callback(frame_stats).
+        """
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        """Stop calling a function subscribed with subscribe.
+
+        Args:
+            callback (callable): the subscribed function.
+
+        Raises:
+            ValueError: If callback is not subscribed.
+        """
+        self._callbacks.remove(callback)
+
+    def record(self, frame):
+        """Accumulate the stats of a call and hand them to the subscribers.
+
+        Args:
+            frame (FrameStats): stats of the call.
+        """
+        self.call_count += 1
+        self.frame_count += frame.frame_count
+        for stage, seconds in frame.stage_seconds.items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.) + seconds
+        self.frustum_voxel_count += frame.frustum_voxel_count
+        self.valid_voxel_count += frame.valid_voxel_count
+        self.last_frame = frame
+        for callback in self._callbacks:
+            callback(frame)
+
+    def as_dict(self):
+        """Get the stats as plain python types, e.g. to write them as json.
+
+        Returns:
+            dict: every attribute, with the last call as a dict.
+        """
+        return {
+            'call_count': self.call_count,
+            'frame_count': self.frame_count,
+            'stage_seconds': dict(self.stage_seconds),
+            'frustum_voxel_count': self.frustum_voxel_count,
+            'valid_voxel_count': self.valid_voxel_count,
+            'last_frame': None if self.last_frame is None else self.last_frame.as_dict(),
+            'memory_bytes': dict(self.memory_bytes),
+        }
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+def marching_cubes_block(tsdf_block, mask=None):
+    """Run marching cubes over a block of tsdf values.
+
+    Args:
+        tsdf_block (numpy.array [l, w, h]): tsdf values of the block.
+        mask (numpy.array [l, w, h], optional): Only compute the surface where True.
+            Defaults to None.
+
+    Returns:
+        numpy.array [n, 3]: each row represents a 3D point in voxel coordinates of the block.
+        numpy.array [k, 3]: each row is a list of point indices used to render triangles.
+        numpy.array [n, 3]: each row represents the normal vector for the corresponding 3D point.
+            None is returned for all three when the block does not contain a surface.
+    """
+    if min(tsdf_block.shape) < 2 or not (tsdf_block.min() < 0 < tsdf_block.max()):
+        return None, None, None
+
+    # imported on first use, scikit-image is slow to import and only needed for meshing
+    from skimage import measure
+    try:
+        points, triangles, normals, _ = measure.marching_cubes(tsdf_block, level=0, method='lewiner', mask=mask)
+    except (RuntimeError, ValueError):
+        # raised by skimage when the mask leaves no surface to extract
+        return None, None, None
+
+    if len(triangles) == 0:
+        return None, None, None
+    return points, triangles, normals
+
+
+def observed_cube_mask(weight_volume, min_weight=0.0):
+    """Mask the marching cubes whose eight corner voxels have all been observed.
+
+    Marching cubes only tests the mask at the highest corner of each cube, so a voxel is
+    kept only when it and its -x, -y and -z neighbours all have a weight above min_weight.
+
+    Args:
+        weight_volume (numpy.array [l, w, h]): accumulated weight of every voxel.
+        min_weight (float, optional): voxels need a weight strictly greater than this to be
+            considered observed. Defaults to 0.
+
+    Returns:
+        numpy.array [l, w, h]: boolean mask to pass to marching cubes.
+    """
+    observed = weight_volume > min_weight
+    mask = observed.copy()
+    mask[1:] &= observed[:-1]
+    mask[:, 1:] &= observed[:, :-1]
+    mask[:, :, 1:] &= observed[:, :, :-1]
+    mask[1:, 1:] &= observed[:-1, :-1]
+    mask[1:, :, 1:] &= observed[:-1, :, :-1]
+    mask[:, 1:, 1:] &= observed[:, :-1, :-1]
+    mask[1:, 1:, 1:] &= observed[:-1, :-1, :-1]
+    return mask
+
+
+def merge_meshes(meshes, tolerance=1e-4):
+    """Concatenate meshes and weld the vertices they share along their seams.
+
+    Args:
+        meshes (list): (points, triangles, normals, colors) tuples as returned by get_mesh.
+            Points of different meshes must be expressed in the same coordinate frame.
+        tolerance (float, optional): vertices closer than this (per axis, in the
+            units of the points) are considered the same vertex. Defaults to 1e-4.
+
+    Returns:
+        numpy.array [n, 3]: each row represents a 3D point.
+        numpy.array [k, 3]: each row is a list of point indices used to render triangles.
+        numpy.array [n, 3]: each row represents the normal vector for the corresponding 3D point.
+        numpy.array [n, 3]: each row represents the color of the corresponding 3D point.
+    """
+    meshes = [mesh for mesh in meshes if mesh[0] is not None and len(mesh[0]) > 0]
+    if len(meshes) == 0:
+        return (np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.int32),
+                np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.uint8))
+
+    offsets = np.cumsum([0] + [len(mesh[0]) for mesh in meshes[:-1]])
+    points = np.concatenate([mesh[0] for mesh in meshes])
+    triangles = np.concatenate([mesh[1] + offset for mesh, offset in zip(meshes, offsets)])
+    normals = np.concatenate([mesh[2] for mesh in meshes])
+    colors = np.concatenate([mesh[3] for mesh in meshes])
+
+    # vertices on a shared seam are computed from the same pair of voxels on both sides,
+    # so after quantization they collapse onto a single key
+    keys = np.round(points / tolerance).astype(np.int64)
+    keys -= keys.min(axis=0)
+    extent = keys.max(axis=0) + 1
+    if np.prod(extent.astype(np.float64)) < 2.0 ** 62:
+        # pack the three axes into one integer, a 1D stable sort is much cheaper than
+        # sorting rows
+        keys = (keys[:, 0] * extent[1] + keys[:, 1]) * extent[2] + keys[:, 2]
+        order = np.argsort(keys, kind='stable')
+        starts = np.concatenate([[True], keys[order[1:]] != keys[order[:-1]]])
+        first = order[starts]
+        inverse = np.empty(len(keys), dtype=np.int64)
+        inverse[order] = np.cumsum(starts) - 1
+    else:
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+    # keep vertices in order of first appearance
+    order = np.argsort(first)
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    first = first[order]
+
+    triangles = remap[inverse][triangles].astype(np.int32)
+    return points[first], triangles, normals[first], colors[first]
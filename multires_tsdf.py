@@ -0,0 +1,206 @@
+from sparse_tsdf import *
+
+
+class MultiResolutionTSDFVolume:
+    """Volumetric TSDF Fusion of RGB-D Images into hashed voxel blocks of several resolutions.
+
+    Level l stores blocks of voxels of side voxel_size * 2^l in a SparseTSDFVolume. Space is
+    split into cells, the blocks of the coarsest level, and all the voxels of a cell are
+    stored at a single level: the finest one requested by the depth pixels observing it.
+    A pixel requests level 0 below level_distance and one level coarser every time the
+    distance doubles, following the growth of depth noise with range. When a closer view
+    requests a finer level for a cell, the voxels already fused there are upsampled into
+    the finer level.
+    """
+
+    def __init__(self, voxel_size, level_count=3, level_distance=1.0, block_size=8, initial_capacity=1024,
+                 volume_bounds=None):
+        """Initialize multi-resolution tsdf volume instance variables.
+
+        Args:
+            voxel_size (float): The side length of the voxels of the finest level in meters.
+            level_count (int, optional): number of levels. Defaults to 3.
+            level_distance (float, optional): depth (in meters) up to which pixels are fused
+                into the finest level. Defaults to 1.
+            block_size (int, optional): The side length of each voxel block in voxels, on every
+                level. Defaults to 8.
+            initial_capacity (int, optional): Number of blocks to preallocate per level.
+                Defaults to 1024.
+            volume_bounds (numpy.array [3, 2], optional): rows index [x, y, z] and cols index
+                [min_bound, max_bound]. Observations outside of the bounds are ignored.
+                Defaults to None, meaning the volume is unbounded.
+
+        Raises:
+            ValueError: If voxel size or level distance is not positive.
+            ValueError: If the number of levels, block size or initial capacity is not positive.
+            ValueError: If volume bounds are not the correct shape.
+        """
+        if level_count <= 0:
+            raise ValueError('level count must be positive.')
+        if level_distance <= 0.0:
+            raise ValueError('level distance must be positive.')
+
+        self._voxel_size = float(voxel_size)
+        self._level_distance = float(level_distance)
+        self._block_size = int(block_size)
+        self._levels = [SparseTSDFVolume(self._voxel_size * 2 ** level, block_size, initial_capacity, volume_bounds)
+                        for level in range(level_count)]
+
+        # level the voxels of every cell are stored at, by packed cell coordinates
+        self._cell_levels = {}
+
+    def get_level_count(self):
+        """Get the number of levels.
+
+        Returns:
+            int: number of levels.
+        """
+        return len(self._levels)
+
+    def get_block_counts(self):
+        """Get the number of allocated voxel blocks of every level.
+
+        Returns:
+            list: number of allocated blocks, from the finest to the coarsest level.
+        """
+        return [volume.get_block_count() for volume in self._levels]
+
+    def get_pixel_levels(self, depth_image):
+        """Get the level every depth pixel requests for the voxels it observes.
+
+        Args:
+            depth_image (numpy.array [h, w]): A z depth image.
+
+        Returns:
+            numpy.array [h, w]: level of every pixel, 0 below level_distance and one more
+                every time the depth doubles, up to the coarsest level.
+        """
+        with np.errstate(divide='ignore'):
+            levels = np.floor(np.log2(np.asarray(depth_image, dtype=np.float64) / self._level_distance)) + 1
+        return np.clip(levels, 0, len(self._levels) - 1).astype(np.int64)
+
+    def get_mesh(self, min_weight=0.0):
+        """ Run marching cubes block by block over the allocated blocks of every level.
+
+        Each level is meshed separately, as SparseTSDFVolume.get_mesh does. Surfaces are not
+        stitched across cells stored at different levels, which leaves a gap of about a voxel
+        along the seams.
+
+        Args:
+            min_weight (float, optional): only extract the cubes whose eight corners have a
+                weight greater than min_weight. Defaults to 0.
+
+        Returns:
+            numpy.array [n, 3]: each row represents a 3D point.
+            numpy.array [k, 3]: each row is a list of point indices used to render triangles.
+            numpy.array [n, 3]: each row represents the normal vector for the corresponding 3D point.
+            numpy.array [n, 3]: each row represents the color of the corresponding 3D point.
+        """
+        meshes = [volume.get_mesh(min_weight) for volume in self._levels]
+        offsets = np.cumsum([0] + [len(mesh[0]) for mesh in meshes[:-1]])
+        points = np.concatenate([mesh[0] for mesh in meshes])
+        triangles = np.concatenate([mesh[1] + offset for mesh, offset in zip(meshes, offsets)]).astype(np.int32)
+        normals = np.concatenate([mesh[2] for mesh in meshes])
+        colors = np.concatenate([mesh[3] for mesh in meshes])
+        return points, triangles, normals, colors
+
+    def integrate(self, color_image, depth_image, camera_intrinsics, camera_pose, observation_weight=1.):
+        """Integrate an RGB-D observation, each voxel at the level of the cell it falls in.
+
+        Args:
+            color_image (numpy.array [h, w, 3]): An rgb image.
+            depth_image (numpy.array [h, w]): A z depth image.
+            camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+            camera_pose (numpy.array [4, 4] or Pose): SE3 transform representing pose (camera to world)
+            observation_weight (float, optional):  The weight to assign for the current
+                observation. Defaults to 1.
+
+        Raises:
+            ValueError: If camera_pose is not a valid transform.
+        """
+        camera_pose = Pose(camera_pose)
+        camera_intrinsics = np.asarray(camera_intrinsics, dtype=np.float64)
+        depth_image = np.asarray(depth_image)
+        pixel_levels = self.get_pixel_levels(depth_image)
+
+        # finest level requested for every cell, levels are visited from the finest one
+        requests = {}
+        for level, volume in enumerate(self._levels):
+            level_depth = np.where(pixel_levels == level, depth_image, 0)
+            if level_depth.any():
+                block_keys = volume._get_band_block_keys(level_depth, camera_intrinsics, camera_pose)
+                for cell in self._get_cell_keys(block_keys, level).tolist():
+                    requests.setdefault(cell, level)
+        for cell, level in requests.items():
+            current = self._cell_levels.get(cell)
+            if current is None:
+                self._cell_levels[cell] = level
+            elif level < current:
+                self._refine_cell(cell, current, level)
+
+        # the pixels of a level can fall in cells stored at any finer level
+        for level, volume in enumerate(self._levels):
+            level_depth = np.where(pixel_levels >= level, depth_image, 0)
+            if not level_depth.any():
+                continue
+            block_keys = volume._get_band_block_keys(level_depth, camera_intrinsics, camera_pose)
+            cells = self._get_cell_keys(block_keys, level, unique=False)
+            keep = np.array([self._cell_levels.get(cell) == level for cell in cells.tolist()], dtype=bool)
+            volume._integrate_blocks(block_keys[keep], color_image, depth_image, camera_intrinsics, camera_pose,
+                                     observation_weight)
+
+    def _get_cell_keys(self, block_keys, level, unique=True):
+        """Get the cells the blocks of a level fall in.
+
+        Args:
+            block_keys (numpy.array [n, ]): packed block coordinates at the level.
+            level (int): level of the blocks.
+            unique (bool, optional): sort and deduplicate the cells. Defaults to True.
+
+        Returns:
+            numpy.array: packed cell coordinates, one per block unless unique is True.
+        """
+        cell_keys = pack_block_keys(unpack_block_keys(block_keys) >> (len(self._levels) - 1 - level))
+        return unique_indices(cell_keys) if unique else cell_keys
+
+    def _refine_cell(self, cell, current, level):
+        """Move the voxels of a cell to a finer level.
+
+        Every voxel of the finer level takes the weight and color of the nearest voxel of
+        the same block of the current level, and its tsdf rescaled to the finer truncation
+        margin. The blocks of the current level are then freed.
+
+        Args:
+            cell (int): packed cell coordinates.
+            current (int): level the cell is stored at.
+            level (int): finer level to store the cell at.
+        """
+        coarse, fine = self._levels[current], self._levels[level]
+        b = self._block_size
+        ratio = 2 ** (current - level)
+        offsets = np.stack(np.meshgrid(*[np.arange(ratio)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+
+        # nearest voxel of the coarse block for every voxel of the fine blocks covering it
+        nearest = np.minimum(np.round(np.arange(b * ratio) / ratio), b - 1).astype(np.int64)
+        upsample = np.ix_(nearest, nearest, nearest)
+
+        span = 2 ** (len(self._levels) - 1 - current)
+        cell_coords = unpack_block_keys([cell])[0]
+        block_keys = pack_block_keys(cell_coords * span + np.stack(
+            np.meshgrid(*[np.arange(span)] * 3, indexing='ij'), axis=-1).reshape(-1, 3))
+        block_keys = [key for key in block_keys.tolist() if key in coarse._block_table]
+        for key in block_keys:
+            index = coarse._block_table[key]
+            tsdf_block = np.clip(coarse._tsdf_blocks[index][upsample] * ratio, -1, 1)
+            weight_block = coarse._weight_blocks[index][upsample]
+            color_block = coarse._color_blocks[index][upsample]
+
+            fine_coords = unpack_block_keys([key])[0] * ratio + offsets
+            fine_indices = fine._allocate_blocks(pack_block_keys(fine_coords))
+            for (x, y, z), fine_index in zip(offsets * b, fine_indices):
+                fine._tsdf_blocks[fine_index] = tsdf_block[x:x + b, y:y + b, z:z + b]
+                fine._weight_blocks[fine_index] = weight_block[x:x + b, y:y + b, z:z + b]
+                fine._color_blocks[fine_index] = color_block[x:x + b, y:y + b, z:z + b]
+
+        coarse._remove_blocks(np.array(block_keys, dtype=np.int64))
+        self._cell_levels[cell] = level
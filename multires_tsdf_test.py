@@ -0,0 +1,81 @@
+import unittest
+import numpy as np
+from multires_tsdf import *
+
+
+class TestMultiResolutionTSDFVolume(unittest.TestCase):
+    """Unit test multires_tsdf.py.
+    """
+
+    def setUp(self):
+        # a 64x48 camera looking down +z at a plane 0.5m away on the left and 1.5m away on the right
+        self.camera_intrinsics = np.array([[60., 0., 32.],
+                                           [0., 60., 24.],
+                                           [0., 0., 1.]])
+        self.depth_image = np.full((48, 64), 0.5)
+        self.depth_image[:, 32:] = 1.5
+        self.color_image = np.full((48, 64, 3), 120, dtype=np.uint8)
+        self.camera_pose = np.eye(4)
+        self.camera_pose[:3, 3] = [0.013, -0.021, 0.004]
+
+    def test_get_pixel_levels(self):
+        """Test MultiResolutionTSDFVolume.get_pixel_levels.
+        """
+        volume = MultiResolutionTSDFVolume(0.02, level_count=3, level_distance=1.)
+        levels = volume.get_pixel_levels(np.array([0., 0.5, 1., 1.9, 2., 3.9, 100.]))
+        self.assertTrue(np.array_equal(levels, [0, 0, 1, 1, 2, 2, 2]))
+
+    def test_integrate(self):
+        """Test MultiResolutionTSDFVolume.integrate stores near and far surfaces at their own level.
+        """
+        volume = MultiResolutionTSDFVolume(0.02, level_count=2, level_distance=1., block_size=4, initial_capacity=2)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+        fine, coarse = volume._levels
+        self.assertGreater(fine.get_block_count(), 0)
+        self.assertGreater(coarse.get_block_count(), 0)
+
+        # every block belongs to a cell stored at its level, near blocks are fine and far ones coarse
+        for level, level_volume in enumerate(volume._levels):
+            block_coords = level_volume._block_coords[:level_volume.get_block_count()]
+            cells = volume._get_cell_keys(pack_block_keys(block_coords), level, unique=False)
+            self.assertTrue(all(volume._cell_levels[cell] == level for cell in cells.tolist()))
+            block_z = (block_coords[:, 2] + 0.5) * 4 * 0.02 * 2 ** level
+            self.assertTrue((np.abs(block_z - [0.5, 1.5][level]) < 0.2).all())
+
+        points, triangles, normals, colors = volume.get_mesh()
+        self.assertGreater(len(triangles), 0)
+        self.assertTrue((np.abs(points[:, 2] - 0.5) < 0.02).any())
+        self.assertTrue((np.abs(points[:, 2] - 1.5) < 0.04).any())
+        self.assertTrue((colors == 120).all())
+
+    def test_refine(self):
+        """Test MultiResolutionTSDFVolume.integrate moves cells to a finer level when the camera gets closer.
+        """
+        volume = MultiResolutionTSDFVolume(0.02, level_count=2, level_distance=1., block_size=4)
+        depth_image = np.full((48, 64), 1.5)
+        volume.integrate(self.color_image, depth_image, self.camera_intrinsics, self.camera_pose)
+        self.assertEqual(volume.get_block_counts()[0], 0)
+        coarse_points = volume.get_mesh()[0]
+
+        # the same plane seen from 1m closer is fused into the finest level
+        camera_pose = self.camera_pose.copy()
+        camera_pose[2, 3] += 1.
+        volume.integrate(self.color_image, depth_image - 1., self.camera_intrinsics, camera_pose)
+        self.assertGreater(volume.get_block_counts()[0], 0)
+        self.assertEqual(min(volume._cell_levels.values()), 0)
+
+        # cells keep a single level, and the refined surface is still the plane
+        fine, coarse = volume._levels
+        fine_cells = set(volume._get_cell_keys(pack_block_keys(fine._block_coords[:fine.get_block_count()]), 0).tolist())
+        coarse_cells = set(volume._get_cell_keys(pack_block_keys(coarse._block_coords[:coarse.get_block_count()]),
+                                                 1).tolist())
+        self.assertFalse(fine_cells & coarse_cells)
+        for key, index in coarse._block_table.items():
+            self.assertEqual(int(pack_block_keys(coarse._block_coords[index:index + 1])[0]), key)
+        points = volume.get_mesh()[0]
+        self.assertTrue(np.allclose(points[:, 2], 1.5, atol=0.04))
+        self.assertGreater(len(points), len(coarse_points))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,234 @@
 import numpy as np
 import os
 
+def write_ascii_rows(f, row_format, records, chunk_size=65536):
+    """Write structured records as text, formatting a chunk of rows at a time.
+
+    Args:
+        f (file): binary file to write to.
+        row_format (str): printf style format of one row, including the newline.
+        records (numpy.array [n, ]): structured array, one record per row.
+        chunk_size (int, optional): number of rows formatted at once. Defaults to 65536.
+    """
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        values = np.concatenate([
+            chunk[name].reshape(len(chunk), -1).astype(np.float64) for name in records.dtype.names], axis=1)
+        f.write(((row_format * len(chunk)) % tuple(values.ravel().tolist())).encode('ascii'))
+
+
+# ply scalar types and their numpy equivalents (without byte order)
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+# byte order prefix of the binary ply formats
+PLY_FORMATS = {'ascii': '', 'binary_little_endian': '<', 'binary_big_endian': '>'}
+
+
+def read_header(f):
+    """Parse the header of a ply file.
+
+    Args:
+        f (file): binary file positioned at the start of the ply.
+
+    Raises:
+        ValueError: If the header is malformed or uses an unsupported format or type.
+
+    Returns:
+        str: 'ascii', 'binary_little_endian' or 'binary_big_endian'.
+        list: (name, count, properties) tuple per element, in file order. Each property is
+            (name, dtype, None) for a scalar or (name, item dtype, count dtype) for a list.
+    """
+    if f.readline().strip() != b'ply':
+        raise ValueError('Invalid ply header')
+
+    file_format = None
+    elements = []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError('Invalid ply header')
+        tokens = line.decode('ascii').split()
+        if len(tokens) == 0 or tokens[0] in ('comment', 'obj_info'):
+            continue
+        if tokens[0] == 'end_header':
+            break
+        if tokens[0] == 'format':
+            if len(tokens) != 3 or tokens[1] not in PLY_FORMATS:
+                raise ValueError('Invalid file format')
+            file_format = tokens[1]
+        elif tokens[0] == 'element' and len(tokens) == 3:
+            elements.append((tokens[1], int(tokens[2]), []))
+        elif tokens[0] == 'property' and len(elements) > 0:
+            if tokens[1] == 'list' and len(tokens) == 5 and tokens[2] in PLY_TYPES and tokens[3] in PLY_TYPES:
+                elements[-1][2].append((tokens[4], PLY_TYPES[tokens[3]], PLY_TYPES[tokens[2]]))
+            elif len(tokens) == 3 and tokens[1] in PLY_TYPES:
+                elements[-1][2].append((tokens[2], PLY_TYPES[tokens[1]], None))
+            else:
+                raise ValueError('Invalid property ' + ' '.join(tokens[1:]))
+        else:
+            raise ValueError('Invalid ply header')
+
+    if file_format is None:
+        raise ValueError('Invalid file format')
+    return file_format, elements
+
+
+def read_ascii_element(values, offset, count, properties):
+    """Read an element from the numbers of an ascii ply body.
+
+    Rows are reshaped in bulk when every list of the element has the same length as in
+    its first row, which covers the common triangle meshes; otherwise rows are walked
+    one at a time.
+
+    Args:
+        values (numpy.array [m, ]): every number of the body, in file order.
+        offset (int): index in values of the first number of the element.
+        count (int): number of rows of the element.
+        properties (list): properties of the element as returned by read_header.
+
+    Raises:
+        ValueError: If the body ends before the element does.
+
+    Returns:
+        dict: property name to numpy.array [count, ] for scalars and numpy.array [count, l]
+            for lists of length l, or a list of count arrays when list lengths vary.
+        int: index in values just past the element.
+    """
+    if count == 0:
+        return {name: np.empty((0,) if count_dtype is None else (0, 0), dtype=dtype)
+                for name, dtype, count_dtype in properties}, offset
+
+    # row layout assuming every row matches the first one
+    columns = []
+    width = 0
+    for name, dtype, count_dtype in properties:
+        if count_dtype is None:
+            columns.append((name, width, None))
+            width += 1
+        else:
+            if offset + width >= len(values):
+                break
+            length = int(values[offset + width])
+            columns.append((name, width + 1, length))
+            width += 1 + length
+
+    if len(columns) == len(properties):
+        rows = values[offset:offset + count * width]
+        if len(rows) == count * width:
+            rows = rows.reshape(count, width)
+            if all(length is None or (rows[:, column - 1] == length).all() for _, column, length in columns):
+                element = {}
+                for (name, column, length), (_, dtype, _) in zip(columns, properties):
+                    if length is None:
+                        element[name] = rows[:, column].astype(dtype)
+                    else:
+                        element[name] = rows[:, column:column + length].astype(dtype)
+                return element, offset + count * width
+
+    # list lengths vary from row to row
+    element = {name: [] for name, _, _ in properties}
+    for _ in range(count):
+        for name, dtype, count_dtype in properties:
+            if count_dtype is None:
+                if offset >= len(values):
+                    raise ValueError('Invalid ply body')
+                element[name].append(values[offset])
+                offset += 1
+            else:
+                if offset >= len(values):
+                    raise ValueError('Invalid ply body')
+                length = int(values[offset])
+                if offset + 1 + length > len(values):
+                    raise ValueError('Invalid ply body')
+                element[name].append(values[offset + 1:offset + 1 + length].astype(dtype))
+                offset += 1 + length
+    for name, dtype, count_dtype in properties:
+        if count_dtype is None:
+            element[name] = np.array(element[name], dtype=dtype)
+    return element, offset
+
+
+def read_binary_element(data, offset, count, properties, byte_order):
+    """Read an element from the bytes of a binary ply body.
+
+    Rows are viewed in bulk through a structured dtype when every list of the element has
+    the same length as in its first row; otherwise rows are walked one at a time.
+
+    Args:
+        data (bytes): body of the ply.
+        offset (int): byte offset of the first row of the element.
+        count (int): number of rows of the element.
+        properties (list): properties of the element as returned by read_header.
+        byte_order (str): '<' or '>'.
+
+    Raises:
+        ValueError: If the body ends before the element does.
+
+    Returns:
+        dict: property name to numpy.array [count, ] for scalars and numpy.array [count, l]
+            for lists of length l, or a list of count arrays when list lengths vary.
+        int: byte offset just past the element.
+    """
+    if count == 0:
+        return {name: np.empty((0,) if count_dtype is None else (0, 0), dtype=dtype)
+                for name, dtype, count_dtype in properties}, offset
+
+    def read_scalar(dtype, position):
+        size = np.dtype(dtype).itemsize
+        if position + size > len(data):
+            raise ValueError('Invalid ply body')
+        return np.frombuffer(data, dtype=byte_order + dtype, count=1, offset=position)[0], position + size
+
+    # structured dtype of a row, taking list lengths from the first row
+    fields = []
+    position = offset
+    for index, (name, dtype, count_dtype) in enumerate(properties):
+        if count_dtype is None:
+            fields.append((name, byte_order + dtype))
+            position += np.dtype(dtype).itemsize
+        else:
+            length, position = read_scalar(count_dtype, position)
+            length = int(length)
+            position += length * np.dtype(dtype).itemsize
+            fields.append(('count%d' % index, byte_order + count_dtype))
+            fields.append((name, byte_order + dtype, (length,)))
+    row_dtype = np.dtype(fields)
+
+    if offset + count * row_dtype.itemsize <= len(data):
+        rows = np.frombuffer(data, dtype=row_dtype, count=count, offset=offset)
+        lengths = [(('count%d' % index), row_dtype[name].shape[0])
+                   for index, (name, _, count_dtype) in enumerate(properties) if count_dtype is not None]
+        if all((rows[field] == length).all() for field, length in lengths):
+            element = {name: rows[name].astype(dtype) for name, dtype, _ in properties}
+            return element, offset + count * row_dtype.itemsize
+
+    # list lengths vary from row to row
+    element = {name: [] for name, _, _ in properties}
+    position = offset
+    for _ in range(count):
+        for name, dtype, count_dtype in properties:
+            if count_dtype is None:
+                value, position = read_scalar(dtype, position)
+                element[name].append(value)
+            else:
+                length, position = read_scalar(count_dtype, position)
+                size = int(length) * np.dtype(dtype).itemsize
+                if position + size > len(data):
+                    raise ValueError('Invalid ply body')
+                element[name].append(np.frombuffer(data, dtype=byte_order + dtype, count=int(length),
+                                                   offset=position).astype(dtype))
+                position += size
+    for name, dtype, count_dtype in properties:
+        if count_dtype is None:
+            element[name] = np.array(element[name], dtype=dtype)
+    return element, position
+
+
 class Ply(object):
     """Class to represent a ply in memory, read plys, and write plys.
     """
@@ -9,8 +237,8 @@ class Ply(object):
         """Initialize the in memory ply representation.
 
         Args:
-            ply_path (str, optional): Path to .ply file to read (note only
-                supports text mode, not binary mode). Defaults to None.
+            ply_path (str, optional): Path to .ply file to read, in ascii or binary
+                mode. Defaults to None.
             triangles (numpy.array [k, 3], optional): each row is a list of point indices used to
                 render triangles. Defaults to None.
             points (numpy.array [n, 3], optional): each row represents a 3D point. Defaults to None.
@@ -70,24 +298,31 @@ class Ply(object):
           self.read(self.ply_path)
           
 
-    def write(self, ply_path):
+    def write(self, ply_path, file_format='ascii'):
         """Write mesh, point cloud, or oriented point cloud to ply file.
 
         Args:
             ply_path (str): Output ply path.
+            file_format (str, optional): 'ascii' or 'binary_little_endian'. Defaults to 'ascii'.
+
+        Raises:
+            NameError: If the directory of ply_path does not exist.
+            ValueError: If file_format is not supported.
         """
         # TODO:(DONE) Write header depending on existance of normals, colors, and triangles.
         # TODO:(DONE) Write points.
         # TODO:(DONE) Write normals if they exist.
         # TODO:(DONE) Write colors if they exist.
         # TODO:(DONE) Write face list if needed.
-        
-        if os.path.isfile(ply_path)== False:
+
+        if not os.path.isdir(os.path.dirname(ply_path) or '.'):
           raise NameError('Invalid path')
-          
+        if file_format not in ('ascii', 'binary_little_endian'):
+          raise ValueError('Invalid file format')
+
         self.ply_path=ply_path
 
-        header='ply\nformat ascii 1.0\nelement vertex ' + str(self.points.shape[0]) +'\nproperty float x\nproperty float y\nproperty float z\n'
+        header='ply\nformat ' + file_format + ' 1.0\nelement vertex ' + str(self.points.shape[0]) +'\nproperty float x\nproperty float y\nproperty float z\n'
 
         normals='property float nx\nproperty float ny\nproperty float nz\n'
 
@@ -105,46 +340,53 @@ class Ply(object):
         else:
           header=header+'end_header\n'
 
-        array=''
+        # One structured record per vertex and per face, in the order of the header
+        vertex_fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+        if self.normals is not None:
+          vertex_fields += [('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')]
+        if self.colors is not None:
+          vertex_fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
 
-        #Points
-        if self.normals is None and self.colors is None:
-          for i in range(self.points.shape[0]):
-            array= array+' '.join(map(str, self.points[i, :]))+'\n'
-
-        #Points and normals
-        if self.normals is not None and self.colors is None:
-          for i in range(self.points.shape[0]):
-            array= array+' '.join(map(str, self.points[i, :]))+ ' '+ ' '.join(map(str, self.normals[i, :]))+'\n'
-
-        #Points and colors
-        if self.normals is None and self.colors is not None:
-          for i in range(self.points.shape[0]):
-            array= array+' '.join(map(str, self.points[i, :]))+' '+ ' '.join(map(str, self.colors[i, :]))+'\n'
-
-        #Points and normals and colors
-        if self.normals is not None and self.colors is not None:
-          for i in range(self.points.shape[0]):
-            array= array+' '.join(map(str, self.points[i, :]))+' '+ ' '.join(map(str, self.normals[i, :]))+' '+' '.join(map(str, self.colors[i, :]))+'\n'
-        
-        header=header+array
+        vertices = np.empty(self.points.shape[0], dtype=vertex_fields)
+        vertices['x'], vertices['y'], vertices['z'] = np.asarray(self.points).T
+        if self.normals is not None:
+          vertices['nx'], vertices['ny'], vertices['nz'] = np.asarray(self.normals).T
+        if self.colors is not None:
+          vertices['red'], vertices['green'], vertices['blue'] = np.asarray(self.colors).T
 
-        #triangles
         if self.triangles is not None:
-          for i in range(self.triangles.shape[0]):
-            trianglesarray='3 '
-            trianglesarray=trianglesarray+' '.join(map(str, self.triangles[i, :]))+'\n'
-            header=header+trianglesarray
+          faces = np.empty(self.triangles.shape[0], dtype=[('count', 'u1'), ('vertex_index', '<i4', (3,))])
+          faces['count'] = 3
+          faces['vertex_index'] = self.triangles
 
-        self.ply_path=ply_path
-        with open(self.ply_path, 'w') as f:
-          f.write(header)
+        with open(self.ply_path, 'wb') as f:
+          f.write(header.encode('ascii'))
+
+          if file_format == 'binary_little_endian':
+            vertices.tofile(f)
+            if self.triangles is not None:
+              faces.tofile(f)
+            return
+
+          # floats with enough digits to round trip float32, colors as integers
+          row_format = ' '.join('%d' if dtype == 'u1' else '%.9g' for _, dtype in vertex_fields) + '\n'
+          write_ascii_rows(f, row_format, vertices)
+          if self.triangles is not None:
+            write_ascii_rows(f, '%d %d %d %d\n', faces)
 
     def read(self, ply_path):
         """Read a ply into memory.
 
+        Supports ascii, binary_little_endian and binary_big_endian files with vertex
+        properties in any order. Bodies are loaded in bulk, falling back to reading row by
+        row only for faces whose lists vary in length.
+
         Args:
             ply_path (str): ply to read in.
+
+        Raises:
+            NameError: If ply_path is not a file.
+            ValueError: If the ply is malformed or does not have x, y and z vertex properties.
         """
         # TODO:(DONE) Read in ply.
         
@@ -152,92 +394,51 @@ class Ply(object):
           raise NameError('Invalid path')
         
         self.ply_path=ply_path
-        myfile= []
-        with open(self.ply_path) as f:
-          for line in f:
-            myfile.append(line.strip())
-
-        #Number of points
-        n=[int(s) for s in myfile[[myfile.index(i) for i in myfile if('element vertex' in i)][0]].split() if s.isdigit()][0]
-
-        #End Header
-        end_header_index=[myfile.index(i) for i in myfile if(i=='end_header')][0]+1
+        with open(self.ply_path, 'rb') as f:
+          file_format, elements = read_header(f)
+          data = f.read()
+
+        # Read every element, in file order
+        contents = {}
+        if file_format == 'ascii':
+          values = np.fromstring(data.decode('ascii'), sep=' ')
+          offset = 0
+          for name, count, properties in elements:
+            contents[name], offset = read_ascii_element(values, offset, count, properties)
+          if offset != len(values):
+            raise ValueError('Invalid ply body')
+        else:
+          offset = 0
+          for name, count, properties in elements:
+            contents[name], offset = read_binary_element(data, offset, count, properties, PLY_FORMATS[file_format])
 
-        #String with points,normals,colors
-        spnc=myfile[end_header_index:end_header_index+n]
+        #Points
+        vertex = contents.get('vertex', {})
+        if not all(name in vertex for name in ('x', 'y', 'z')):
+          raise ValueError('All 3 dimensions of point not provided')
+        self.points = np.stack([vertex['x'], vertex['y'], vertex['z']], axis=1).astype(np.float64)
+
+        #Normals
+        self.normals = None
+        if all(name in vertex for name in ('nx', 'ny', 'nz')):
+          self.normals = np.stack([vertex['nx'], vertex['ny'], vertex['nz']], axis=1).astype(np.float64)
+
+        #Colors
+        self.colors = None
+        for names in (('red', 'green', 'blue'), ('r', 'g', 'b'), ('diffuse_red', 'diffuse_green', 'diffuse_blue')):
+          if all(name in vertex for name in names):
+            self.colors = np.stack([vertex[name] for name in names], axis=1).astype(np.ubyte)
+            break
 
         #Triangles
-        if len([myfile.index(i) for i in myfile if('element face' in i)])==1:
-          
-          #Number of triangles
-          k=[int(s) for s in myfile[[myfile.index(i) for i in myfile if('element face' in i)][0]].split() if s.isdigit()][0]
-
-          #String with triangles
-          st=myfile[end_header_index+n:end_header_index+n+k]
-
-          self.triangles = np.empty(shape=[0, 3], dtype=np.intc)
-          for row in st:
-            splitrow= row.split()
-            if len(splitrow)!=4:
+        self.triangles = None
+        face = contents.get('face', {})
+        for name in ('vertex_index', 'vertex_indices'):
+          if name in face:
+            triangles = face[name]
+            if len(triangles) == 0:
+              triangles = np.empty((0, 3))
+            if isinstance(triangles, list) or triangles.shape[1] != 3:
               raise ValueError('Triangle is not correct dimension')
-            
-            self.triangles = np.append(self.triangles,[[int(splitrow[1]), int(splitrow[2]), int(splitrow[3])]] , axis=0)
-
-        #Points
-        if len([myfile.index(i) for i in myfile if('property float' in i)])==3:
-          self.points = np.empty(shape=[0, 3])
-          for row in spnc:
-            splitrow= row.split()
-            
-            if len(splitrow)!=3:
-              raise ValueError('All 3 dimensions of point not provided')
-            
-            self.points = np.append(self.points,[[float(splitrow[0]), float(splitrow[1]), float(splitrow[2])]] , axis=0)
-        
-        #Points and normals and NO colors
-        if len([myfile.index(i) for i in myfile if('property float' in i)])==6 and len([myfile.index(i) for i in myfile if('property uchar' in i)])==0:
-          self.points = np.empty(shape=[0, 3])
-          self.normals = np.empty(shape=[0, 3])
-          for row in spnc:
-            splitrow= row.split()
-            
-            if len(splitrow)!=6:
-              raise ValueError('Points and Normals are not equal')
-            
-            self.points = np.append(self.points,[[float(splitrow[0]), float(splitrow[1]), float(splitrow[2])]] , axis=0)
-
-            self.normals = np.append(self.normals,[[float(splitrow[3]), float(splitrow[4]), float(splitrow[5])]] , axis=0)
-
-
-        #Points and colors and normals
-        if len([myfile.index(i) for i in myfile if('property float' in i)])==6 and len([myfile.index(i) for i in myfile if('property uchar' in i)])==3:
-          self.points = np.empty(shape=[0, 3])
-          self.normals = np.empty(shape=[0, 3])
-          self.colors = np.empty(shape=[0, 3], dtype=np.ubyte)
-          
-          for row in spnc:
-            splitrow= row.split()
-
-            if len(splitrow)!=9:
-              raise ValueError('Points and Colors and Normals are not equal')
-            
-            self.points = np.append(self.points,[[float(splitrow[0]), float(splitrow[1]), float(splitrow[2])]] , axis=0)
-
-            self.normals = np.append(self.normals,[[float(splitrow[3]), float(splitrow[4]), float(splitrow[5])]] , axis=0)
-
-            self.colors= np.append(self.colors,[[int(splitrow[6]), int(splitrow[7]), int(splitrow[8])]] , axis=0)
-
-
-        #Points and colors
-        if (len([myfile.index(i) for i in myfile if('property float' in i)])+len([myfile.index(i) for i in myfile if('property uchar' in i)]))==6:
-          self.points = np.empty(shape=[0, 3])
-          self.colors = np.empty(shape=[0, 3], dtype=np.ubyte)
-          for row in spnc:
-            splitrow= row.split()
-
-            if len(splitrow)!=6:
-              raise ValueError('Points and Colors are not equal')
-
-            self.points = np.append(self.points,[[float(splitrow[0]), float(splitrow[1]), float(splitrow[2])]] , axis=0)
-
-            self.colors = np.append(self.colors,[[float(splitrow[3]), float(splitrow[4]), float(splitrow[5])]] , axis=0)
+            self.triangles = triangles.astype(np.intc)
+            break
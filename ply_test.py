@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from ply import *
+
+class TestPly(unittest.TestCase):
+    """Unit test ply.py.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        np.random.seed(8)
+        self.points = np.random.uniform(-1, 1, (50, 3)).astype(np.float32)
+        self.normals = np.random.uniform(-1, 1, (50, 3)).astype(np.float32)
+        self.colors = np.random.randint(0, 256, (50, 3)).astype(np.uint8)
+        self.triangles = np.random.randint(0, 50, (20, 3))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_ascii(self):
+        """Test Ply.write in ascii format.
+        """
+        ply_path = os.path.join(self.directory, 'mesh.ply')
+        Ply(triangles=self.triangles, points=self.points, normals=self.normals, colors=self.colors).write(ply_path)
+
+        with open(ply_path) as f:
+            lines = f.read().splitlines()
+        body = lines[lines.index('end_header') + 1:]
+        self.assertEqual(lines[1], 'format ascii 1.0')
+        self.assertEqual(len(body), 70)
+
+        vertices = np.array([line.split() for line in body[:50]], dtype=np.float64)
+        self.assertTrue(np.array_equal(vertices[:, :3].astype(np.float32), self.points))
+        self.assertTrue(np.array_equal(vertices[:, 3:6].astype(np.float32), self.normals))
+        self.assertTrue(np.array_equal(vertices[:, 6:], self.colors))
+        faces = np.array([line.split() for line in body[50:]], dtype=np.int64)
+        self.assertTrue(np.array_equal(faces, np.hstack([np.full((20, 1), 3), self.triangles])))
+
+    def test_write_binary(self):
+        """Test Ply.write in binary_little_endian format.
+        """
+        ply_path = os.path.join(self.directory, 'points.ply')
+        Ply(points=self.points, colors=self.colors).write(ply_path, file_format='binary_little_endian')
+
+        with open(ply_path, 'rb') as f:
+            data = f.read()
+        header, body = data.split(b'end_header\n')
+        self.assertIn(b'format binary_little_endian 1.0\n', header)
+
+        vertices = np.frombuffer(body, dtype=[('point', '<f4', (3,)), ('color', 'u1', (3,))])
+        self.assertTrue(np.array_equal(vertices['point'], self.points))
+        self.assertTrue(np.array_equal(vertices['color'], self.colors))
+
+    def test_read(self):
+        """Test Ply.read round trips Ply.write in ascii and binary format.
+        """
+        for file_format in ('ascii', 'binary_little_endian'):
+            ply_path = os.path.join(self.directory, file_format + '.ply')
+            Ply(triangles=self.triangles, points=self.points, normals=self.normals, colors=self.colors).write(
+                ply_path, file_format=file_format)
+
+            ply = Ply(ply_path)
+            self.assertTrue(np.array_equal(ply.points, self.points))
+            self.assertTrue(np.array_equal(ply.normals, self.normals))
+            self.assertTrue(np.array_equal(ply.colors, self.colors))
+            self.assertTrue(np.array_equal(ply.triangles, self.triangles))
+            self.assertEqual(ply.points.dtype, np.float64)
+            self.assertEqual(ply.colors.dtype, np.uint8)
+            self.assertEqual(ply.triangles.dtype, np.intc)
+
+    def test_read_property_order(self):
+        """Test Ply.read with reordered properties, extra elements and big endian data.
+        """
+        header = ('ply\nformat {} 1.0\ncomment reordered\nelement vertex 2\nproperty uchar blue\n'
+                  'property double z\nproperty float x\nproperty float y\nproperty uchar red\n'
+                  'property uchar green\nelement face 1\nproperty uchar flags\n'
+                  'property list uchar uint vertex_indices\nelement edge 1\nproperty int vertex1\n'
+                  'property int vertex2\nend_header\n')
+        ascii_path = os.path.join(self.directory, 'ascii.ply')
+        with open(ascii_path, 'w') as f:
+            f.write(header.format('ascii') + '3 0.5 1 2 1 2\n6 -1.5 4 5 4 5\n7 3 0 1 1\n0 1\n')
+
+        binary_path = os.path.join(self.directory, 'binary.ply')
+        vertices = np.array([(3, 0.5, 1, 2, 1, 2), (6, -1.5, 4, 5, 4, 5)], dtype=[
+            ('blue', 'u1'), ('z', '>f8'), ('x', '>f4'), ('y', '>f4'), ('red', 'u1'), ('green', 'u1')])
+        faces = np.array([(7, 3, (0, 1, 1))], dtype=[('flags', 'u1'), ('count', 'u1'), ('vertex_indices', '>u4', (3,))])
+        with open(binary_path, 'wb') as f:
+            f.write(header.format('binary_big_endian').encode('ascii'))
+            f.write(vertices.tobytes() + faces.tobytes() + np.array([0, 1], dtype='>i4').tobytes())
+
+        for ply_path in (ascii_path, binary_path):
+            ply = Ply(ply_path)
+            self.assertTrue(np.array_equal(ply.points, [[1, 2, 0.5], [4, 5, -1.5]]))
+            self.assertTrue(np.array_equal(ply.colors, [[1, 2, 3], [4, 5, 6]]))
+            self.assertTrue(np.array_equal(ply.triangles, [[0, 1, 1]]))
+            self.assertIsNone(ply.normals)
+
+    def test_read_invalid(self):
+        """Test Ply.read with faces that are not triangles and truncated bodies.
+        """
+        ply_path = os.path.join(self.directory, 'quads.ply')
+        header = ('ply\nformat ascii 1.0\nelement vertex 4\nproperty float x\nproperty float y\n'
+                  'property float z\nelement face 2\nproperty list uchar int vertex_index\nend_header\n')
+        with open(ply_path, 'w') as f:
+            f.write(header + '0 0 0\n1 0 0\n1 1 0\n0 1 0\n3 0 1 2\n4 0 1 2 3\n')
+        with self.assertRaises(ValueError):
+            Ply(ply_path)
+
+        with open(ply_path, 'w') as f:
+            f.write(header + '0 0 0\n1 0 0\n1 1 0\n0 1 0\n3 0 1 2\n')
+        with self.assertRaises(ValueError):
+            Ply(ply_path)
+
+    def test_write_invalid(self):
+        """Test Ply.write with invalid arguments.
+        """
+        ply = Ply(points=self.points)
+        with self.assertRaises(NameError):
+            ply.write(os.path.join(self.directory, 'missing', 'points.ply'))
+        with self.assertRaises(ValueError):
+            ply.write(os.path.join(self.directory, 'points.ply'), file_format='binary_big_endian')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,306 @@
+from tsdf import *
+
+
+@njit(parallel=True, cache=True)
+def integrate_window_kernel(tsdf_volume, weight_volume, color_volume, voxel_min, voxel_max, voxel_size,
+                            truncation_margin, color_image, depth_image, intrinsics, world_to_camera,
+                            observation_weight, tsdf_scale, max_weight):
+    """Fuse one RGB-D observation into a circularly addressed window of voxels.
+
+    Voxel x, y, z of the world grid, located at (x, y, z) * voxel_size, is stored at
+    index (x, y, z) modulo the shape of the volumes.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf values, updated in place.
+        weight_volume (numpy.array [l, w, h]): accumulated weights, updated in place.
+        color_volume (numpy.array [l, w, h, 3]): rgb colors, updated in place.
+        voxel_min (numpy.array [3, ]): first world grid index to visit along x, y and z.
+        voxel_max (numpy.array [3, ]): one past the last world grid index to visit along x, y and z.
+        voxel_size (float): The side length of each voxel in meters.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+        color_image (numpy.array [h, w, 3]): An rgb image.
+        depth_image (numpy.array [h, w]): A z depth image.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        world_to_camera (numpy.array [4, 4]): SE3 transform from world to camera coordinates.
+        observation_weight (float): Weight to give the observation.
+        tsdf_scale (float): value a stored tsdf of 1 is represented by.
+        max_weight (float): largest weight that can be stored.
+    """
+    max_depth = depth_image.max()
+    size_x, size_y, size_z = tsdf_volume.shape
+    for x in prange(voxel_min[0], voxel_max[0]):
+        world_x = x * voxel_size
+        for y in range(voxel_min[1], voxel_max[1]):
+            world_y = y * voxel_size
+            for z in range(voxel_min[2], voxel_max[2]):
+                world_z = z * voxel_size
+                u, v, margin_distance = project_voxel(
+                    world_x, world_y, world_z, world_to_camera, intrinsics, depth_image, truncation_margin, max_depth)
+                if u < 0:
+                    continue
+                update_voxel(tsdf_volume, weight_volume, color_volume, (x % size_x, y % size_y, z % size_z),
+                             color_image, u, v, margin_distance, observation_weight, tsdf_scale, max_weight)
+
+
+class ScrollingTSDFVolume:
+    """Volumetric TSDF Fusion of RGB-D Images into a fixed size window that follows the camera.
+
+    The window is a dense grid of window_size voxels aligned to a world grid of spacing
+    voxel_size with a voxel at the world origin. It is stored with circular addressing,
+    world grid voxel (x, y, z) lives at (x, y, z) modulo window_size, so moving the window
+    by whole voxels only clears the slabs it leaves behind instead of copying the grid.
+    Memory and the per frame cost do not depend on how far the camera travels.
+    """
+
+    def __init__(self, window_size, voxel_size, center=(0., 0., 0.), look_ahead=0., shift_threshold=None,
+                 evict_callback=None, evict_directory=None, tsdf_dtype=np.float32, weight_dtype=np.float32,
+                 color_dtype=np.float32):
+        """Initialize scrolling tsdf volume instance variables.
+
+        Args:
+            window_size (int or numpy.array [3, ]): number of voxels of the window along x, y and z.
+            voxel_size (float): The side length of each voxel in meters.
+            center (numpy.array [3, ], optional): world coordinates of the initial window center.
+                Defaults to the world origin.
+            look_ahead (float, optional): integrate centers the window this far (in meters) in
+                front of the camera along its optical axis. Defaults to 0.
+            shift_threshold (int or numpy.array [3, ], optional): number of voxels the window
+                center may lag behind before integrate moves it along an axis, which batches
+                small motions into fewer, larger shifts. Defaults to None, meaning an eighth of
+                the window size.
+            evict_callback (callable, optional): called as evict_callback(voxel_min, tsdf, weight,
+                color) with the world grid index of the first voxel and the values of every slab
+                of voxels that leaves the window and holds an observation. Defaults to None.
+            evict_directory (str, optional): directory every evicted slab holding an observation
+                is saved to, as n_x_y_z.npz where n counts the saved slabs and x, y, z is the
+                world grid index of the first voxel. Created if it does not exist. Defaults to None.
+            tsdf_dtype (numpy.dtype, optional): storage type of the tsdf values, see TSDFVolume.
+                Defaults to float32.
+            weight_dtype (numpy.dtype, optional): storage type of the weights, see TSDFVolume.
+                Defaults to float32.
+            color_dtype (numpy.dtype, optional): storage type of the colors, see TSDFVolume.
+                Defaults to float32.
+
+        Raises:
+            NameError: If evict_directory cannot be created.
+            ValueError: If window size or voxel size is not positive.
+            ValueError: If a storage type is not supported.
+        """
+        window_size = np.broadcast_to(np.asarray(window_size, dtype=np.int64), (3,)).copy()
+        if np.any(window_size <= 0):
+            raise ValueError('window size must be positive.')
+        if voxel_size <= 0.0:
+            raise ValueError('voxel size must be positive.')
+
+        tsdf_dtype, weight_dtype, color_dtype, tsdf_scale, max_weight = check_volume_dtypes(
+            tsdf_dtype, weight_dtype, color_dtype)
+
+        if evict_directory is not None:
+            try:
+                os.makedirs(evict_directory, exist_ok=True)
+            except OSError:
+                raise NameError('Invalid path')
+
+        self._window_size = window_size
+        self._voxel_size = float(voxel_size)
+        self._truncation_margin = 2 * self._voxel_size  # truncation on SDF (max alowable distance away from a surface)
+        self._look_ahead = float(look_ahead)
+        if shift_threshold is None:
+            shift_threshold = window_size // 8
+        self._shift_threshold = np.broadcast_to(np.asarray(shift_threshold, dtype=np.int64), (3,)).copy()
+        self._evict_callback = evict_callback
+        self._evict_directory = evict_directory
+        self._evict_count = 0  # slabs saved to evict_directory
+        self._tsdf_scale = tsdf_scale
+        self._max_weight = max_weight
+
+        # world grid index of the first voxel of the window
+        self._window_min = self._get_window_min(center)
+
+        shape = tuple(window_size)
+        self._tsdf_volume = np.full(shape, self._tsdf_scale, dtype=tsdf_dtype)
+        self._weight_volume = np.zeros(shape, dtype=weight_dtype)
+        self._color_volume = np.zeros(shape + (3,), dtype=color_dtype)  # rgb order
+
+    def get_volume_origin(self):
+        """Get the world coordinates of the first voxel of the window.
+
+        Returns:
+            numpy.array [3, ]: origin of the grids returned by get_volume in world coordinates.
+        """
+        return self._window_min * self._voxel_size
+
+    def get_volume(self):
+        """Get the tsdf, weight and color values of the window in world grid order.
+
+        The grids are copies, voxel (0, 0, 0) is located at get_volume_origin().
+
+        Returns:
+            numpy.array [l, w, h]: tsdf values decoded to float32.
+            numpy.array [l, w, h]: weights in their storage type.
+            numpy.array [l, w, h, 3]: rgb colors in their storage type.
+        """
+        region = self._get_storage_indices(self._window_min, self._window_min + self._window_size)
+        tsdf_volume = self._tsdf_volume[region].astype(np.float32)
+        if self._tsdf_scale != 1.0:
+            tsdf_volume /= np.float32(self._tsdf_scale)
+        return tsdf_volume, self._weight_volume[region], self._color_volume[region]
+
+    def get_mesh(self, min_weight=None):
+        """ Run marching cubes over the window to get a mesh representation.
+
+        Args:
+            min_weight (float, optional): only extract the cubes whose eight corners have a
+                weight greater than min_weight. Defaults to None, meaning every cube is
+                extracted.
+
+        Returns:
+            numpy.array [n, 3]: each row represents a 3D point.
+            numpy.array [k, 3]: each row is a list of point indices used to render triangles.
+            numpy.array [n, 3]: each row represents the normal vector for the corresponding 3D point.
+            numpy.array [n, 3]: each row represents the color of the corresponding 3D point.
+        """
+        tsdf_volume, weight_volume, color_volume = self.get_volume()
+        mask = None if min_weight is None else observed_cube_mask(weight_volume, min_weight)
+        voxel_points, triangles, normals = marching_cubes_block(tsdf_volume, mask)
+        if voxel_points is None:
+            return merge_meshes([])
+
+        # Get vertex colors.
+        points_ind = np.round(voxel_points).astype(int)
+        colors = np.floor(color_volume[points_ind[:, 0], points_ind[:, 1], points_ind[:, 2]]).astype(np.uint8)
+
+        points = TSDFVolume.voxel_to_world(self.get_volume_origin(), voxel_points, self._voxel_size)
+        return points, triangles, normals, colors
+
+    def recenter(self, center):
+        """Move the window so it is centered on a point, evicting the voxels it leaves.
+
+        Args:
+            center (numpy.array [3, ]): world coordinates of the new window center.
+        """
+        self._shift_to(self._get_window_min(center))
+
+    def integrate(self, color_image, depth_image, camera_intrinsics, camera_pose, observation_weight=1.):
+        """Integrate an RGB-D observation into the window, moving it along with the camera first.
+
+        Args:
+            color_image (numpy.array [h, w, 3]): An rgb image.
+            depth_image (numpy.array [h, w]): A z depth image.
+            camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+            camera_pose (numpy.array [4, 4] or Pose): SE3 transform representing pose (camera to world)
+            observation_weight (float, optional):  The weight to assign for the current
+                observation. Defaults to 1.
+
+        Raises:
+            ValueError: If camera_pose is not a valid transform.
+            ValueError: If observation_weight is not a whole number and the weights are
+                stored as integers.
+        """
+        if self._max_weight != np.inf and observation_weight != int(observation_weight):
+            raise ValueError('observation_weight must be a whole number with integer weights.')
+
+        camera_pose = Pose(camera_pose)
+        world_to_camera = camera_pose.inverse().matrix
+        camera_intrinsics = np.asarray(camera_intrinsics, dtype=np.float64)
+
+        # only move along the axes where the window lags too far behind the camera
+        window_min = self._get_window_min(camera_pose.translation + camera_pose.rotation[:, 2] * self._look_ahead)
+        lagging = np.abs(window_min - self._window_min) > self._shift_threshold
+        self._shift_to(np.where(lagging, window_min, self._window_min))
+
+        voxel_min, voxel_max = frustum_voxel_bounds(depth_image, camera_intrinsics, camera_pose,
+                                                    self.get_volume_origin(), self._voxel_size,
+                                                    self._window_size, self._truncation_margin)
+        if np.any(voxel_max <= voxel_min):
+            return
+
+        integrate_window_kernel(
+            self._tsdf_volume,
+            self._weight_volume,
+            self._color_volume,
+            voxel_min + self._window_min,
+            voxel_max + self._window_min,
+            self._voxel_size,
+            self._truncation_margin,
+            color_image,
+            depth_image,
+            camera_intrinsics,
+            world_to_camera,
+            float(observation_weight),
+            self._tsdf_scale,
+            self._max_weight)
+
+    def _get_window_min(self, center):
+        """Get the first world grid index of the window centered on a point.
+
+        Args:
+            center (numpy.array [3, ]): world coordinates of the window center.
+
+        Returns:
+            numpy.array [3, ]: world grid index of the first voxel of the window.
+        """
+        return np.round(np.asarray(center, dtype=np.float64) / self._voxel_size).astype(np.int64) - self._window_size // 2
+
+    def _get_storage_indices(self, voxel_min, voxel_max):
+        """Get the storage index of a box of world grid voxels inside the window.
+
+        Args:
+            voxel_min (numpy.array [3, ]): first world grid index along x, y and z.
+            voxel_max (numpy.array [3, ]): one past the last world grid index along x, y and z.
+
+        Returns:
+            tuple: open mesh index arrays (see numpy.ix_) into the voxel volumes.
+        """
+        return np.ix_(*[np.arange(lo, hi) % size for lo, hi, size in zip(voxel_min, voxel_max, self._window_size)])
+
+    def _shift_to(self, window_min):
+        """Move the window one axis at a time, evicting and clearing the slabs it leaves.
+
+        Args:
+            window_min (numpy.array [3, ]): world grid index of the new first voxel of the window.
+        """
+        for axis in range(3):
+            shift = window_min[axis] - self._window_min[axis]
+            if shift == 0:
+                continue
+
+            # the slab of voxels leaving the window, the whole window for a jump past its size
+            old_max = self._window_min + self._window_size
+            slab_min, slab_max = self._window_min.copy(), old_max.copy()
+            if shift > 0:
+                slab_max[axis] = min(old_max[axis], window_min[axis])
+            else:
+                slab_min[axis] = max(self._window_min[axis], window_min[axis] + self._window_size[axis])
+            region = self._get_storage_indices(slab_min, slab_max)
+            self._evict(slab_min, region)
+
+            self._tsdf_volume[region] = self._tsdf_scale
+            self._weight_volume[region] = 0
+            self._color_volume[region] = 0
+            self._window_min[axis] = window_min[axis]
+
+    def _evict(self, voxel_min, region):
+        """Hand a slab of voxels leaving the window to the callback and the evict directory.
+
+        Args:
+            voxel_min (numpy.array [3, ]): world grid index of the first voxel of the slab.
+            region (tuple): storage indices of the slab, see _get_storage_indices.
+        """
+        if self._evict_callback is None and self._evict_directory is None:
+            return
+        weight_slab = self._weight_volume[region]
+        if not weight_slab.any():
+            return
+
+        tsdf_slab = self._tsdf_volume[region].astype(np.float32)
+        if self._tsdf_scale != 1.0:
+            tsdf_slab /= np.float32(self._tsdf_scale)
+        color_slab = self._color_volume[region]
+        if self._evict_directory is not None:
+            # numbered, as a window moving back and forth evicts slabs starting at the same voxel
+            path = os.path.join(self._evict_directory, '{:06d}_{}_{}_{}.npz'.format(self._evict_count, *voxel_min))
+            np.savez(path, tsdf=tsdf_slab, weight=weight_slab, color=color_slab)
+            self._evict_count += 1
+        if self._evict_callback is not None:
+            self._evict_callback(voxel_min.copy(), tsdf_slab, weight_slab, color_slab)
@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from scrolling_tsdf import *
+
+
+class TestScrollingTSDFVolume(unittest.TestCase):
+    """Unit test scrolling_tsdf.py.
+    """
+
+    def setUp(self):
+        # a 64x48 camera looking down +z at a plane 0.5m away
+        self.camera_intrinsics = np.array([[60., 0., 32.],
+                                           [0., 60., 24.],
+                                           [0., 0., 1.]])
+        self.depth_image = np.full((48, 64), 0.5)
+        self.color_image = np.zeros((48, 64, 3), dtype=np.uint8)
+        self.color_image[..., 0] = np.arange(64, dtype=np.uint8)[None, :] * 3
+        self.color_image[..., 2] = 200
+        self.camera_pose = np.eye(4)
+        self.camera_pose[:3, 3] = [0.013, -0.021, 0.004]
+
+    def test_integrate(self):
+        """Test ScrollingTSDFVolume.integrate against the dense TSDFVolume over the same voxels.
+        """
+        volume = ScrollingTSDFVolume((30, 20, 20), voxel_size=0.02, center=(0., 0., 0.5), look_ahead=0.5)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+        # a camera this close to the window center does not move it
+        self.assertTrue(np.allclose(volume.get_volume_origin(), [-0.3, -0.2, 0.3]))
+        volume_bounds = np.stack([volume.get_volume_origin(), volume.get_volume_origin() + 0.6], axis=1)
+        dense = TSDFVolume(volume_bounds, voxel_size=0.02)
+        dense.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+        tsdf_volume, weight_volume, color_volume = volume.get_volume()
+        self.assertTrue(np.allclose(tsdf_volume, dense._tsdf_volume[:, :20, :20], atol=1e-5))
+        self.assertTrue(np.array_equal(weight_volume, dense._weight_volume[:, :20, :20]))
+        # voxel centers are computed from a different origin, the ones on a pixel border may
+        # take the color of the neighbouring pixel
+        self.assertTrue(np.allclose(color_volume, dense._color_volume[:, :20, :20], atol=3))
+
+        points, triangles, normals, colors = volume.get_mesh(min_weight=0.)
+        self.assertGreater(len(triangles), 0)
+        self.assertTrue(np.allclose(points[:, 2], 0.504, atol=1e-3))
+
+    def test_scrolling(self):
+        """Test ScrollingTSDFVolume moves with the camera and evicts the voxels it leaves.
+        """
+        evicted = []
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        volume = ScrollingTSDFVolume(32, voxel_size=0.02, look_ahead=0.5, shift_threshold=2,
+                                     evict_callback=lambda *slab: evicted.append(slab), evict_directory=directory)
+        tsdf_storage = volume._tsdf_volume
+        initial_min = volume._window_min.copy()
+
+        # the camera drives along -x, the window follows it
+        camera_pose = self.camera_pose.copy()
+        for step in range(8):
+            camera_pose[0, 3] = -0.05 * step
+            previous_volume = volume.get_volume()
+            previous_min = volume._window_min.copy()
+            evicted_count = len(evicted)
+            volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, camera_pose)
+            target = np.round((camera_pose[:3, 3] + [0., 0., 0.5]) / 0.02) - 16
+            self.assertTrue(np.all(np.abs(volume._window_min - target) <= 2))
+
+            # the slabs handed out are the voxels that just left the window
+            for voxel_min, tsdf_slab, weight_slab, color_slab in evicted[evicted_count:]:
+                offset = voxel_min - previous_min
+                region = tuple(slice(o, o + s) for o, s in zip(offset, weight_slab.shape))
+                self.assertTrue(np.array_equal(tsdf_slab, previous_volume[0][region]))
+                self.assertTrue(np.array_equal(weight_slab, previous_volume[1][region]))
+                self.assertTrue(np.array_equal(color_slab, previous_volume[2][region]))
+                self.assertTrue(np.all(offset + weight_slab.shape <= 32))
+
+        self.assertGreater(len(evicted), 0)
+        self.assertEqual(len(os.listdir(directory)), len(evicted))
+        self.assertIs(volume._tsdf_volume, tsdf_storage)
+
+        # the voxels that never left the window match a dense volume fused over the whole trajectory
+        volume_bounds = np.array([[-1., 0.4], [-0.4, 0.4], [0., 1.]])
+        dense = TSDFVolume(volume_bounds, voxel_size=0.02)
+        for step in range(8):
+            camera_pose[0, 3] = -0.05 * step
+            dense.integrate(self.color_image, self.depth_image, self.camera_intrinsics, camera_pose)
+        tsdf_volume, weight_volume, _ = volume.get_volume()
+        self.assertLess(volume._window_min[0], initial_min[0])
+        kept = slice(initial_min[0] - volume._window_min[0], 32)
+        offset = volume._window_min - np.round(volume_bounds[:, 0] / 0.02).astype(int)
+        region = tuple(slice(o, o + 32) for o in offset)
+        self.assertTrue(np.allclose(tsdf_volume[kept], dense._tsdf_volume[region][kept], atol=1e-5))
+        self.assertTrue(np.array_equal(weight_volume[kept], dense._weight_volume[region][kept]))
+
+        # recentering far away evicts everything
+        volume.recenter((100., 0., 0.))
+        self.assertFalse(volume.get_volume()[1].any())
+
+        with self.assertRaises(ValueError):
+            ScrollingTSDFVolume(0, voxel_size=0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
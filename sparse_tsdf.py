@@ -0,0 +1,360 @@
+from meshing import marching_cubes_block, merge_meshes, observed_cube_mask
+from tsdf import *
+
+
+@njit(parallel=True, cache=True)
+def integrate_blocks_kernel(tsdf_blocks, weight_blocks, color_blocks, block_coords, block_indices,
+                            voxel_size, truncation_margin, color_image, depth_image, intrinsics,
+                            world_to_camera, observation_weight):
+    """Fuse one RGB-D observation into a set of allocated voxel blocks in a single parallel pass.
+
+    Args:
+        tsdf_blocks (numpy.array [c, b, b, b]): tsdf values of every block, updated in place.
+        weight_blocks (numpy.array [c, b, b, b]): accumulated weights, updated in place.
+        color_blocks (numpy.array [c, b, b, b, 3]): rgb colors, updated in place.
+        block_coords (numpy.array [c, 3]): block coordinates of every block, voxel
+            (0, 0, 0) of block i is at world coordinates block_coords[i] * b * voxel_size.
+        block_indices (numpy.array [n, ]): indices of the blocks to integrate.
+        voxel_size (float): The side length of each voxel in meters.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+        color_image (numpy.array [h, w, 3]): An rgb image.
+        depth_image (numpy.array [h, w]): A z depth image.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        world_to_camera (numpy.array [4, 4]): SE3 transform from world to camera coordinates.
+        observation_weight (float): Weight to give the observation.
+    """
+    max_depth = depth_image.max()
+    block_size = tsdf_blocks.shape[1]
+    for i in prange(len(block_indices)):
+        b = block_indices[i]
+        for x in range(block_size):
+            world_x = (block_coords[b, 0] * block_size + x) * voxel_size
+            for y in range(block_size):
+                world_y = (block_coords[b, 1] * block_size + y) * voxel_size
+                for z in range(block_size):
+                    world_z = (block_coords[b, 2] * block_size + z) * voxel_size
+                    u, v, margin_distance = project_voxel(
+                        world_x, world_y, world_z, world_to_camera, intrinsics, depth_image, truncation_margin, max_depth)
+                    if u < 0:
+                        continue
+                    update_voxel(tsdf_blocks, weight_blocks, color_blocks, (b, x, y, z), color_image, u, v,
+                                 margin_distance, observation_weight, 1.0, np.inf)
+
+
+def pack_block_keys(block_coords):
+    """Pack block coordinates into single integer hash keys, 21 bits per axis.
+
+    Args:
+        block_coords (numpy.array [n, 3]): block coordinates in [-2^20, 2^20).
+
+    Returns:
+        numpy.array [n, ]: int64 key of every block.
+    """
+    block_coords = np.asarray(block_coords, dtype=np.int64) + (1 << 20)
+    return (block_coords[:, 0] << 42) | (block_coords[:, 1] << 21) | block_coords[:, 2]
+
+
+def unpack_block_keys(block_keys):
+    """Unpack integer hash keys created by pack_block_keys back into block coordinates.
+
+    Args:
+        block_keys (numpy.array [n, ]): int64 key of every block.
+
+    Returns:
+        numpy.array [n, 3]: block coordinates.
+    """
+    block_keys = np.asarray(block_keys, dtype=np.int64)
+    mask = (1 << 21) - 1
+    return np.stack([block_keys >> 42, (block_keys >> 21) & mask, block_keys & mask], axis=1) - (1 << 20)
+
+
+class SparseTSDFVolume:
+    """Volumetric TSDF Fusion of RGB-D Images into hashed voxel blocks.
+
+    Only blocks of block_size^3 voxels that fall within the truncation band of an
+    observed depth are allocated, so memory grows with the observed surface area
+    instead of with the volume bounds.
+    """
+
+    def __init__(self, voxel_size, block_size=8, initial_capacity=1024, volume_bounds=None):
+        """Initialize sparse tsdf volume instance variables.
+
+        Args:
+            voxel_size (float): The side length of each voxel in meters.
+            block_size (int, optional): The side length of each voxel block in voxels.
+                Defaults to 8.
+            initial_capacity (int, optional): Number of blocks to preallocate. The block
+                pool doubles whenever it runs out of space. Defaults to 1024.
+            volume_bounds (numpy.array [3, 2], optional): rows index [x, y, z] and cols index
+                [min_bound, max_bound]. Observations outside of the bounds are ignored.
+                Defaults to None, meaning the volume is unbounded.
+
+        Raises:
+            ValueError: If voxel size is not positive.
+            ValueError: If block size or initial capacity is not positive.
+            ValueError: If volume bounds are not the correct shape.
+        """
+        if voxel_size <= 0.0:
+            raise ValueError('voxel size must be positive.')
+        if block_size <= 0 or initial_capacity <= 0:
+            raise ValueError('block size and initial capacity must be positive.')
+        if volume_bounds is not None:
+            volume_bounds = np.asarray(volume_bounds, dtype=np.float64)
+            if volume_bounds.shape != (3, 2):
+                raise ValueError('volume_bounds should be of shape (3, 2).')
+
+        self._voxel_size = float(voxel_size)
+        self._block_size = int(block_size)
+        self._truncation_margin = 2 * self._voxel_size  # truncation on SDF (max alowable distance away from a surface)
+        self._volume_bounds = volume_bounds
+
+        # block pool, entries [0, self._block_count) are in use
+        block_shape = (int(initial_capacity), self._block_size, self._block_size, self._block_size)
+        self._tsdf_blocks = np.ones(block_shape, dtype=np.float32)
+        self._weight_blocks = np.zeros(block_shape, dtype=np.float32)
+        self._color_blocks = np.zeros(block_shape + (3,), dtype=np.float32)  # rgb order
+        self._block_coords = np.zeros((int(initial_capacity), 3), dtype=np.int64)
+        self._block_count = 0
+
+        # hash table from packed block coordinates to block pool index
+        self._block_table = {}
+
+    def get_block_count(self):
+        """Get the number of allocated voxel blocks.
+
+        Returns:
+            int: number of allocated blocks.
+        """
+        return self._block_count
+
+    def get_volume(self):
+        """Get the tsdf and color volumes as dense grids over the allocated blocks.
+
+        The grids cover the bounding box of all allocated blocks, voxel (0, 0, 0) is
+        located at get_volume_origin(). Unallocated space has tsdf 1 and color 0.
+
+        Returns:
+            numpy.array [l, w, h]: l, w, h are the dimensions of the voxel grid in voxel space.
+                Each entry contains the integrated tsdf value.
+            numpy.array [l, w, h, 3]: l, w, h are the dimensions of the voxel grid in voxel space.
+                3 is the channel number in the order r, g, then b.
+        """
+        block_coords = self._block_coords[:self._block_count]
+        if self._block_count == 0:
+            return np.ones((0, 0, 0), dtype=np.float32), np.zeros((0, 0, 0, 3), dtype=np.float32)
+
+        min_block = block_coords.min(axis=0)
+        voxel_bounds = (block_coords.max(axis=0) - min_block + 1) * self._block_size
+        tsdf_volume = np.ones(voxel_bounds, dtype=np.float32)
+        color_volume = np.zeros(np.append(voxel_bounds, 3), dtype=np.float32)
+
+        b = self._block_size
+        for i, (x, y, z) in enumerate((block_coords - min_block) * b):
+            tsdf_volume[x:x + b, y:y + b, z:z + b] = self._tsdf_blocks[i]
+            color_volume[x:x + b, y:y + b, z:z + b] = self._color_blocks[i]
+
+        return tsdf_volume, color_volume
+
+    def get_volume_origin(self):
+        """Get the world coordinates of voxel (0, 0, 0) of the grids returned by get_volume.
+
+        Returns:
+            numpy.array [3, ]: origin of the dense grids in world coordinates.
+        """
+        if self._block_count == 0:
+            return np.zeros(3, dtype=np.float32)
+        min_block = self._block_coords[:self._block_count].min(axis=0)
+        return (min_block * self._block_size * self._voxel_size).astype(np.float32)
+
+    def get_mesh(self, min_weight=0.0):
+        """ Run marching cubes block by block over the allocated blocks to get a mesh representation.
+
+        Each block is padded with the first slab of voxels of its +x, +y and +z neighbours
+        so neighbouring block meshes meet, and the seam vertices are welded. Cubes touching
+        unobserved voxels are skipped, so no surface is generated where the truncation band
+        meets unallocated space.
+
+        Args:
+            min_weight (float, optional): only extract the cubes whose eight corners have a
+                weight greater than min_weight. Defaults to 0.
+
+        Returns:
+            numpy.array [n, 3]: each row represents a 3D point.
+            numpy.array [k, 3]: each row is a list of point indices used to render triangles.
+            numpy.array [n, 3]: each row represents the normal vector for the corresponding 3D point.
+            numpy.array [n, 3]: each row represents the color of the corresponding 3D point.
+        """
+        b = self._block_size
+        meshes = []
+        for i in range(self._block_count):
+            tsdf_block, weight_block, color_block = self._get_padded_block(i)
+            voxel_points, triangles, normals = marching_cubes_block(tsdf_block, observed_cube_mask(weight_block, min_weight))
+            if voxel_points is None:
+                continue
+
+            # Get vertex colors.
+            points_ind = np.round(voxel_points).astype(int)
+            colors = np.floor(color_block[points_ind[:, 0], points_ind[:, 1], points_ind[:, 2]]).astype(np.uint8)
+
+            meshes.append((voxel_points + self._block_coords[i] * b, triangles, normals, colors))
+
+        voxel_points, triangles, normals, colors = merge_meshes(meshes)
+        points = (voxel_points * self._voxel_size).astype(np.float32)
+        return points, triangles, normals, colors
+
+    def integrate(self, color_image, depth_image, camera_intrinsics, camera_pose, observation_weight=1.):
+        """Integrate an RGB-D observation into the TSDF volume, allocating the voxel blocks
+            within the truncation band of the observed depth.
+
+        Args:
+            color_image (numpy.array [h, w, 3]): An rgb image.
+            depth_image (numpy.array [h, w]): A z depth image.
+            camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+            camera_pose (numpy.array [4, 4] or Pose): SE3 transform representing pose (camera to world)
+            observation_weight (float, optional):  The weight to assign for the current
+                observation. Defaults to 1.
+        """
+        camera_pose = Pose(camera_pose)
+        camera_intrinsics = np.asarray(camera_intrinsics, dtype=np.float64)
+        block_keys = self._get_band_block_keys(depth_image, camera_intrinsics, camera_pose)
+        self._integrate_blocks(block_keys, color_image, depth_image, camera_intrinsics, camera_pose,
+                               observation_weight)
+
+    def _get_band_block_keys(self, depth_image, camera_intrinsics, camera_pose):
+        """Find the blocks within the truncation band of the observed depth.
+
+        Args:
+            depth_image (numpy.array [h, w]): A z depth image.
+            camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+            camera_pose (Pose): SE3 transform representing pose (camera to world)
+
+        Returns:
+            numpy.array [n, ]: sorted packed block coordinates of the blocks.
+        """
+        samples, valid = truncation_band_voxels(
+            depth_image, camera_intrinsics, camera_pose.matrix,
+            np.zeros(3), self._voxel_size, self._truncation_margin)
+        samples = samples[valid].reshape(-1, 3)
+        if self._volume_bounds is not None:
+            inside = np.all((samples * self._voxel_size >= self._volume_bounds[:, 0])
+                            & (samples * self._voxel_size <= self._volume_bounds[:, 1]), axis=1)
+            samples = samples[inside]
+        return unique_indices(pack_block_keys(samples // self._block_size))
+
+    def _integrate_blocks(self, block_keys, color_image, depth_image, camera_intrinsics, camera_pose,
+                          observation_weight):
+        """Allocate a set of blocks and fuse an RGB-D observation into them.
+
+        Args:
+            block_keys (numpy.array [n, ]): packed block coordinates of the blocks.
+            color_image (numpy.array [h, w, 3]): An rgb image.
+            depth_image (numpy.array [h, w]): A z depth image.
+            camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+            camera_pose (Pose): SE3 transform representing pose (camera to world)
+            observation_weight (float): Weight to give the observation.
+        """
+        block_indices = self._allocate_blocks(block_keys)
+        integrate_blocks_kernel(
+            self._tsdf_blocks,
+            self._weight_blocks,
+            self._color_blocks,
+            self._block_coords,
+            block_indices,
+            self._voxel_size,
+            self._truncation_margin,
+            color_image,
+            depth_image,
+            camera_intrinsics,
+            camera_pose.inverse().matrix,
+            float(observation_weight))
+
+    def _allocate_blocks(self, block_keys):
+        """Look up blocks in the hash table, allocating the ones that do not exist yet.
+
+        Args:
+            block_keys (numpy.array [n, ]): packed block coordinates.
+
+        Returns:
+            numpy.array [n, ]: block pool index of every block.
+        """
+        block_coords = unpack_block_keys(block_keys)
+        block_indices = np.empty(len(block_keys), dtype=np.int64)
+        for i, key in enumerate(block_keys.tolist()):
+            index = self._block_table.get(key)
+            if index is None:
+                if self._block_count == len(self._block_coords):
+                    self._grow_pool()
+                index = self._block_count
+                self._block_table[key] = index
+                self._block_coords[index] = block_coords[i]
+                self._block_count += 1
+            block_indices[i] = index
+        return block_indices
+
+    def _remove_blocks(self, block_keys):
+        """Free blocks, moving the last blocks of the pool into the freed entries.
+
+        Args:
+            block_keys (numpy.array [n, ]): packed block coordinates, keys of blocks that are
+                not allocated are ignored.
+        """
+        for key in np.asarray(block_keys).tolist():
+            index = self._block_table.pop(key, None)
+            if index is None:
+                continue
+            last = self._block_count - 1
+            if index != last:
+                self._tsdf_blocks[index] = self._tsdf_blocks[last]
+                self._weight_blocks[index] = self._weight_blocks[last]
+                self._color_blocks[index] = self._color_blocks[last]
+                self._block_coords[index] = self._block_coords[last]
+                self._block_table[int(pack_block_keys(self._block_coords[index:index + 1])[0])] = index
+
+            # allocation expects unused entries to hold an unobserved block
+            self._tsdf_blocks[last] = 1
+            self._weight_blocks[last] = 0
+            self._color_blocks[last] = 0
+            self._block_count -= 1
+
+    def _grow_pool(self):
+        """Double the capacity of the block pool.
+        """
+        capacity = len(self._block_coords)
+        self._tsdf_blocks = np.concatenate([self._tsdf_blocks, np.ones_like(self._tsdf_blocks)])
+        self._weight_blocks = np.concatenate([self._weight_blocks, np.zeros_like(self._weight_blocks)])
+        self._color_blocks = np.concatenate([self._color_blocks, np.zeros_like(self._color_blocks)])
+        self._block_coords = np.concatenate([self._block_coords, np.zeros((capacity, 3), dtype=np.int64)])
+
+    def _get_padded_block(self, index):
+        """Get the tsdf, weight and color values of a block extended by one voxel along +x, +y and +z.
+
+        Args:
+            index (int): block pool index.
+
+        Returns:
+            numpy.array [b + 1, b + 1, b + 1]: tsdf values, 1 where the neighbour is not allocated.
+            numpy.array [b + 1, b + 1, b + 1]: weights, 0 where the neighbour is not allocated.
+            numpy.array [b + 1, b + 1, b + 1, 3]: rgb colors, 0 where the neighbour is not allocated.
+        """
+        b = self._block_size
+        tsdf_block = np.ones((b + 1, b + 1, b + 1), dtype=np.float32)
+        weight_block = np.zeros((b + 1, b + 1, b + 1), dtype=np.float32)
+        color_block = np.zeros((b + 1, b + 1, b + 1, 3), dtype=np.float32)
+        key = int(pack_block_keys(self._block_coords[index:index + 1])[0])
+        for dx in (0, 1):
+            for dy in (0, 1):
+                for dz in (0, 1):
+                    neighbour = self._block_table.get(key + (dx << 42) + (dy << 21) + dz)
+                    if neighbour is None:
+                        continue
+                    # the part of the neighbour that falls in the padded block
+                    sx = slice(0, b) if dx == 0 else slice(0, 1)
+                    sy = slice(0, b) if dy == 0 else slice(0, 1)
+                    sz = slice(0, b) if dz == 0 else slice(0, 1)
+                    tx = slice(0, b) if dx == 0 else slice(b, b + 1)
+                    ty = slice(0, b) if dy == 0 else slice(b, b + 1)
+                    tz = slice(0, b) if dz == 0 else slice(b, b + 1)
+                    tsdf_block[tx, ty, tz] = self._tsdf_blocks[neighbour, sx, sy, sz]
+                    weight_block[tx, ty, tz] = self._weight_blocks[neighbour, sx, sy, sz]
+                    color_block[tx, ty, tz] = self._color_blocks[neighbour, sx, sy, sz]
+        return tsdf_block, weight_block, color_block
@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+from sparse_tsdf import *
+
+
+class TestSparseTSDFVolume(unittest.TestCase):
+    """Unit test sparse_tsdf.py.
+    """
+
+    def setUp(self):
+        # a 64x48 camera looking down +z at a plane 0.5m away
+        self.camera_intrinsics = np.array([[60., 0., 32.],
+                                           [0., 60., 24.],
+                                           [0., 0., 1.]])
+        self.depth_image = np.full((48, 64), 0.5)
+        self.color_image = np.full((48, 64, 3), 120, dtype=np.uint8)
+        self.camera_pose = np.eye(4)
+        self.camera_pose[:3, 3] = [0.013, -0.021, 0.004]
+
+    def test_pack_block_keys(self):
+        """Test sparse_tsdf.pack_block_keys and sparse_tsdf.unpack_block_keys.
+        """
+        block_coords = np.array([[0, 0, 0], [-1, 2, -3], [1000, -70000, 5]])
+        self.assertTrue(np.array_equal(unpack_block_keys(pack_block_keys(block_coords)), block_coords))
+
+    def test_integrate(self):
+        """Test SparseTSDFVolume.integrate against the dense TSDFVolume.
+        """
+        volume = SparseTSDFVolume(0.02, block_size=4, initial_capacity=2)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+        # only blocks around the plane are allocated
+        self.assertGreater(volume.get_block_count(), 0)
+        block_coords = volume._block_coords[:volume.get_block_count()]
+        block_z = (block_coords[:, 2] * 4 + np.arange(4)[:, None]) * 0.02
+        self.assertTrue((np.abs(block_z - 0.5) < 0.2).all())
+
+        # every observed voxel matches the dense volume covering the same space
+        tsdf_volume, _ = volume.get_volume()
+        volume_origin = volume.get_volume_origin()
+        volume_bounds = np.stack([volume_origin, volume_origin + (np.array(tsdf_volume.shape) - 0.5) * 0.02], axis=1)
+        dense = TSDFVolume(volume_bounds.astype(np.float64), voxel_size=0.02)
+        dense.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+        observed = tsdf_volume != 1
+        self.assertTrue(observed.any())
+        self.assertTrue(np.allclose(tsdf_volume[observed], dense._tsdf_volume[observed], atol=1e-5))
+
+        # the extracted surface is the plane
+        points, triangles, normals, colors = volume.get_mesh()
+        self.assertGreater(len(triangles), 0)
+        self.assertTrue(np.allclose(points[:, 2], 0.5, atol=0.01))
+        self.assertTrue((colors == 120).all())
+        self.assertEqual(len(np.unique(points.round(5), axis=0)), len(points))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,423 @@
+from collections import OrderedDict
+from tsdf import *
+
+
+def tiles_in_frustum(tile_mins, tile_maxs, volume_origin, voxel_size, depth_image, camera_intrinsics,
+                     world_to_camera, truncation_margin):
+    """Test which tiles of voxels may intersect the camera frustum of an observation.
+
+    A tile is culled when the eight corners of the box around its voxel centers all lie
+    outside the same plane of the frustum. The test is conservative, a tile that is kept
+    may still receive no update.
+
+    Args:
+        tile_mins (numpy.array [n, 3]): first voxel index of every tile along x, y and z.
+        tile_maxs (numpy.array [n, 3]): one past the last voxel index of every tile.
+        volume_origin (numpy.array [3, ]): world coordinates of voxel (0, 0, 0).
+        voxel_size (float): The side length of each voxel in meters.
+        depth_image (numpy.array [h, w]): A z depth image.
+        camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        world_to_camera (numpy.array [4, 4]): SE3 transform from world to camera coordinates.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+
+    Returns:
+        numpy.array [n, ]: True for the tiles that may intersect the frustum.
+    """
+    image_height, image_width = depth_image.shape
+    max_depth = depth_image.max() + truncation_margin
+    fu, fv = camera_intrinsics[0, 0], camera_intrinsics[1, 1]
+    u0, v0 = camera_intrinsics[0, 2], camera_intrinsics[1, 2]
+
+    # corners of every tile in camera coordinates
+    corner_offsets = np.array([[dx, dy, dz] for dx in (0, 1) for dy in (0, 1) for dz in (0, 1)])
+    corners = np.where(corner_offsets, tile_maxs[:, None] - 1, tile_mins[:, None])
+    corners = transform_point3s(world_to_camera, volume_origin + corners.reshape(-1, 3) * voxel_size, check=False)
+    x, y, z = corners.reshape(-1, 8, 3).transpose(2, 0, 1)
+
+    # half spaces outside of the frustum, the image sides are widened by a pixel to
+    # stay clear of rounding at the image border
+    outside = [z <= 0,
+               z > max_depth,
+               x * fu + (u0 + 1.5) * z < 0,
+               x * fu + (u0 - image_width - 0.5) * z > 0,
+               y * fv + (v0 + 1.5) * z < 0,
+               y * fv + (v0 - image_height - 0.5) * z > 0]
+    culled = np.zeros(len(tile_mins), dtype=bool)
+    for plane in outside:
+        culled |= plane.all(axis=1)
+    return ~culled
+
+
+class TiledTSDFVolume:
+    """Volumetric TSDF Fusion of RGB-D Images into a volume kept out of core.
+
+    The voxel grid is split into tiles of tile_size^3 voxels stored as one file each in
+    a directory. Only the tiles in the frustum of an observation are read, and at most
+    max_resident_tiles stay in memory, the least recently used one is written back and
+    dropped when another one is needed. Tiles that were never observed are not stored,
+    so the volume bounds can be far larger than both the memory and the disk space used.
+    """
+
+    def __init__(self, directory, volume_bounds, voxel_size, tile_size=64, max_resident_tiles=64,
+                 tsdf_dtype=np.float32, weight_dtype=np.float32, color_dtype=np.float32):
+        """Initialize tiled tsdf volume instance variables.
+
+        Args:
+            directory (str): directory the tiles are stored in, created if it does not exist.
+            volume_bounds (numpy.array [3, 2]): rows index [x, y, z] and cols index [min_bound, max_bound].
+                Note: units are in meters.
+            voxel_size (float): The side length of each voxel in meters.
+            tile_size (int, optional): side length of the tiles in voxels. Defaults to 64.
+            max_resident_tiles (int, optional): number of tiles kept in memory. Defaults to 64.
+            tsdf_dtype (numpy.dtype, optional): storage type of the tsdf values, see TSDFVolume.
+                Defaults to float32.
+            weight_dtype (numpy.dtype, optional): storage type of the weights, see TSDFVolume.
+                Defaults to float32.
+            color_dtype (numpy.dtype, optional): storage type of the colors, see TSDFVolume.
+                Defaults to float32.
+
+        Raises:
+            NameError: If directory cannot be created.
+            ValueError: If directory already holds a volume.
+            ValueError: If volume bounds are not the correct shape.
+            ValueError: If voxel size, tile size or the number of resident tiles is not positive.
+            ValueError: If a storage type is not supported.
+        """
+        self._init_layout(directory, volume_bounds, voxel_size, tile_size, max_resident_tiles,
+                          tsdf_dtype, weight_dtype, color_dtype)
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            raise NameError('Invalid path')
+        if os.path.isfile(os.path.join(directory, 'meta.json')):
+            raise ValueError('directory already holds a volume, open it with load.')
+
+        meta = {
+            'format': 1,
+            'volume_bounds': self._volume_bounds.tolist(),
+            'voxel_size': self._voxel_size,
+            'tile_size': self._tile_size,
+            'tsdf_dtype': self._tsdf_dtype.name,
+            'weight_dtype': self._weight_dtype.name,
+            'color_dtype': self._color_dtype.name,
+        }
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def _init_layout(self, directory, volume_bounds, voxel_size, tile_size, max_resident_tiles,
+                     tsdf_dtype, weight_dtype, color_dtype):
+        """Validate the arguments of __init__ and set the instance variables.
+
+        Raises:
+            ValueError: See __init__.
+        """
+        volume_bounds = np.array(volume_bounds, dtype=np.float64)
+        if volume_bounds.shape != (3, 2):
+            raise ValueError('volume_bounds should be of shape (3, 2).')
+        if voxel_size <= 0.0:
+            raise ValueError('voxel size must be positive.')
+        if tile_size <= 0 or max_resident_tiles <= 0:
+            raise ValueError('tile size and the number of resident tiles must be positive.')
+
+        tsdf_dtype, weight_dtype, color_dtype, tsdf_scale, max_weight = check_volume_dtypes(
+            tsdf_dtype, weight_dtype, color_dtype)
+
+        self._directory = directory
+        self._voxel_size = float(voxel_size)
+        self._truncation_margin = 2 * self._voxel_size  # truncation on SDF (max alowable distance away from a surface)
+        self._voxel_bounds = np.ceil((volume_bounds[:, 1] - volume_bounds[:, 0]) / self._voxel_size).astype(int)
+        volume_bounds[:, 1] = volume_bounds[:, 0] + self._voxel_bounds * self._voxel_size
+        self._volume_bounds = volume_bounds
+        self._volume_origin = volume_bounds[:, 0].astype(np.float32)
+        self._tile_size = int(tile_size)
+        self._max_resident_tiles = int(max_resident_tiles)
+
+        self._tsdf_dtype, self._weight_dtype, self._color_dtype = tsdf_dtype, weight_dtype, color_dtype
+        self._tsdf_scale = tsdf_scale
+        self._max_weight = max_weight
+
+        # tiles in memory from least to most recently used, as (tsdf, weight, color) tuples
+        self._resident_tiles = OrderedDict()
+        self._modified_tiles = set()  # resident tiles that differ from their file
+        self._stored_tiles = set()  # tiles that have a file
+
+    @classmethod
+    def load(cls, directory, max_resident_tiles=64):
+        """Open a volume stored in a directory by an earlier instance.
+
+        Only the metadata is read, tiles are read when they are first needed.
+
+        Args:
+            directory (str): directory the tiles are stored in.
+            max_resident_tiles (int, optional): number of tiles kept in memory. Defaults to 64.
+
+        Raises:
+            NameError: If directory does not hold a volume.
+
+        Returns:
+            TiledTSDFVolume: The opened volume.
+        """
+        meta_path = os.path.join(directory, 'meta.json')
+        if not os.path.isfile(meta_path):
+            raise NameError('Invalid path')
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        volume = cls.__new__(cls)
+        volume._init_layout(directory, meta['volume_bounds'], meta['voxel_size'], meta['tile_size'],
+                            max_resident_tiles, meta['tsdf_dtype'], meta['weight_dtype'], meta['color_dtype'])
+        for name in os.listdir(directory):
+            if name.endswith('.npz'):
+                volume._stored_tiles.add(tuple(int(i) for i in name[:-len('.npz')].split('_')))
+        return volume
+
+    def get_tile_count(self):
+        """Get the number of tiles that have been observed.
+
+        Returns:
+            int: number of tiles stored on disk or waiting in memory to be written.
+        """
+        return len(self._stored_tiles | self._modified_tiles)
+
+    def get_resident_tile_count(self):
+        """Get the number of tiles held in memory.
+
+        Returns:
+            int: number of resident tiles, at most max_resident_tiles.
+        """
+        return len(self._resident_tiles)
+
+    def flush(self):
+        """Write every tile modified since it was read to disk, keeping it in memory.
+        """
+        for tile in sorted(self._modified_tiles):
+            self._write_tile(tile)
+        self._modified_tiles.clear()
+
+    def get_region(self, voxel_min, voxel_max):
+        """Read the tsdf, weight and color values of a box of voxels.
+
+        Args:
+            voxel_min (numpy.array [3, ]): first voxel index to read along x, y and z.
+            voxel_max (numpy.array [3, ]): one past the last voxel index to read along x, y and z.
+
+        Returns:
+            numpy.array [l, w, h]: tsdf values decoded to float32, 1 where nothing was observed.
+            numpy.array [l, w, h]: weights in their storage type.
+            numpy.array [l, w, h, 3]: rgb colors in their storage type.
+        """
+        voxel_min = np.clip(voxel_min, 0, self._voxel_bounds)
+        voxel_max = np.clip(voxel_max, voxel_min, self._voxel_bounds)
+        shape = tuple(voxel_max - voxel_min)
+        tsdf_region = np.ones(shape, dtype=np.float32)
+        weight_region = np.zeros(shape, dtype=self._weight_dtype)
+        color_region = np.zeros(shape + (3,), dtype=self._color_dtype)
+        if min(shape) == 0:
+            return tsdf_region, weight_region, color_region
+
+        t = self._tile_size
+        tile_ranges = [range(lo // t, (hi - 1) // t + 1) for lo, hi in zip(voxel_min, voxel_max)]
+        for tile in ((x, y, z) for x in tile_ranges[0] for y in tile_ranges[1] for z in tile_ranges[2]):
+            arrays = self._get_tile(tile, create=False)
+            if arrays is None:
+                continue
+            tile_min = np.array(tile) * t
+            lo = np.maximum(voxel_min, tile_min)
+            hi = np.minimum(voxel_max, tile_min + t)
+            source = tuple(slice(a, b) for a, b in zip(lo - tile_min, hi - tile_min))
+            target = tuple(slice(a, b) for a, b in zip(lo - voxel_min, hi - voxel_min))
+            tsdf_region[target] = arrays[0][source]
+            weight_region[target] = arrays[1][source]
+            color_region[target] = arrays[2][source]
+
+        if self._tsdf_scale != 1.0:
+            tsdf_region /= np.float32(self._tsdf_scale)
+        return tsdf_region, weight_region, color_region
+
+    def get_mesh(self, min_weight=None):
+        """ Run marching cubes tile by tile to get a mesh representation.
+
+        Tiles are read through the resident tile cache one at a time, with one voxel of
+        their neighbours on every side, so the whole volume never has to be in memory.
+        The result is the mesh TSDFVolume.get_mesh extracts with a mesh_block_size of
+        tile_size.
+
+        Args:
+            min_weight (float, optional): only extract the cubes whose eight corners have a
+                weight greater than min_weight. Defaults to None, meaning every cube is
+                extracted.
+
+        Returns:
+            numpy.array [n, 3]: each row represents a 3D point.
+            numpy.array [k, 3]: each row is a list of point indices used to render triangles.
+            numpy.array [n, 3]: each row represents the normal vector for the corresponding 3D point.
+            numpy.array [n, 3]: each row represents the color of the corresponding 3D point.
+        """
+        # a tile owns the cubes whose lowest corner falls inside it, so the tiles below
+        # an observed tile can own part of its surface too
+        blocks = set()
+        for x, y, z in self._stored_tiles | self._modified_tiles:
+            for dx in (0, 1):
+                for dy in (0, 1):
+                    for dz in (0, 1):
+                        if x >= dx and y >= dy and z >= dz:
+                            blocks.add((x - dx, y - dy, z - dz))
+
+        t = self._tile_size
+        meshes = []
+        for block in sorted(blocks):
+            block_min = np.array(block) * t
+            block_max = np.minimum(block_min + t + 1, self._voxel_bounds)
+            read_min = np.maximum(block_min - 1, 0)
+            tsdf_block, weight_block, color_block = self.get_region(read_min, block_max + 1)
+            if not (tsdf_block.min() < 0 < tsdf_block.max()):
+                continue
+
+            # marching cubes tests the mask at the highest corner of each cube
+            mask = np.zeros(tsdf_block.shape, dtype=bool)
+            mask[tuple(slice(lo + 1, hi) for lo, hi in zip(block_min - read_min, block_max - read_min))] = True
+            if min_weight is not None:
+                mask &= observed_cube_mask(weight_block, min_weight)
+            voxel_points, triangles, normals = marching_cubes_block(tsdf_block, mask)
+            if voxel_points is None:
+                continue
+
+            voxel_points = voxel_points + read_min
+
+            # Get vertex colors, rounding the volume coordinates like TSDFVolume.get_mesh
+            points_ind = np.round(voxel_points).astype(int) - read_min
+            colors = np.floor(color_block[points_ind[:, 0], points_ind[:, 1], points_ind[:, 2]]).astype(np.uint8)
+            meshes.append((voxel_points, triangles, normals, colors))
+
+        voxel_points, triangles, normals, colors = merge_meshes(meshes)
+        points = TSDFVolume.voxel_to_world(self._volume_origin, voxel_points, self._voxel_size)
+        return points, triangles, normals, colors
+
+    def integrate(self, color_image, depth_image, camera_intrinsics, camera_pose, observation_weight=1.):
+        """Integrate an RGB-D observation into the tiles intersecting its camera frustum.
+
+        Args:
+            color_image (numpy.array [h, w, 3]): An rgb image.
+            depth_image (numpy.array [h, w]): A z depth image.
+            camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+            camera_pose (numpy.array [4, 4] or Pose): SE3 transform representing pose (camera to world)
+            observation_weight (float, optional):  The weight to assign for the current
+                observation. Defaults to 1.
+
+        Raises:
+            ValueError: If camera_pose is not a valid transform.
+            ValueError: If observation_weight is not a whole number and the weights are
+                stored as integers.
+        """
+        if self._max_weight != np.inf and observation_weight != int(observation_weight):
+            raise ValueError('observation_weight must be a whole number with integer weights.')
+
+        camera_pose = Pose(camera_pose)
+        world_to_camera = camera_pose.inverse().matrix
+        camera_intrinsics = np.asarray(camera_intrinsics, dtype=np.float64)
+
+        voxel_min, voxel_max = frustum_voxel_bounds(depth_image, camera_intrinsics, camera_pose, self._volume_origin,
+                                                    self._voxel_size, self._voxel_bounds, self._truncation_margin)
+        if np.any(voxel_max <= voxel_min):
+            return
+
+        t = self._tile_size
+        tiles = np.stack(np.meshgrid(*[np.arange(lo // t, (hi - 1) // t + 1) for lo, hi in zip(voxel_min, voxel_max)],
+                                     indexing='ij'), axis=-1).reshape(-1, 3)
+        tile_mins = tiles * t
+        tile_maxs = np.minimum(tile_mins + t, self._voxel_bounds)
+        visible = tiles_in_frustum(tile_mins, tile_maxs, self._volume_origin, self._voxel_size, depth_image,
+                                   camera_intrinsics, world_to_camera, self._truncation_margin)
+
+        # tiles are not meshed incrementally, the kernel flags into a scratch array
+        dirty_blocks = np.zeros((1, 1, 1), dtype=bool)
+        for tile, tile_min in zip(map(tuple, tiles[visible].tolist()), tile_mins[visible]):
+            tsdf_tile, weight_tile, color_tile = self._get_tile(tile)
+            integrate_kernel(
+                tsdf_tile,
+                weight_tile,
+                color_tile,
+                np.maximum(voxel_min - tile_min, 0),
+                np.minimum(voxel_max - tile_min, tsdf_tile.shape),
+                self._volume_origin + tile_min * self._voxel_size,
+                self._voxel_size,
+                self._truncation_margin,
+                color_image,
+                depth_image,
+                camera_intrinsics,
+                world_to_camera,
+                float(observation_weight),
+                self._tsdf_scale,
+                self._max_weight,
+                dirty_blocks,
+                t,
+                -1.0)
+            if tile in self._stored_tiles or weight_tile.any():
+                self._modified_tiles.add(tile)
+
+    def _get_tile_path(self, tile):
+        """Get the file a tile is stored in.
+
+        Args:
+            tile (tuple): tile coordinates along x, y and z.
+
+        Returns:
+            str: path of the tile file.
+        """
+        return os.path.join(self._directory, '{}_{}_{}.npz'.format(*tile))
+
+    def _get_tile(self, tile, create=True):
+        """Get the voxels of a tile, reading it from disk if it is not resident.
+
+        Args:
+            tile (tuple): tile coordinates along x, y and z.
+            create (bool, optional): create tiles that were never observed. Defaults to True.
+
+        Returns:
+            tuple: tsdf, weight and color arrays of the tile, updated in place by integrate.
+                None when the tile was never observed and create is False.
+        """
+        arrays = self._resident_tiles.get(tile)
+        if arrays is not None:
+            self._resident_tiles.move_to_end(tile)
+            return arrays
+
+        if tile in self._stored_tiles:
+            with np.load(self._get_tile_path(tile)) as tile_file:
+                arrays = (tile_file['tsdf'], tile_file['weight'], tile_file['color'])
+        elif create:
+            tile_min = np.array(tile) * self._tile_size
+            shape = tuple(np.minimum(tile_min + self._tile_size, self._voxel_bounds) - tile_min)
+            arrays = (np.full(shape, self._tsdf_scale, dtype=self._tsdf_dtype),
+                      np.zeros(shape, dtype=self._weight_dtype),
+                      np.zeros(shape + (3,), dtype=self._color_dtype))
+        else:
+            return None
+
+        while len(self._resident_tiles) >= self._max_resident_tiles:
+            self._evict_tile()
+        self._resident_tiles[tile] = arrays
+        return arrays
+
+    def _evict_tile(self):
+        """Drop the least recently used resident tile, writing it to disk if it was modified.
+        """
+        tile = next(iter(self._resident_tiles))
+        if tile in self._modified_tiles:
+            self._write_tile(tile)
+            self._modified_tiles.discard(tile)
+        del self._resident_tiles[tile]
+
+    def _write_tile(self, tile):
+        """Write a resident tile to its file.
+
+        Args:
+            tile (tuple): tile coordinates along x, y and z.
+        """
+        tsdf_tile, weight_tile, color_tile = self._resident_tiles[tile]
+        # written next to the tile first, so an interrupted write keeps the previous tile
+        path = self._get_tile_path(tile)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, tsdf=tsdf_tile, weight=weight_tile, color=color_tile)
+        os.replace(path + '.tmp', path)
+        self._stored_tiles.add(tile)
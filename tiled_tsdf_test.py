@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from tiled_tsdf import *
+
+
+class TestTiledTSDFVolume(unittest.TestCase):
+    """Unit test tiled_tsdf.py.
+    """
+
+    def setUp(self):
+        # a 64x48 camera looking down +z at a plane 0.5m away
+        self.camera_intrinsics = np.array([[60., 0., 32.],
+                                           [0., 60., 24.],
+                                           [0., 0., 1.]])
+        self.depth_image = np.full((48, 64), 0.5)
+        self.depth_image[:8, :8] = 0.  # missing depth
+        self.color_image = np.full((48, 64, 3), 120, dtype=np.uint8)
+        self.camera_pose = np.eye(4)
+        self.camera_pose[:3, 3] = [0.013, -0.021, 0.004]
+        # the camera only sees part of a wider volume
+        self.volume_bounds = np.array([[-0.6, 0.6], [-0.4, 0.4], [0., 0.7]])
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_integrate(self):
+        """Test TiledTSDFVolume.integrate and TiledTSDFVolume.get_mesh against the dense TSDFVolume.
+        """
+        volume = TiledTSDFVolume(self.directory, self.volume_bounds, voxel_size=0.02, tile_size=8,
+                                 max_resident_tiles=3)
+        dense = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02, mesh_block_size=8)
+        for depth_offset in [0., 0.01]:
+            volume.integrate(self.color_image, self.depth_image + depth_offset, self.camera_intrinsics,
+                             self.camera_pose)
+            dense.integrate(self.color_image, self.depth_image + depth_offset, self.camera_intrinsics,
+                            self.camera_pose)
+
+        # only the observed tiles were written, and only a few are kept in memory
+        self.assertLessEqual(volume.get_resident_tile_count(), 3)
+        self.assertGreater(volume.get_tile_count(), 3)
+        self.assertLess(volume.get_tile_count(), np.prod(-(-volume._voxel_bounds // 8)))
+
+        tsdf_volume, weight_volume, color_volume = volume.get_region(np.zeros(3, dtype=int), volume._voxel_bounds)
+        self.assertTrue(np.allclose(tsdf_volume, dense._tsdf_volume, atol=1e-5))
+        self.assertTrue(np.allclose(weight_volume, dense._weight_volume))
+        self.assertTrue(np.allclose(color_volume, dense._color_volume))
+
+        for min_weight in [None, 0.]:
+            points, triangles, normals, colors = volume.get_mesh(min_weight=min_weight)
+            expected = dense.get_mesh(min_weight=min_weight)
+            self.assertGreater(len(triangles), 0)
+            self.assertTrue(np.allclose(points, expected[0], atol=1e-5))
+            self.assertTrue(np.array_equal(triangles, expected[1]))
+            self.assertTrue(np.allclose(normals, expected[2], atol=1e-4))
+            self.assertTrue(np.array_equal(colors, expected[3]))
+
+    def test_load(self):
+        """Test TiledTSDFVolume.load resumes from the tiles written by flush.
+        """
+        volume = TiledTSDFVolume(self.directory, self.volume_bounds, voxel_size=0.02, tile_size=8,
+                                 tsdf_dtype=np.int16, weight_dtype=np.uint8, color_dtype=np.uint8)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+        volume.flush()
+
+        loaded = TiledTSDFVolume.load(self.directory, max_resident_tiles=2)
+        self.assertEqual(loaded.get_tile_count(), volume.get_tile_count())
+        self.assertEqual(loaded.get_resident_tile_count(), 0)
+        for volume in [volume, loaded]:
+            volume.integrate(self.color_image, self.depth_image + 0.01, self.camera_intrinsics, self.camera_pose)
+        for actual, expected in zip(loaded.get_region(np.zeros(3, dtype=int), loaded._voxel_bounds),
+                                    volume.get_region(np.zeros(3, dtype=int), volume._voxel_bounds)):
+            self.assertTrue(np.array_equal(actual, expected))
+
+        with self.assertRaises(ValueError):
+            TiledTSDFVolume(self.directory, self.volume_bounds, voxel_size=0.02)
+        with self.assertRaises(NameError):
+            TiledTSDFVolume.load(os.path.join(self.directory, 'missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
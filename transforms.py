@@ -1,3 +1,4 @@
+from functools import lru_cache
 from numba import njit, prange
 import numpy as np
 
@@ -35,12 +36,35 @@ def transform_is_valid(t, tolerance=1e-3):
 
     return real_check and inverse_check and det_check and last_row_check
 
-def transform_concat(t1, t2):
-    """[summary]
+def as_transform(t, check=True, name='t'):
+    """Get the 4x4 matrix of a transform, validating it unless it is a Pose.
 
     Args:
-        t1 (numpy.array [4, 4]): SE3 transform.
-        t2 (numpy.array [4, 4]): SE3 transform.
+        t (numpy.array [4, 4] or Pose): SE3 transform.
+        check (bool, optional): validate t with transform_is_valid. Poses were validated
+            when they were created and are never checked again. Defaults to True.
+        name (str, optional): name of the argument in error messages. Defaults to 't'.
+
+    Raises:
+        ValueError: If check is set and t is not a valid transform.
+
+    Returns:
+        numpy.array [4, 4]: The transform matrix.
+    """
+    if isinstance(t, Pose):
+        return t.matrix
+    t = np.asarray(t)
+    if check and not transform_is_valid(t):
+        raise ValueError('Invalid input transform ' + name)
+    return t
+
+def transform_concat(t1, t2, check=True):
+    """Concatenate two transforms.
+
+    Args:
+        t1 (numpy.array [4, 4] or Pose): SE3 transform.
+        t2 (numpy.array [4, 4] or Pose): SE3 transform.
+        check (bool, optional): validate the transforms. Defaults to True.
 
     Raises:
         ValueError: t1 is invalid.
@@ -49,43 +73,122 @@ def transform_concat(t1, t2):
     Returns:
         numpy.array [4, 4]: t1 * t2.
     """
-    if not transform_is_valid(t1):
-        raise ValueError('Invalid input transform t1')
-    if not transform_is_valid(t2):
-        raise ValueError('Invalid input transform t2')
+    t1 = as_transform(t1, check, 't1')
+    t2 = as_transform(t2, check, 't2')
 
     return np.matmul(t1, t2)
 
-def transform_point3s(t, ps):
+@njit(parallel=True, cache=True)
+def transform_points_kernel(rotation, translation, points, out):
+    """Compute R @ p + t for every point, in the precision of out.
+
+    Args:
+        rotation (numpy.array [3, 3]): rotation of the transform.
+        translation (numpy.array [3, ]): translation of the transform.
+        points (numpy.array [n, 3]): n 3D points (x, y, z).
+        out (numpy.array [n, 3]): transformed points, written in place. May be points.
+    """
+    for i in prange(points.shape[0]):
+        # read the whole point first, out may alias points
+        x, y, z = points[i, 0], points[i, 1], points[i, 2]
+        for j in range(3):
+            out[i, j] = rotation[j, 0] * x + rotation[j, 1] * y + rotation[j, 2] * z + translation[j]
+
+@njit(parallel=True, cache=True)
+def transform_points_batch_kernel(rotations, translations, points, out):
+    """Compute R @ p + t for every transform and every point.
+
+    Args:
+        rotations (numpy.array [f, 3, 3]): rotations of the transforms.
+        translations (numpy.array [f, 3]): translations of the transforms.
+        points (numpy.array [f, n, 3]): a point set per transform, or [1, n, 3] for a point
+            set shared by every transform.
+        out (numpy.array [f, n, 3]): transformed points, written in place.
+    """
+    point_count = out.shape[1]
+    shared = points.shape[0] == 1
+    for k in prange(out.shape[0] * point_count):
+        f = k // point_count
+        i = k % point_count
+        p = 0 if shared else f
+        x, y, z = points[p, i, 0], points[p, i, 1], points[p, i, 2]
+        for j in range(3):
+            out[f, i, j] = (rotations[f, j, 0] * x + rotations[f, j, 1] * y + rotations[f, j, 2] * z
+                            + translations[f, j])
+
+def transform_point3s(t, ps, check=True, out=None):
     """Transfrom 3D points from one space to another.
 
+    Points are transformed as R @ p + t, without homogeneous copies. float32 points stay
+    in float32, other points are transformed in float64.
+
     Args:
-        t (numpy.array [4, 4]): SE3 transform.
+        t (numpy.array [4, 4] or Pose): SE3 transform.
         ps (numpy.array [n, 3]): Array of n 3D points (x, y, z).
+        check (bool, optional): validate t. Defaults to True.
+        out (numpy.array [n, 3], optional): array the transformed points are written to,
+            ps itself to transform in place. Defaults to None, meaning a new array.
 
     Raises:
         ValueError: If t is not a valid transform.
-        ValueError: If ps does not have correct shape.
+        ValueError: If ps or out does not have correct shape.
 
     Returns:
         numpy.array [n, 3]: Transformed 3D points.
     """
-    if not transform_is_valid(t):
-        raise ValueError('Invalid input transform t')
+    t = as_transform(t, check)
+    ps = np.asarray(ps)
     if len(ps.shape) != 2 or ps.shape[1] != 3:
         raise ValueError('Invalid input points ps')
+    if out is None:
+        out = np.empty(ps.shape, dtype=np.float32 if ps.dtype == np.float32 else np.float64)
+    elif out.shape != ps.shape:
+        raise ValueError('Invalid output points out')
+
+    transform_points_kernel(t[:3, :3].astype(out.dtype), t[:3, 3].astype(out.dtype), ps, out)
+    return out
+
+def transform_point3s_batch(ts, ps, check=True):
+    """Transform point sets by many transforms at once.
+
+    Args:
+        ts (numpy.array [f, 4, 4]): f SE3 transforms.
+        ps (numpy.array [f, n, 3]): a set of n 3D points per transform, or [n, 3] for a
+            single point set transformed by every transform.
+        check (bool, optional): validate every transform. Defaults to True.
+
+    Raises:
+        ValueError: If a transform is not valid.
+        ValueError: If ts or ps does not have correct shape.
 
-    # convert to homogeneous
-    ps_homogeneous = np.hstack([ps, np.ones((len(ps), 1), dtype=np.float32)])
-    ps_transformed = np.dot(t, ps_homogeneous.T).T
+    Returns:
+        numpy.array [f, n, 3]: Transformed 3D points, in float32 for float32 points.
+    """
+    ts = np.asarray(ts)
+    ps = np.asarray(ps)
+    if len(ts.shape) != 3 or ts.shape[1:] != (4, 4):
+        raise ValueError('Invalid input transforms ts')
+    if check and not all(transform_is_valid(t) for t in ts):
+        raise ValueError('Invalid input transform in ts')
+    if len(ps.shape) == 2:
+        ps = ps[None]
+    if len(ps.shape) != 3 or ps.shape[2] != 3 or ps.shape[0] not in (1, len(ts)):
+        raise ValueError('Invalid input points ps')
 
-    return ps_transformed[:, :3]
+    dtype = np.float32 if ps.dtype == np.float32 else np.float64
+    out = np.empty((len(ts), ps.shape[1], 3), dtype=dtype)
+    transform_points_batch_kernel(np.ascontiguousarray(ts[:, :3, :3], dtype=dtype),
+                                  np.ascontiguousarray(ts[:, :3, 3], dtype=dtype), ps, out)
+    return out
 
-def transform_inverse(t):
+def transform_inverse(t, check=True):
     """Find the inverse of the transfom.
 
+    The inverse of [R | t] is computed in closed form as [R^T | -R^T t].
+
     Args:
-        t (numpy.array [4, 4]): SE3 transform.
+        t (numpy.array [4, 4] or Pose): SE3 transform.
+        check (bool, optional): validate t. Defaults to True.
 
     Raises:
         ValueError: If t is not a valid transform.
@@ -93,12 +196,110 @@ def transform_inverse(t):
     Returns:
         numpy.array [4, 4]: Inverse of the input transform.
     """
-    if not transform_is_valid(t):
-        raise ValueError('Invalid input transform t')
+    t = as_transform(t, check)
+
+    return transform_inverse_batch(t[None], check=False)[0]
+
+def transform_inverse_batch(ts, check=True):
+    """Find the inverses of many transforms at once.
+
+    Args:
+        ts (numpy.array [f, 4, 4]): f SE3 transforms.
+        check (bool, optional): validate every transform. Defaults to True.
+
+    Raises:
+        ValueError: If a transform is not valid.
+
+    Returns:
+        numpy.array [f, 4, 4]: Inverse of every input transform.
+    """
+    ts = np.asarray(ts)
+    if check and not all(transform_is_valid(t) for t in ts):
+        raise ValueError('Invalid input transform in ts')
+
+    rotations_t = np.swapaxes(ts[:, :3, :3], 1, 2)
+    inverses = np.zeros(ts.shape, dtype=np.result_type(ts.dtype, np.float32))
+    inverses[:, :3, :3] = rotations_t
+    inverses[:, :3, 3] = -np.einsum('fij,fj->fi', rotations_t, ts[:, :3, 3])
+    inverses[:, 3, 3] = 1.
+    return inverses
+
+class Pose(object):
+    """SE3 transform validated once, when it is created.
+
+    Functions of this module taking a transform accept a Pose as well and skip their
+    validation for it, as do the volumes' integrate methods.
+    """
+
+    def __init__(self, t, check=True):
+        """Initialize the pose.
+
+        Args:
+            t (numpy.array [4, 4] or Pose): SE3 transform.
+            check (bool, optional): validate t. Only disable for transforms known to be
+                valid, such as products and inverses of poses. Defaults to True.
 
-    return np.linalg.inv(t)
+        Raises:
+            ValueError: If t is not a valid transform.
+        """
+        matrix = np.array(as_transform(t, check), dtype=np.float64)
+        matrix.setflags(write=False)
+        self._matrix = matrix
 
-@njit(parallel=True)
+    @property
+    def matrix(self):
+        """numpy.array [4, 4]: The read only transform matrix."""
+        return self._matrix
+
+    @property
+    def rotation(self):
+        """numpy.array [3, 3]: The rotation of the transform."""
+        return self._matrix[:3, :3]
+
+    @property
+    def translation(self):
+        """numpy.array [3, ]: The translation of the transform."""
+        return self._matrix[:3, 3]
+
+    def __array__(self, dtype=None, copy=None):
+        return self._matrix.astype(dtype or self._matrix.dtype)
+
+    def __matmul__(self, other):
+        """Concatenate two poses.
+
+        Args:
+            other (Pose): transform applied first.
+
+        Returns:
+            Pose: self * other.
+        """
+        return Pose(np.matmul(self._matrix, as_transform(other)), check=False)
+
+    def __repr__(self):
+        return 'Pose({})'.format(self._matrix.tolist())
+
+    def inverse(self):
+        """Find the inverse of the pose in closed form.
+
+        Returns:
+            Pose: Inverse of the pose.
+        """
+        return Pose(transform_inverse(self._matrix, check=False), check=False)
+
+    def transform_points(self, ps, out=None):
+        """Transform 3D points, see transform_point3s.
+
+        Args:
+            ps (numpy.array [n, 3]): Array of n 3D points (x, y, z).
+            out (numpy.array [n, 3], optional): array the transformed points are written to.
+                Defaults to None, meaning a new array.
+
+        Returns:
+            numpy.array [n, 3]: Transformed 3D points.
+        """
+        return transform_point3s(self._matrix, ps, check=False, out=out)
+
+@njit(parallel=True, cache=True)
 def camera_to_image(intrinsics, camera_points):
     """Project points in camera space to the image plane.
 
@@ -131,24 +332,144 @@ def camera_to_image(intrinsics, camera_points):
 
     return image_coordinates
 
-def depth_to_point_cloud(intrinsics, depth_image):
+@lru_cache(maxsize=16)
+def _camera_rays(fu, fv, u0, v0, height, width):
+    """Compute the ray table of camera_rays, cached by camera parameters and image size.
+    """
+    ray_x = (np.arange(width) - u0) / fu
+    ray_y = (np.arange(height) - v0) / fv
+    # shared between calls, make sure no caller modifies them
+    ray_x.setflags(write=False)
+    ray_y.setflags(write=False)
+    return ray_x, ray_y
+
+def camera_rays(intrinsics, height, width):
+    """Get the ray table of a pinhole camera, computed once per camera and image size.
+
+    The back projection of pixel (u, v) at depth z is (ray_x[u] * z, ray_y[v] * z, z).
+
+    Args:
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        height (int): image height in pixels.
+        width (int): image width in pixels.
+
+    Raises:
+        ValueError: If intrinsics are not the correct shape.
+
+    Returns:
+        numpy.array [w, ]: x / z of the rays through every pixel column.
+        numpy.array [h, ]: y / z of the rays through every pixel row.
+    """
+    intrinsics = np.asarray(intrinsics)
+    if intrinsics.shape != (3, 3):
+        raise ValueError('Invalid input intrinsics')
+    return _camera_rays(float(intrinsics[0, 0]), float(intrinsics[1, 1]), float(intrinsics[0, 2]),
+                        float(intrinsics[1, 2]), int(height), int(width))
+
+@njit(cache=True)
+def back_project_kernel(depth_image, ray_x, ray_y, min_depth, max_depth, camera_pose, color_image):
+    """Back project the pixels of a depth image within a depth range.
+
+    Args:
+        depth_image (numpy.array [h, w]): each entry is a z depth value.
+        ray_x (numpy.array [w, ]): x / z of the rays through every pixel column.
+        ray_y (numpy.array [h, ]): y / z of the rays through every pixel row.
+        min_depth (float): smallest depth kept, pixels without depth (<= 0) are always skipped.
+        max_depth (float): largest depth kept.
+        camera_pose (numpy.array [4, 4]): SE3 transform applied to the points, or an empty
+            array to keep them in camera coordinates.
+        color_image (numpy.array [h, w, 3]): An rgb image, or an empty image to skip colors.
+
+    Returns:
+        numpy.array [n, 3]: each row represents a different valid 3D point.
+        numpy.array [n, 3]: each row represents the color of the corresponding 3D point,
+            with no rows when color_image is empty.
+    """
+    height, width = depth_image.shape
+    # count first so the outputs are allocated at their final size
+    n = 0
+    for v in range(height):
+        for u in range(width):
+            z = depth_image[v, u]
+            n += (z > 0) & (z >= min_depth) & (z <= max_depth)
+
+    transform = camera_pose.shape[0] > 0
+    with_colors = color_image.shape[0] > 0
+    points = np.empty((n, 3))
+    colors = np.empty((n if with_colors else 0, 3), dtype=color_image.dtype)
+    i = 0
+    for v in range(height):
+        for u in range(width):
+            z = depth_image[v, u]
+            if not (z > 0 and z >= min_depth and z <= max_depth):
+                continue
+            x = ray_x[u] * z
+            y = ray_y[v] * z
+            if transform:
+                for j in range(3):
+                    points[i, j] = (camera_pose[j, 0] * x + camera_pose[j, 1] * y
+                                    + camera_pose[j, 2] * z + camera_pose[j, 3])
+            else:
+                points[i, 0] = x
+                points[i, 1] = y
+                points[i, 2] = z
+            if with_colors:
+                for c in range(3):
+                    colors[i, c] = color_image[v, u, c]
+            i += 1
+    return points, colors
+
+def depth_to_point_cloud(intrinsics, depth_image, stride=1, roi=None, depth_range=None, color_image=None,
+                         camera_pose=None):
     """Back project a depth image to a point cloud.
-        Note: point clouds are unordered, so any permutation of points in the list is acceptable.
+        Note: points are ordered by pixel row, then pixel column.
         Note: Only output those points whose depth > 0.
 
     Args:
         intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
         depth_image (numpy.array [h, w]): each entry is a z depth value.
+        stride (int, optional): only back project every stride-th pixel along u and v.
+            Defaults to 1.
+        roi (tuple, optional): (u_min, v_min, u_max, v_max) pixel bounds of the region to
+            back project, the max bounds are excluded. Defaults to None, meaning the whole image.
+        depth_range (tuple, optional): (min_depth, max_depth), only output the points whose
+            depth lies within these bounds. Defaults to None.
+        color_image (numpy.array [h, w, 3], optional): An rgb image aligned with the depth
+            image, the color of every point is returned as well. Defaults to None.
+        camera_pose (numpy.array [4, 4] or Pose, optional): SE3 transform representing pose
+            (camera to world), the points are returned in world coordinates. Defaults to None,
+            meaning camera coordinates.
+
+    Raises:
+        ValueError: If stride is not positive.
+        ValueError: If the color image does not match the depth image.
+        ValueError: If camera_pose is not a valid transform.
 
     Returns:
         numpy.array [n, 3]: each row represents a different valid 3D point.
+        numpy.array [n, 3]: each row represents the color of the corresponding 3D point,
+            only returned when color_image is given.
     """
-    point_cloud= np.empty(shape=[0, 3])
-    it = np.nditer(depth_image, flags=['multi_index'])
-    for a in it:
-      if a > 0:
-        x=(it.multi_index[1]-intrinsics[0][2])/intrinsics[0][0]*a
-        y=(it.multi_index[0]-intrinsics[1][2])/intrinsics[1][1]*a
-        z=a
-        point_cloud=np.append(point_cloud, [[x, y, z]], axis=0)
-    return point_cloud
+    depth_image = np.asarray(depth_image)
+    height, width = depth_image.shape
+    ray_x, ray_y = camera_rays(intrinsics, height, width)
+    if stride < 1:
+        raise ValueError('stride must be positive.')
+    if color_image is not None and color_image.shape[:2] != depth_image.shape:
+        raise ValueError('color_image should have the size of depth_image.')
+    if camera_pose is not None:
+        camera_pose = as_transform(camera_pose, name='camera_pose')
+
+    u_min, v_min, u_max, v_max = (0, 0, width, height) if roi is None else roi
+    rows = slice(max(v_min, 0), min(v_max, height), stride)
+    cols = slice(max(u_min, 0), min(u_max, width), stride)
+
+    min_depth, max_depth = (0.0, np.inf) if depth_range is None else depth_range
+    pose = np.empty((0, 4)) if camera_pose is None else np.asarray(camera_pose, dtype=np.float64)
+    colors = np.empty((0, 0, 3), dtype=np.uint8) if color_image is None else color_image[rows, cols]
+    point_cloud, point_colors = back_project_kernel(
+        depth_image[rows, cols], ray_x[cols], ray_y[rows], float(min_depth), float(max_depth), pose, colors)
+
+    if color_image is None:
+        return point_cloud
+    return point_cloud, point_colors
@@ -91,6 +91,59 @@ class TestTransforms(unittest.TestCase):
         self.assertTrue(np.isclose(np.matmul(t, t_inv), np.eye(4)).all())
         self.assertTrue(np.isclose(np.matmul(t_inv, t), np.eye(4)).all())
 
+    def test_transform_batch(self):
+        """Test transforms.transform_point3s_batch and transforms.transform_inverse_batch.
+        """
+        np.random.seed(8)
+        ts = np.tile(np.eye(4), (3, 1, 1))
+        for t in ts:
+            t[:3, :3] = self._rand_rotation_matrix()
+            t[:3, 3] = np.random.uniform(-1, 1, 3)
+        ps = np.random.uniform(-1, 1, (3, 5, 3))
+
+        transformed = transform_point3s_batch(ts, ps)
+        shared = transform_point3s_batch(ts, ps[0].astype(np.float32))
+        inverses = transform_inverse_batch(ts)
+        for f in range(3):
+            self.assertTrue(np.allclose(transformed[f], transform_point3s(ts[f], ps[f])))
+            self.assertTrue(np.allclose(shared[f], transform_point3s(ts[f], ps[0]), atol=1e-6))
+            self.assertTrue(np.allclose(np.matmul(ts[f], inverses[f]), np.eye(4)))
+        self.assertEqual(shared.dtype, np.float32)
+
+        ts[1, 3, 0] = 1.
+        with self.assertRaises(ValueError):
+            transform_point3s_batch(ts, ps)
+        with self.assertRaises(ValueError):
+            transform_inverse_batch(ts)
+        transform_inverse_batch(ts, check=False)
+
+    def test_pose(self):
+        """Test transforms.Pose.
+        """
+        np.random.seed(8)
+        t = np.eye(4)
+        t[:3, :3] = self._rand_rotation_matrix()
+        t[:3, 3] = [1., -2., 0.5]
+        pose = Pose(t)
+        ps = np.random.uniform(-1, 1, (10, 3)).astype(np.float32)
+
+        self.assertTrue(np.array_equal(pose.matrix, t))
+        self.assertTrue(np.allclose((pose.inverse() @ pose).matrix, np.eye(4)))
+        self.assertTrue(np.allclose(transform_concat(pose, pose), np.matmul(t, t)))
+
+        # float32 points stay float32, and can be transformed in place
+        expected = transform_point3s(t, ps.astype(np.float64))
+        transformed = pose.transform_points(ps)
+        self.assertEqual(transformed.dtype, np.float32)
+        self.assertTrue(np.allclose(transformed, expected, atol=1e-6))
+        pose.transform_points(ps, out=ps)
+        self.assertTrue(np.array_equal(ps, transformed))
+
+        with self.assertRaises(ValueError):
+            Pose(np.ones((4, 4)))
+        with self.assertRaises(ValueError):
+            pose.matrix[0, 0] = 2.
+
     def test_camera_to_image(self):
         """Test transforms.camera_to_image.
         """
@@ -148,6 +201,46 @@ class TestTransforms(unittest.TestCase):
 
         self.assertTrue(valid_cloud)
 
+    def test_depth_to_point_cloud_options(self):
+        """Test transforms.depth_to_point_cloud with striding, crops, depth range, colors and pose.
+        """
+        np.random.seed(8)
+        camera_intrinsics = np.array([[50., 0., 20.],
+                                      [0., 55., 15.],
+                                      [0., 0., 1.]])
+        depth_image = np.random.uniform(0.2, 2., (30, 40))
+        depth_image[np.random.uniform(size=(30, 40)) < 0.3] = 0.
+        color_image = np.random.randint(0, 256, (30, 40, 3)).astype(np.uint8)
+        camera_pose = np.eye(4)
+        camera_pose[:3, :3] = self._rand_rotation_matrix()
+        camera_pose[:3, 3] = [0.5, -1., 2.]
+
+        # reference back projection, pixel by pixel
+        expected_points, expected_colors = [], []
+        for v in range(3, 25, 2):
+            for u in range(10, 40, 2):
+                z = depth_image[v, u]
+                if 0.5 <= z <= 1.5:
+                    point = [(u - 20.) / 50. * z, (v - 15.) / 55. * z, z, 1.]
+                    expected_points.append(np.dot(camera_pose, point)[:3])
+                    expected_colors.append(color_image[v, u])
+
+        points, colors = depth_to_point_cloud(camera_intrinsics, depth_image, stride=2, roi=(10, 3, 60, 25),
+                                              depth_range=(0.5, 1.5), color_image=color_image,
+                                              camera_pose=camera_pose)
+        self.assertTrue(np.allclose(points, expected_points))
+        self.assertTrue(np.array_equal(colors, expected_colors))
+
+        # the defaults output every pixel with a depth in camera coordinates
+        points = depth_to_point_cloud(camera_intrinsics, depth_image)
+        self.assertEqual(len(points), np.count_nonzero(depth_image))
+        self.assertTrue(np.array_equal(points[:, 2], depth_image[depth_image > 0]))
+
+        with self.assertRaises(ValueError):
+            depth_to_point_cloud(camera_intrinsics, depth_image, stride=0)
+        with self.assertRaises(ValueError):
+            depth_to_point_cloud(camera_intrinsics, depth_image, camera_pose=np.ones((4, 4)))
+
     def _rand_rotation_matrix(self):
         """Creates a random rotation matrix.
             Based on code from here:
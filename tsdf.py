@@ -1,22 +1,1017 @@
-from skimage import measure
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+from instrumentation import FrameStats, IntegrationStats
+import io
+import json
+from meshing import marching_cubes_block, merge_meshes, observed_cube_mask
+import multiprocessing
+import os
 from transforms import *
 
 
+def unique_indices(indices):
+    """Sort and deduplicate an array of integer indices.
+
+    Args:
+        indices (numpy.array [n, ]): integer indices, duplicates allowed.
+
+    Returns:
+        numpy.array [m, ]: the distinct indices in increasing order.
+    """
+    indices = np.sort(indices)
+    if len(indices) == 0:
+        return indices
+    return indices[np.concatenate([[True], indices[1:] != indices[:-1]])]
+
+
+@njit(cache=True)
+def project_voxel(world_x, world_y, world_z, world_to_camera, intrinsics, depth_image, truncation_margin, max_depth):
+    """Project a voxel center into the depth image and compute its truncated signed distance.
+
+    Args:
+        world_x (float): x coordinate of the voxel center in world coordinates.
+        world_y (float): y coordinate of the voxel center in world coordinates.
+        world_z (float): z coordinate of the voxel center in world coordinates.
+        world_to_camera (numpy.array [4, 4]): SE3 transform from world to camera coordinates.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        depth_image (numpy.array [h, w]): A z depth image.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+        max_depth (float): largest depth of depth_image. Voxels further than the truncation
+            margin behind it are not valid, whichever pixel they project to, so the frustum
+            of frustum_voxel_bounds holds every valid voxel whatever the camera orientation.
+
+    Returns:
+        int: u pixel coordinate of the voxel, -1 if the voxel is not valid.
+        int: v pixel coordinate of the voxel, -1 if the voxel is not valid.
+        float: tsdf value of the observation clipped to [-1, 1].
+    """
+    # world to camera
+    camera_x = (world_to_camera[0, 0] * world_x + world_to_camera[0, 1] * world_y
+                + world_to_camera[0, 2] * world_z + world_to_camera[0, 3])
+    camera_y = (world_to_camera[1, 0] * world_x + world_to_camera[1, 1] * world_y
+                + world_to_camera[1, 2] * world_z + world_to_camera[1, 3])
+    camera_z = (world_to_camera[2, 0] * world_x + world_to_camera[2, 1] * world_y
+                + world_to_camera[2, 2] * world_z + world_to_camera[2, 3])
+    if camera_z <= 0 or camera_z > max_depth + truncation_margin:
+        return -1, -1, 0.0
+
+    # camera to image, skipping voxels outside of the image bounds
+    u = int(np.round(camera_x * intrinsics[0, 0] / camera_z + intrinsics[0, 2]))
+    v = int(np.round(camera_y * intrinsics[1, 1] / camera_z + intrinsics[1, 2]))
+    if u < 0 or u >= depth_image.shape[1] or v < 0 or v >= depth_image.shape[0]:
+        return -1, -1, 0.0
+
+    depth = depth_image[v, u]
+    if depth <= 0:
+        return -1, -1, 0.0
+
+    return u, v, min(1.0, max(-1.0, (depth - camera_z) / truncation_margin))
+
+
+@njit(cache=True)
+def update_voxel(tsdf_volume, weight_volume, color_volume, index, color_image, u, v,
+                 margin_distance, observation_weight, tsdf_scale, max_weight):
+    """Fold one observation into the running weighted averages of a single voxel.
+
+    Tsdf values are stored multiplied by tsdf_scale (rounded for integer volumes) and
+    weights saturate at max_weight, so compact volume layouts are updated in place.
+
+    Args:
+        tsdf_volume (numpy.array): tsdf values, updated in place.
+        weight_volume (numpy.array): accumulated weights, updated in place.
+        color_volume (numpy.array): rgb colors (last axis), updated in place.
+        index (tuple): index of the voxel into tsdf_volume and weight_volume.
+        color_image (numpy.array [h, w, 3]): An rgb image.
+        u (int): u pixel coordinate the voxel projects to.
+        v (int): v pixel coordinate the voxel projects to.
+        margin_distance (float): tsdf value of the observation.
+        observation_weight (float): Weight to give the observation.
+        tsdf_scale (float): value a stored tsdf of 1 is represented by.
+        max_weight (float): largest weight that can be stored.
+    """
+    w_old = float(weight_volume[index])
+    w_new = w_old + observation_weight
+    tsdf_new = (w_old * tsdf_volume[index] / tsdf_scale + observation_weight * margin_distance) / w_new
+    if tsdf_scale == 1.0:
+        tsdf_volume[index] = tsdf_new
+    else:
+        tsdf_volume[index] = np.round(tsdf_new * tsdf_scale)
+    weight_volume[index] = min(w_new, max_weight)
+
+    # colors are stored as whole rgb values in [0, 255]
+    for c in range(3):
+        color = (w_old * color_volume[index + (c,)] + observation_weight * color_image[v, u, c]) / w_new
+        color_volume[index + (c,)] = min(255.0, max(0.0, np.floor(color)))
+
+
+@njit(parallel=True, cache=True)
+def tsdf_and_weights_kernel(tsdf_old, margin_distance, w_old, observation_weight, tsdf_scale, max_weight):
+    """Compute TSDFVolume.get_new_tsdf_and_weights for a resolved max_weight.
+
+    Args:
+        tsdf_old (numpy.array [v, ]): old tsdf values, stored multiplied by tsdf_scale.
+        margin_distance (numpy.array [v, ]): tsdf values of the observation.
+        w_old (numpy.array [v, ]): old weight values.
+        observation_weight (float): Weight to give each new observation.
+        tsdf_scale (float): value a stored tsdf of 1 is represented by.
+        max_weight (float): largest weight that can be stored.
+
+    Returns:
+        numpy.array [v, ]: new tsdf values, stored like tsdf_old.
+        numpy.array [v, ]: new weights, stored like w_old.
+    """
+    tsdf_new = np.empty_like(tsdf_old)
+    w_new = np.empty_like(w_old)
+
+    for i in prange(0, len(tsdf_old)):
+        w = w_old[i] + observation_weight
+        tsdf = (w_old[i] * tsdf_old[i] / tsdf_scale + observation_weight * margin_distance[i]) / w
+        if tsdf_scale == 1.0:
+            tsdf_new[i] = tsdf
+        else:
+            tsdf_new[i] = np.round(tsdf * tsdf_scale)
+        w_new[i] = min(w, max_weight)
+    return tsdf_new, w_new
+
+
+@njit(cache=True)
+def mark_dirty_blocks(dirty_blocks, x, y, z_min, z_max, block_size):
+    """Flag the mesh blocks owning a marching cube with a corner in a run of voxels along z.
+
+    A block owns the cubes whose lowest corner falls inside it, so voxels on the low
+    faces of a block also flag the neighbouring blocks below it.
+
+    Args:
+        dirty_blocks (numpy.array [p, q, r]): one flag per mesh block, updated in place.
+        x (int): x index of the voxels.
+        y (int): y index of the voxels.
+        z_min (int): z index of the first voxel of the run.
+        z_max (int): z index of the last voxel of the run.
+        block_size (int): side length of the mesh blocks in voxels.
+    """
+    for block_x in range(max(x - 1, 0) // block_size, x // block_size + 1):
+        for block_y in range(max(y - 1, 0) // block_size, y // block_size + 1):
+            for block_z in range(max(z_min - 1, 0) // block_size, z_max // block_size + 1):
+                dirty_blocks[block_x, block_y, block_z] = True
+
+
+@njit(parallel=True, cache=True)
+def truncation_band_voxels(depth_image, intrinsics, camera_to_world, volume_origin, voxel_size,
+                           truncation_margin):
+    """Find the voxels lying within the truncation band of the observed depth.
+
+    Each valid depth pixel is back projected and sampled every half voxel along its ray
+    from depth - truncation_margin to depth + truncation_margin.
+
+    Args:
+        depth_image (numpy.array [h, w]): A z depth image.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        camera_to_world (numpy.array [4, 4]): SE3 transform representing pose (camera to world)
+        volume_origin (numpy.array [3, ]): world coordinates of voxel (0, 0, 0).
+        voxel_size (float): The side length of each voxel in meters.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+
+    Returns:
+        numpy.array [h, w, s, 3]: voxel coordinates of the s samples along each pixel ray.
+        numpy.array [h, w]: True for pixels with a valid depth, whose samples should be used.
+    """
+    image_height, image_width = depth_image.shape
+    fu = intrinsics[0, 0]
+    fv = intrinsics[1, 1]
+    u0 = intrinsics[0, 2]
+    v0 = intrinsics[1, 2]
+    step_count = int(np.ceil(4 * truncation_margin / voxel_size)) + 1
+    step = 2 * truncation_margin / (step_count - 1)
+
+    samples = np.empty((image_height, image_width, step_count, 3), dtype=np.int64)
+    valid = np.zeros((image_height, image_width), dtype=np.bool_)
+    for v in prange(image_height):
+        for u in range(image_width):
+            depth = depth_image[v, u]
+            if depth <= 0:
+                continue
+            valid[v, u] = True
+            ray_x = (u - u0) / fu
+            ray_y = (v - v0) / fv
+            for s in range(step_count):
+                camera_z = depth - truncation_margin + s * step
+                camera_x = ray_x * camera_z
+                camera_y = ray_y * camera_z
+                for j in range(3):
+                    world = (camera_to_world[j, 0] * camera_x + camera_to_world[j, 1] * camera_y
+                             + camera_to_world[j, 2] * camera_z + camera_to_world[j, 3])
+                    samples[v, u, s, j] = int(np.round((world - volume_origin[j]) / voxel_size))
+
+    return samples, valid
+
+
+@njit(parallel=True, cache=True)
+def integrate_kernel(tsdf_volume, weight_volume, color_volume, voxel_min, voxel_max, volume_origin,
+                     voxel_size, truncation_margin, color_image, depth_image, intrinsics, world_to_camera,
+                     observation_weight, tsdf_scale, max_weight, dirty_blocks, block_size,
+                     mask_weight):
+    """Fuse one RGB-D observation into the voxel volumes in a single parallel pass.
+
+    Every voxel in [voxel_min, voxel_max) is projected into the image, tested for validity,
+    compared against the observed depth and has its tsdf, weight and color updated in place.
+    No per-voxel intermediate arrays are allocated.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf values, updated in place.
+        weight_volume (numpy.array [l, w, h]): accumulated weights, updated in place.
+        color_volume (numpy.array [l, w, h, 3]): rgb colors, updated in place.
+        voxel_min (numpy.array [3, ]): first voxel index to visit along x, y and z.
+        voxel_max (numpy.array [3, ]): one past the last voxel index to visit along x, y and z.
+        volume_origin (numpy.array [3, ]): world coordinates of voxel (0, 0, 0).
+        voxel_size (float): The side length of each voxel in meters.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+        color_image (numpy.array [h, w, 3]): An rgb image.
+        depth_image (numpy.array [h, w]): A z depth image.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        world_to_camera (numpy.array [4, 4]): SE3 transform from world to camera coordinates.
+        observation_weight (float): Weight to give the observation.
+        tsdf_scale (float): value a stored tsdf of 1 is represented by.
+        max_weight (float): largest weight that can be stored.
+        dirty_blocks (numpy.array [p, q, r]): mesh block flags, set around every voxel whose tsdf is
+            below 1 before or after the update, or whose weight was at most mask_weight, as the
+            surface or the observation mask may have changed there.
+        block_size (int): side length of the mesh blocks in voxels.
+        mask_weight (float): weight up to which voxels are masked out of the mesh, -1 when
+            the mesh is not masked.
+    """
+    max_depth = depth_image.max()
+    for x in prange(voxel_min[0], voxel_max[0]):
+        world_x = volume_origin[0] + x * voxel_size
+        for y in range(voxel_min[1], voxel_max[1]):
+            world_y = volume_origin[1] + y * voxel_size
+            # range of voxels along z where the mesh may change
+            z_min, z_max = voxel_max[2], -1
+            for z in range(voxel_min[2], voxel_max[2]):
+                world_z = volume_origin[2] + z * voxel_size
+                u, v, margin_distance = project_voxel(
+                    world_x, world_y, world_z, world_to_camera, intrinsics, depth_image, truncation_margin, max_depth)
+                if u < 0:
+                    continue
+                if (margin_distance < 1.0 or tsdf_volume[x, y, z] < tsdf_scale
+                        or weight_volume[x, y, z] <= mask_weight):
+                    z_min, z_max = min(z_min, z), max(z_max, z)
+                update_voxel(tsdf_volume, weight_volume, color_volume, (x, y, z), color_image, u, v,
+                             margin_distance, observation_weight, tsdf_scale, max_weight)
+            if z_max >= 0:
+                mark_dirty_blocks(dirty_blocks, x, y, z_min, z_max, block_size)
+
+
+@njit(parallel=True, cache=True)
+def integrate_voxels_kernel(tsdf_volume, weight_volume, color_volume, voxel_indices, volume_origin,
+                            voxel_size, truncation_margin, color_image, depth_image, intrinsics,
+                            world_to_camera, observation_weight, tsdf_scale, max_weight, dirty_blocks,
+                            block_size, mask_weight):
+    """Fuse one RGB-D observation into a list of voxels in a single parallel pass.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf values, updated in place.
+        weight_volume (numpy.array [l, w, h]): accumulated weights, updated in place.
+        color_volume (numpy.array [l, w, h, 3]): rgb colors, updated in place.
+        voxel_indices (numpy.array [n, ]): unique flat (C-order) indices of the voxels to update.
+        volume_origin (numpy.array [3, ]): world coordinates of voxel (0, 0, 0).
+        voxel_size (float): The side length of each voxel in meters.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+        color_image (numpy.array [h, w, 3]): An rgb image.
+        depth_image (numpy.array [h, w]): A z depth image.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        world_to_camera (numpy.array [4, 4]): SE3 transform from world to camera coordinates.
+        observation_weight (float): Weight to give the observation.
+        tsdf_scale (float): value a stored tsdf of 1 is represented by.
+        max_weight (float): largest weight that can be stored.
+        dirty_blocks (numpy.array [p, q, r]): mesh block flags, set around every voxel whose tsdf is
+            below 1 before or after the update, or whose weight was at most mask_weight, as the
+            surface or the observation mask may have changed there.
+        block_size (int): side length of the mesh blocks in voxels.
+        mask_weight (float): weight up to which voxels are masked out of the mesh, -1 when
+            the mesh is not masked.
+    """
+    max_depth = depth_image.max()
+    size_y = tsdf_volume.shape[1]
+    size_z = tsdf_volume.shape[2]
+    for i in prange(len(voxel_indices)):
+        x, yz = divmod(voxel_indices[i], size_y * size_z)
+        y, z = divmod(yz, size_z)
+        u, v, margin_distance = project_voxel(
+            volume_origin[0] + x * voxel_size, volume_origin[1] + y * voxel_size, volume_origin[2] + z * voxel_size,
+            world_to_camera, intrinsics, depth_image, truncation_margin, max_depth)
+        if u < 0:
+            continue
+        if (margin_distance < 1.0 or tsdf_volume[x, y, z] < tsdf_scale
+                or weight_volume[x, y, z] <= mask_weight):
+            mark_dirty_blocks(dirty_blocks, x, y, z, z, block_size)
+        update_voxel(tsdf_volume, weight_volume, color_volume, (x, y, z), color_image, u, v,
+                     margin_distance, observation_weight, tsdf_scale, max_weight)
+
+
+@njit(parallel=True, cache=True)
+def integrate_batch_kernel(tsdf_volume, weight_volume, color_volume, voxel_min, voxel_max, volume_origin,
+                           voxel_size, truncation_margin, color_images, depth_images, intrinsics,
+                           world_to_cameras, observation_weights, tsdf_scale, max_weight, dirty_blocks,
+                           block_size, mask_weight, tile_size):
+    """Fuse a batch of RGB-D observations into the voxel volumes in a single parallel pass.
+
+    The volume is split into cubic tiles that are processed in parallel, and each tile
+    folds in the frames of the batch in order. This gives the same result as integrating
+    the frames one after the other, while every voxel is loaded from memory once per batch
+    and a tile only touches a small patch of each image.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf values, updated in place.
+        weight_volume (numpy.array [l, w, h]): accumulated weights, updated in place.
+        color_volume (numpy.array [l, w, h, 3]): rgb colors, updated in place.
+        voxel_min (numpy.array [f, 3]): first voxel index inside the frustum of each frame.
+        voxel_max (numpy.array [f, 3]): one past the last voxel index inside the frustum of each frame.
+        volume_origin (numpy.array [3, ]): world coordinates of voxel (0, 0, 0).
+        voxel_size (float): The side length of each voxel in meters.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+        color_images (numpy.array [f, h, w, 3]): rgb images.
+        depth_images (numpy.array [f, h, w]): z depth images.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        world_to_cameras (numpy.array [f, 4, 4]): SE3 transforms from world to camera coordinates.
+        observation_weights (numpy.array [f, ]): Weight to give each observation.
+        tsdf_scale (float): value a stored tsdf of 1 is represented by.
+        max_weight (float): largest weight that can be stored.
+        dirty_blocks (numpy.array [p, q, r]): mesh block flags, set around every voxel whose tsdf is
+            below 1 before or after the update, or whose weight was at most mask_weight, as the
+            surface or the observation mask may have changed there.
+        block_size (int): side length of the mesh blocks in voxels.
+        mask_weight (float): weight up to which voxels are masked out of the mesh, -1 when
+            the mesh is not masked.
+        tile_size (int): side length of the tiles in voxels.
+    """
+    frame_count = len(depth_images)
+    max_depths = np.empty(frame_count)
+    for f in range(frame_count):
+        max_depths[f] = depth_images[f].max()
+    batch_min = np.empty(3, dtype=np.int64)
+    tile_counts = np.empty(3, dtype=np.int64)
+    for j in range(3):
+        batch_min[j] = voxel_min[:, j].min()
+        tile_counts[j] = max(0, (voxel_max[:, j].max() - batch_min[j] + tile_size - 1) // tile_size)
+
+    for tile in prange(tile_counts[0] * tile_counts[1] * tile_counts[2]):
+        tile_x, tile_yz = divmod(tile, tile_counts[1] * tile_counts[2])
+        tile_y, tile_z = divmod(tile_yz, tile_counts[2])
+        x0 = batch_min[0] + tile_x * tile_size
+        y0 = batch_min[1] + tile_y * tile_size
+        z0 = batch_min[2] + tile_z * tile_size
+
+        for f in range(frame_count):
+            world_to_camera = world_to_cameras[f]
+            depth_image = depth_images[f]
+            max_depth = max_depths[f]
+            color_image = color_images[f]
+            for x in range(max(x0, voxel_min[f, 0]), min(x0 + tile_size, voxel_max[f, 0])):
+                world_x = volume_origin[0] + x * voxel_size
+                for y in range(max(y0, voxel_min[f, 1]), min(y0 + tile_size, voxel_max[f, 1])):
+                    world_y = volume_origin[1] + y * voxel_size
+                    z_min, z_max = z0 + tile_size, -1
+                    for z in range(max(z0, voxel_min[f, 2]), min(z0 + tile_size, voxel_max[f, 2])):
+                        world_z = volume_origin[2] + z * voxel_size
+                        u, v, margin_distance = project_voxel(
+                            world_x, world_y, world_z, world_to_camera, intrinsics, depth_image, truncation_margin, max_depth)
+                        if u < 0:
+                            continue
+                        if (margin_distance < 1.0 or tsdf_volume[x, y, z] < tsdf_scale
+                                or weight_volume[x, y, z] <= mask_weight):
+                            z_min, z_max = min(z_min, z), max(z_max, z)
+                        update_voxel(tsdf_volume, weight_volume, color_volume, (x, y, z), color_image, u, v,
+                                     margin_distance, observation_weights[f], tsdf_scale, max_weight)
+                    if z_max >= 0:
+                        mark_dirty_blocks(dirty_blocks, x, y, z_min, z_max, block_size)
+
+
+@njit(parallel=True, cache=True)
+def count_valid_voxels_kernel(voxel_min, voxel_max, volume_origin, voxel_size, truncation_margin, depth_image,
+                              intrinsics, world_to_camera):
+    """Count the voxels of a box that project onto a valid depth, the ones integrate_kernel updates.
+
+    Args:
+        voxel_min (numpy.array [3, ]): first voxel index to visit along x, y and z.
+        voxel_max (numpy.array [3, ]): one past the last voxel index to visit along x, y and z.
+        volume_origin (numpy.array [3, ]): world coordinates of voxel (0, 0, 0).
+        voxel_size (float): The side length of each voxel in meters.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+        depth_image (numpy.array [h, w]): A z depth image.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        world_to_camera (numpy.array [4, 4]): SE3 transform from world to camera coordinates.
+
+    Returns:
+        int: number of valid voxels.
+    """
+    max_depth = depth_image.max()
+    counts = np.zeros(max(0, voxel_max[0] - voxel_min[0]), dtype=np.int64)
+    for i in prange(0, len(counts)):
+        world_x = volume_origin[0] + (voxel_min[0] + i) * voxel_size
+        for y in range(voxel_min[1], voxel_max[1]):
+            world_y = volume_origin[1] + y * voxel_size
+            for z in range(voxel_min[2], voxel_max[2]):
+                world_z = volume_origin[2] + z * voxel_size
+                u, _, _ = project_voxel(
+                    world_x, world_y, world_z, world_to_camera, intrinsics, depth_image, truncation_margin, max_depth)
+                if u >= 0:
+                    counts[i] += 1
+    return counts.sum()
+
+
+@njit(parallel=True, cache=True)
+def count_valid_voxel_indices_kernel(voxel_indices, volume_shape, volume_origin, voxel_size, truncation_margin,
+                                     depth_image, intrinsics, world_to_camera):
+    """Count the voxels of a list that project onto a valid depth, the ones integrate_voxels_kernel updates.
+
+    Args:
+        voxel_indices (numpy.array [n, ]): flat (C-order) indices of the voxels.
+        volume_shape (tuple): shape of the voxel volumes.
+        volume_origin (numpy.array [3, ]): world coordinates of voxel (0, 0, 0).
+        voxel_size (float): The side length of each voxel in meters.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+        depth_image (numpy.array [h, w]): A z depth image.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        world_to_camera (numpy.array [4, 4]): SE3 transform from world to camera coordinates.
+
+    Returns:
+        int: number of valid voxels.
+    """
+    max_depth = depth_image.max()
+    size_y = volume_shape[1]
+    size_z = volume_shape[2]
+    valid = np.zeros(len(voxel_indices), dtype=np.bool_)
+    for i in prange(len(voxel_indices)):
+        x, yz = divmod(voxel_indices[i], size_y * size_z)
+        y, z = divmod(yz, size_z)
+        u, _, _ = project_voxel(
+            volume_origin[0] + x * voxel_size, volume_origin[1] + y * voxel_size, volume_origin[2] + z * voxel_size,
+            world_to_camera, intrinsics, depth_image, truncation_margin, max_depth)
+        valid[i] = u >= 0
+    return valid.sum()
+
+
+@njit(cache=True)
+def tsdf_gradient(tsdf_volume, x, y, z):
+    """Compute the tsdf gradient at a voxel with central differences, one-sided on the volume faces.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf volume in its storage type.
+        x (int): x index of the voxel.
+        y (int): y index of the voxel.
+        z (int): z index of the voxel.
+
+    Returns:
+        (float, float, float): gradient along x, y and z, in stored tsdf units per voxel.
+    """
+    l, w, h = tsdf_volume.shape
+    x_lo, x_hi = max(x - 1, 0), min(x + 1, l - 1)
+    y_lo, y_hi = max(y - 1, 0), min(y + 1, w - 1)
+    z_lo, z_hi = max(z - 1, 0), min(z + 1, h - 1)
+    gx = gy = gz = 0.0
+    if x_hi > x_lo:
+        gx = (float(tsdf_volume[x_hi, y, z]) - float(tsdf_volume[x_lo, y, z])) / (x_hi - x_lo)
+    if y_hi > y_lo:
+        gy = (float(tsdf_volume[x, y_hi, z]) - float(tsdf_volume[x, y_lo, z])) / (y_hi - y_lo)
+    if z_hi > z_lo:
+        gz = (float(tsdf_volume[x, y, z_hi]) - float(tsdf_volume[x, y, z_lo])) / (z_hi - z_lo)
+    return gx, gy, gz
+
+
+@njit(cache=True)
+def neighbour_voxel(x, y, z, axis):
+    """Get the index of the next voxel along an axis.
+
+    Args:
+        x (int): x index of the voxel.
+        y (int): y index of the voxel.
+        z (int): z index of the voxel.
+        axis (int): 0, 1 or 2 for the +x, +y or +z neighbour.
+
+    Returns:
+        (int, int, int): index of the neighbour, which may lie outside of the volume.
+    """
+    if axis == 0:
+        return x + 1, y, z
+    if axis == 1:
+        return x, y + 1, z
+    return x, y, z + 1
+
+
+@njit(cache=True)
+def zero_crossing(tsdf_volume, weight_volume, x, y, z, axis, min_weight):
+    """Test whether the tsdf changes sign between a voxel and its neighbour along an axis.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf volume in its storage type.
+        weight_volume (numpy.array [l, w, h]): accumulated weight of every voxel.
+        x (int): x index of the voxel.
+        y (int): y index of the voxel.
+        z (int): z index of the voxel.
+        axis (int): 0, 1 or 2 for the +x, +y or +z neighbour.
+        min_weight (float): both voxels need a weight strictly greater than this, -1 accepts
+            unobserved voxels.
+
+    Returns:
+        bool: True if the edge between the two voxels crosses the surface.
+    """
+    nx, ny, nz = neighbour_voxel(x, y, z, axis)
+    if nx >= tsdf_volume.shape[0] or ny >= tsdf_volume.shape[1] or nz >= tsdf_volume.shape[2]:
+        return False
+    if (tsdf_volume[x, y, z] < 0) == (tsdf_volume[nx, ny, nz] < 0):
+        return False
+    return weight_volume[x, y, z] > min_weight and weight_volume[nx, ny, nz] > min_weight
+
+
+@njit(parallel=True, cache=True)
+def count_zero_crossings_kernel(tsdf_volume, weight_volume, min_weight):
+    """Count the voxel edges crossing the surface in every x slice of the volume.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf volume in its storage type.
+        weight_volume (numpy.array [l, w, h]): accumulated weight of every voxel.
+        min_weight (float): see zero_crossing.
+
+    Returns:
+        numpy.array [l, ]: number of crossing edges starting in every x slice.
+    """
+    counts = np.zeros(tsdf_volume.shape[0], dtype=np.int64)
+    for x in prange(0, tsdf_volume.shape[0]):
+        count = 0
+        for y in range(tsdf_volume.shape[1]):
+            for z in range(tsdf_volume.shape[2]):
+                for axis in range(3):
+                    if zero_crossing(tsdf_volume, weight_volume, x, y, z, axis, min_weight):
+                        count += 1
+        counts[x] = count
+    return counts
+
+
+@njit(parallel=True, cache=True)
+def zero_crossings_kernel(tsdf_volume, weight_volume, color_volume, min_weight, offsets,
+                          points, normals, colors):
+    """Interpolate a surface point on every voxel edge crossing the surface.
+
+    Points are written slice by slice, in the same order count_zero_crossings_kernel
+    counted them, so the output does not depend on the number of threads.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf volume in its storage type.
+        weight_volume (numpy.array [l, w, h]): accumulated weight of every voxel.
+        color_volume (numpy.array [l, w, h, 3]): rgb color of every voxel.
+        min_weight (float): see zero_crossing.
+        offsets (numpy.array [l, ]): index of the first point of every x slice.
+        points (numpy.array [n, 3]): surface points in voxel coordinates, filled in place.
+        normals (numpy.array [n, 3]): unit normals along the negated tsdf gradient, filled in place.
+        colors (numpy.array [n, 3]): color of the voxel nearest to the points, filled in place.
+    """
+    for x in prange(0, tsdf_volume.shape[0]):
+        i = offsets[x]
+        for y in range(tsdf_volume.shape[1]):
+            for z in range(tsdf_volume.shape[2]):
+                for axis in range(3):
+                    if not zero_crossing(tsdf_volume, weight_volume, x, y, z, axis, min_weight):
+                        continue
+                    nx, ny, nz = neighbour_voxel(x, y, z, axis)
+                    tsdf_0 = float(tsdf_volume[x, y, z])
+                    tsdf_1 = float(tsdf_volume[nx, ny, nz])
+                    t = tsdf_0 / (tsdf_0 - tsdf_1)
+
+                    points[i, 0] = x + t * (nx - x)
+                    points[i, 1] = y + t * (ny - y)
+                    points[i, 2] = z + t * (nz - z)
+
+                    gx_0, gy_0, gz_0 = tsdf_gradient(tsdf_volume, x, y, z)
+                    gx_1, gy_1, gz_1 = tsdf_gradient(tsdf_volume, nx, ny, nz)
+                    gx = gx_0 + t * (gx_1 - gx_0)
+                    gy = gy_0 + t * (gy_1 - gy_0)
+                    gz = gz_0 + t * (gz_1 - gz_0)
+                    norm = np.sqrt(gx * gx + gy * gy + gz * gz)
+                    if norm > 0:
+                        # oriented like the marching cubes normals, away from free space
+                        normals[i, 0] = -gx / norm
+                        normals[i, 1] = -gy / norm
+                        normals[i, 2] = -gz / norm
+
+                    cx = int(np.round(points[i, 0]))
+                    cy = int(np.round(points[i, 1]))
+                    cz = int(np.round(points[i, 2]))
+                    for c in range(3):
+                        colors[i, c] = np.uint8(np.floor(color_volume[cx, cy, cz, c]))
+                    i += 1
+
+
+@njit(cache=True)
+def sample_tsdf(tsdf_volume, tsdf_scale, x, y, z):
+    """Trilinearly interpolate the tsdf at a point in voxel coordinates.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf volume in its storage type.
+        tsdf_scale (float): value a stored tsdf of 1 is represented by.
+        x (float): x voxel coordinate, within [0, l - 1].
+        y (float): y voxel coordinate, within [0, w - 1].
+        z (float): z voxel coordinate, within [0, h - 1].
+
+    Returns:
+        float: interpolated tsdf value in [-1, 1].
+    """
+    x0 = min(max(int(np.floor(x)), 0), tsdf_volume.shape[0] - 2)
+    y0 = min(max(int(np.floor(y)), 0), tsdf_volume.shape[1] - 2)
+    z0 = min(max(int(np.floor(z)), 0), tsdf_volume.shape[2] - 2)
+    fx, fy, fz = x - x0, y - y0, z - z0
+
+    value = 0.0
+    for dx in range(2):
+        wx = fx if dx else 1.0 - fx
+        for dy in range(2):
+            wy = fy if dy else 1.0 - fy
+            for dz in range(2):
+                wz = fz if dz else 1.0 - fz
+                value += wx * wy * wz * tsdf_volume[x0 + dx, y0 + dy, z0 + dz]
+    return value / tsdf_scale
+
+
+@njit(cache=True)
+def sample_observed(weight_volume, x, y, z):
+    """Test whether the eight voxels sample_tsdf interpolates at a point have been observed.
+
+    Args:
+        weight_volume (numpy.array [l, w, h]): accumulated weight of every voxel.
+        x (float): x voxel coordinate, within [0, l - 1].
+        y (float): y voxel coordinate, within [0, w - 1].
+        z (float): z voxel coordinate, within [0, h - 1].
+
+    Returns:
+        bool: True if all of them have a weight above 0.
+    """
+    x0 = min(max(int(np.floor(x)), 0), weight_volume.shape[0] - 2)
+    y0 = min(max(int(np.floor(y)), 0), weight_volume.shape[1] - 2)
+    z0 = min(max(int(np.floor(z)), 0), weight_volume.shape[2] - 2)
+    for dx in range(2):
+        for dy in range(2):
+            for dz in range(2):
+                if weight_volume[x0 + dx, y0 + dy, z0 + dz] <= 0:
+                    return False
+    return True
+
+
+@njit(parallel=True, cache=True)
+def surface_bricks_kernel(tsdf_volume, brick_size):
+    """Flag the bricks of voxels where a ray may find a surface.
+
+    A brick is flagged when a voxel in it, or in the layer of voxels just above it along
+    any axis, has a tsdf of at most 0. Elsewhere every tsdf sample interpolated from the
+    brick is positive, so rays can cross the brick without sampling it.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf volume in its storage type.
+        brick_size (int): side length of the bricks in voxels.
+
+    Returns:
+        numpy.array [p, q, r]: one flag per brick.
+    """
+    l, w, h = tsdf_volume.shape
+    bricks = np.zeros(((l + brick_size - 1) // brick_size, (w + brick_size - 1) // brick_size,
+                       (h + brick_size - 1) // brick_size), dtype=np.bool_)
+    for brick_x in prange(bricks.shape[0]):
+        for x in range(max(brick_x * brick_size, 0), min((brick_x + 1) * brick_size + 1, l)):
+            for y in range(w):
+                for z in range(h):
+                    if tsdf_volume[x, y, z] <= 0:
+                        # voxels on the low faces of a brick also belong to the bricks below
+                        for brick_y in range(max(y - 1, 0) // brick_size, y // brick_size + 1):
+                            for brick_z in range(max(z - 1, 0) // brick_size, z // brick_size + 1):
+                                bricks[brick_x, brick_y, brick_z] = True
+    return bricks
+
+
+@njit(cache=True)
+def next_brick_face(origin, direction, brick, brick_size):
+    """Find where a ray leaves a brick along one axis, for a 3D DDA over the bricks.
+
+    Args:
+        origin (float): coordinate of the ray origin along the axis, in voxels.
+        direction (float): coordinate of the ray direction along the axis, in voxels.
+        brick (int): index of the brick along the axis.
+        brick_size (int): side length of the bricks in voxels.
+
+    Returns:
+        float: ray parameter at the next brick face crossed along the axis.
+        float: ray parameter between two brick faces along the axis.
+        int: brick index increment when crossing a face along the axis.
+    """
+    if direction > 0:
+        return ((brick + 1) * brick_size - origin) / direction, brick_size / direction, 1
+    if direction < 0:
+        return (brick * brick_size - origin) / direction, -brick_size / direction, -1
+    return np.inf, np.inf, 0
+
+
+@njit(parallel=True, cache=True)
+def raycast_kernel(tsdf_volume, weight_volume, color_volume, volume_origin, voxel_size, truncation_margin,
+                   tsdf_scale, bricks, brick_size, intrinsics, camera_to_world, depth_image, normal_image,
+                   color_image):
+    """Render the surface of the volume by marching a ray through every pixel.
+
+    Rays cross the bricks without surface in one step. Elsewhere they advance by 0.8 of
+    the distance their tsdf sample guarantees to be free, and by at least half a voxel,
+    until the interpolated tsdf turns from positive to negative between two observed
+    samples. The crossing is then interpolated linearly between the two samples.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf volume in its storage type.
+        weight_volume (numpy.array [l, w, h]): accumulated weight of every voxel.
+        color_volume (numpy.array [l, w, h, 3]): rgb color of every voxel.
+        volume_origin (numpy.array [3, ]): world coordinates of voxel (0, 0, 0).
+        voxel_size (float): The side length of each voxel in meters.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+        tsdf_scale (float): value a stored tsdf of 1 is represented by.
+        bricks (numpy.array [p, q, r]): surface flags from surface_bricks_kernel.
+        brick_size (int): side length of the bricks in voxels.
+        intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        camera_to_world (numpy.array [4, 4]): SE3 transform representing pose (camera to world)
+        depth_image (numpy.array [h, w]): z depth of the surface, 0 where no surface is hit.
+            Written in place.
+        normal_image (numpy.array [h, w, 3]): unit world frame normals facing free space,
+            written in place.
+        color_image (numpy.array [h, w, 3]): color of the voxel nearest to the surface,
+            written in place.
+    """
+    image_height, image_width = depth_image.shape
+    fu = intrinsics[0, 0]
+    fv = intrinsics[1, 1]
+    u0 = intrinsics[0, 2]
+    v0 = intrinsics[1, 2]
+    origin = np.empty(3)
+    for j in range(3):
+        origin[j] = (camera_to_world[j, 3] - volume_origin[j]) / voxel_size
+
+    for v in prange(image_height):
+        direction = np.empty(3)
+        point = np.empty(3)
+        for u in range(image_width):
+            # ray in voxel coordinates, parameterized by the camera z depth
+            ray_x = (u - u0) / fu
+            ray_y = (v - v0) / fv
+            for j in range(3):
+                direction[j] = (camera_to_world[j, 0] * ray_x + camera_to_world[j, 1] * ray_y
+                                + camera_to_world[j, 2]) / voxel_size
+            meters_per_depth = voxel_size * np.sqrt(direction[0] ** 2 + direction[1] ** 2 + direction[2] ** 2)
+
+            # clip the ray to the voxel centers of the volume
+            t_near, t_far = 0.0, np.inf
+            for j in range(3):
+                if direction[j] == 0:
+                    if origin[j] < 0 or origin[j] > tsdf_volume.shape[j] - 1:
+                        t_far = -1.0
+                    continue
+                t_0 = -origin[j] / direction[j]
+                t_1 = (tsdf_volume.shape[j] - 1 - origin[j]) / direction[j]
+                t_near = max(t_near, min(t_0, t_1))
+                t_far = min(t_far, max(t_0, t_1))
+            if t_near >= t_far:
+                continue
+
+            # a thousandth of a voxel along the ray, to resume marching just before a brick face
+            epsilon = 1e-3 * voxel_size / meters_per_depth
+            t = t_near
+            for j in range(3):
+                point[j] = origin[j] + t * direction[j]
+            value = sample_tsdf(tsdf_volume, tsdf_scale, point[0], point[1], point[2])
+            while t < t_far:
+                for j in range(3):
+                    point[j] = origin[j] + t * direction[j]
+                brick_x = min(int(point[0]), tsdf_volume.shape[0] - 1) // brick_size
+                brick_y = min(int(point[1]), tsdf_volume.shape[1] - 1) // brick_size
+                brick_z = min(int(point[2]), tsdf_volume.shape[2] - 1) // brick_size
+                if not bricks[brick_x, brick_y, brick_z]:
+                    # walk the bricks without surface (3D DDA) up to the face of the next brick with one
+                    face_x, delta_x, step_x = next_brick_face(origin[0], direction[0], brick_x, brick_size)
+                    face_y, delta_y, step_y = next_brick_face(origin[1], direction[1], brick_y, brick_size)
+                    face_z, delta_z, step_z = next_brick_face(origin[2], direction[2], brick_z, brick_size)
+                    while not bricks[brick_x, brick_y, brick_z]:
+                        if face_x <= face_y and face_x <= face_z:
+                            t, face_x, brick_x = face_x, face_x + delta_x, brick_x + step_x
+                        elif face_y <= face_z:
+                            t, face_y, brick_y = face_y, face_y + delta_y, brick_y + step_y
+                        else:
+                            t, face_z, brick_z = face_z, face_z + delta_z, brick_z + step_z
+                        if (t >= t_far or brick_x < 0 or brick_x >= bricks.shape[0] or brick_y < 0
+                                or brick_y >= bricks.shape[1] or brick_z < 0 or brick_z >= bricks.shape[2]):
+                            t = t_far
+                            break
+                    if t >= t_far:
+                        break
+
+                    # resume just before the face, where the tsdf is still positive
+                    t = max(t - epsilon, t_near)
+                    for j in range(3):
+                        point[j] = origin[j] + t * direction[j]
+                    value = sample_tsdf(tsdf_volume, tsdf_scale, point[0], point[1], point[2])
+
+                step = max(0.8 * value * truncation_margin, 0.5 * voxel_size) / meters_per_depth
+                t_next = min(t + step, t_far)
+                for j in range(3):
+                    point[j] = origin[j] + t_next * direction[j]
+                value_next = sample_tsdf(tsdf_volume, tsdf_scale, point[0], point[1], point[2])
+
+                if value > 0 and value_next <= 0 and sample_observed(weight_volume, point[0], point[1], point[2]):
+                    t_hit = t + (t_next - t) * value / (value - value_next)
+                    for j in range(3):
+                        point[j] = origin[j] + t * direction[j]
+                    if sample_observed(weight_volume, point[0], point[1], point[2]):
+                        depth_image[v, u] = t_hit
+                        for j in range(3):
+                            point[j] = origin[j] + t_hit * direction[j]
+                        raycast_surface(tsdf_volume, color_volume, tsdf_scale, point, normal_image[v, u],
+                                        color_image[v, u])
+                        break
+                t, value = t_next, value_next
+
+
+@njit(cache=True)
+def raycast_surface(tsdf_volume, color_volume, tsdf_scale, point, normal, color):
+    """Compute the normal and the color of the surface at a point found by raycast_kernel.
+
+    Args:
+        tsdf_volume (numpy.array [l, w, h]): tsdf volume in its storage type.
+        color_volume (numpy.array [l, w, h, 3]): rgb color of every voxel.
+        tsdf_scale (float): value a stored tsdf of 1 is represented by.
+        point (numpy.array [3, ]): surface point in voxel coordinates.
+        normal (numpy.array [3, ]): unit tsdf gradient at the point, written in place.
+        color (numpy.array [3, ]): color of the voxel nearest to the point, written in place.
+    """
+    # central differences one voxel to each side of the point
+    lo = point.copy()
+    hi = point.copy()
+    norm = 0.0
+    for j in range(3):
+        lo[j] = max(point[j] - 1.0, 0.0)
+        hi[j] = min(point[j] + 1.0, tsdf_volume.shape[j] - 1.0)
+        normal[j] = (sample_tsdf(tsdf_volume, tsdf_scale, hi[0], hi[1], hi[2])
+                     - sample_tsdf(tsdf_volume, tsdf_scale, lo[0], lo[1], lo[2]))
+        norm += normal[j] ** 2
+        lo[j] = point[j]
+        hi[j] = point[j]
+    if norm > 0:
+        for j in range(3):
+            normal[j] /= np.sqrt(norm)
+
+    x = int(np.round(point[0]))
+    y = int(np.round(point[1]))
+    z = int(np.round(point[2]))
+    for c in range(3):
+        color[c] = np.uint8(np.floor(color_volume[x, y, z, c]))
+
+
+def frustum_voxel_bounds(depth_image, camera_intrinsics, camera_pose, volume_origin, voxel_size, voxel_bounds,
+                         truncation_margin):
+    """Compute the voxel-space bounding box of the camera frustum of an observation.
+
+    The frustum spans the image and reaches from the camera center to the largest
+    observed depth plus the truncation margin. Voxels outside of it cannot receive
+    an update from the observation.
+
+    Args:
+        depth_image (numpy.array [h, w]): A z depth image.
+        camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+        camera_pose (numpy.array [4, 4] or Pose): SE3 transform representing pose (camera to world)
+        volume_origin (numpy.array [3, ]): world coordinates of voxel (0, 0, 0).
+        voxel_size (float): The side length of each voxel in meters.
+        voxel_bounds (numpy.array [3, ]): number of voxels along x, y and z.
+        truncation_margin (float): distance (in meters) at which the sdf is truncated.
+
+    Returns:
+        numpy.array [3, ]: first voxel index inside the frustum along x, y and z.
+        numpy.array [3, ]: one past the last voxel index inside the frustum along x, y and z.
+            Empty along at least one axis when the frustum misses the volume.
+    """
+    image_height, image_width = depth_image.shape
+    max_depth = depth_image.max() + truncation_margin
+    if max_depth <= truncation_margin:
+        return np.zeros(3, dtype=np.int64), np.zeros(3, dtype=np.int64)
+
+    # camera center and the image corners on the far plane. Pixels are rounded to
+    # the nearest integer, so the image covers [-0.5, size - 0.5) along each axis.
+    fu, fv = camera_intrinsics[0, 0], camera_intrinsics[1, 1]
+    u0, v0 = camera_intrinsics[0, 2], camera_intrinsics[1, 2]
+    u = (np.array([-0.5, image_width - 0.5]) - u0) / fu * max_depth
+    v = (np.array([-0.5, image_height - 0.5]) - v0) / fv * max_depth
+    frustum = np.array([[0., 0., 0.],
+                        [u[0], v[0], max_depth],
+                        [u[1], v[0], max_depth],
+                        [u[0], v[1], max_depth],
+                        [u[1], v[1], max_depth]])
+    frustum = transform_point3s(camera_pose, frustum)
+
+    voxel_min = np.floor((frustum.min(axis=0) - volume_origin) / voxel_size).astype(np.int64)
+    voxel_max = np.ceil((frustum.max(axis=0) - volume_origin) / voxel_size).astype(np.int64) + 1
+    return np.clip(voxel_min, 0, voxel_bounds), np.clip(voxel_max, 0, voxel_bounds)
+
+
+# value a tsdf of 1 is stored as, for every supported tsdf storage type
+TSDF_SCALES = {
+    np.dtype(np.float32): 1.0,
+    np.dtype(np.int16): float(np.iinfo(np.int16).max),
+}
+
+# file name (without .npy) each voxel volume is saved to by TSDFVolume.save
+VOLUME_FILES = {
+    'tsdf': '_tsdf_volume',
+    'weight': '_weight_volume',
+    'color': '_color_volume',
+}
+
+# side length in voxels of the bricks raycast skips when they hold no surface
+RAYCAST_BRICK_SIZE = 8
+
+# largest weight that can be stored, for every supported weight storage type
+MAX_WEIGHTS = {
+    np.dtype(np.float32): np.inf,
+    np.dtype(np.uint16): float(np.iinfo(np.uint16).max),
+    np.dtype(np.uint8): float(np.iinfo(np.uint8).max),
+}
+
+
+def check_volume_dtypes(tsdf_dtype, weight_dtype, color_dtype):
+    """Validate the storage types of the tsdf, weight and color volumes.
+
+    Args:
+        tsdf_dtype (numpy.dtype): float32 or int16, see TSDF_SCALES.
+        weight_dtype (numpy.dtype): float32, uint16 or uint8, see MAX_WEIGHTS.
+        color_dtype (numpy.dtype): float32 or uint8.
+
+    Raises:
+        ValueError: If a storage type is not supported.
+
+    Returns:
+        numpy.dtype: the tsdf storage type.
+        numpy.dtype: the weight storage type.
+        numpy.dtype: the color storage type.
+        float: value a tsdf of 1 is stored as.
+        float: largest weight that can be stored.
+    """
+    tsdf_dtype, weight_dtype, color_dtype = np.dtype(tsdf_dtype), np.dtype(weight_dtype), np.dtype(color_dtype)
+    if tsdf_dtype not in TSDF_SCALES:
+        raise ValueError('tsdf_dtype should be one of float32 or int16.')
+    if weight_dtype not in MAX_WEIGHTS:
+        raise ValueError('weight_dtype should be one of float32, uint16 or uint8.')
+    if color_dtype not in (np.float32, np.uint8):
+        raise ValueError('color_dtype should be one of float32 or uint8.')
+    return tsdf_dtype, weight_dtype, color_dtype, TSDF_SCALES[tsdf_dtype], MAX_WEIGHTS[weight_dtype]
+
+
 class TSDFVolume:
     """Volumetric TSDF Fusion of RGB-D Images.
     """
 
-    def __init__(self, volume_bounds, voxel_size):
+    def __init__(self, volume_bounds, voxel_size, tsdf_dtype=np.float32, weight_dtype=np.float32,
+                 color_dtype=np.float32, mesh_block_size=32):
         """Initialize tsdf volume instance variables.
 
         Args:
             volume_bounds (numpy.array [3, 2]): rows index [x, y, z] and cols index [min_bound, max_bound].
                 Note: units are in meters.
             voxel_size (float): The side length of each voxel in meters.
+            tsdf_dtype (numpy.dtype, optional): storage type of the tsdf volume, one of float32
+                or int16 (tsdf normalized to [-32767, 32767]). Defaults to float32.
+            weight_dtype (numpy.dtype, optional): storage type of the weight volume, one of
+                float32, uint16 or uint8. Integer weights saturate at their largest value, after
+                which the volume keeps a moving average of the observations. Defaults to float32.
+            color_dtype (numpy.dtype, optional): storage type of the color volume, one of float32
+                or uint8. Defaults to float32.
+            mesh_block_size (int, optional): side length in voxels of the blocks get_mesh
+                extracts and caches separately. Defaults to 32.
 
         Raises:
             ValueError: If volume bounds are not the correct shape.
-            ValueError: If voxel size is not positive.
+            ValueError: If voxel size or mesh block size is not positive.
+            ValueError: If a storage type is not supported.
+        """
+        self._init_layout(volume_bounds, voxel_size, tsdf_dtype, weight_dtype, color_dtype, mesh_block_size)
+
+        print('Voxel volume size: {} x {} x {} - # voxels: {:,}'.format(
+            self._voxel_bounds[0],
+            self._voxel_bounds[1],
+            self._voxel_bounds[2],
+            self._voxel_bounds[0] * self._voxel_bounds[1] * self._voxel_bounds[2]))
+
+        # Initialize pointers to voxel volume in memory
+        self._tsdf_volume = np.full(self._voxel_bounds, self._tsdf_scale, dtype=tsdf_dtype)
+
+        # for computing the cumulative moving average of observations per voxel
+        self._weight_volume = np.zeros(self._voxel_bounds, dtype=weight_dtype)
+        color_bounds = np.append(self._voxel_bounds, 3)
+        self._color_volume = np.zeros(color_bounds, dtype=color_dtype)  # rgb order
+
+        # Voxel grid coordinates are not stored, they are derived from the voxel
+        # indices whenever they are needed (see get_voxel_coords).
+
+    def _init_layout(self, volume_bounds, voxel_size, tsdf_dtype, weight_dtype, color_dtype, mesh_block_size):
+        """Validate the arguments of __init__ and set everything but the voxel volumes.
+
+        Raises:
+            ValueError: See __init__.
         """
         volume_bounds = np.asarray(volume_bounds)
         if volume_bounds.shape != (3, 2):
@@ -24,6 +1019,11 @@ class TSDFVolume:
 
         if voxel_size <= 0.0:
             raise ValueError('voxel size must be positive.')
+        if mesh_block_size <= 0:
+            raise ValueError('mesh block size must be positive.')
+
+        tsdf_dtype, weight_dtype, color_dtype, tsdf_scale, max_weight = check_volume_dtypes(
+            tsdf_dtype, weight_dtype, color_dtype)
 
         # Define voxel volume parameters
         self._volume_bounds = volume_bounds
@@ -40,68 +1040,412 @@ class TSDFVolume:
         # volume min bound is the origin of the volume in world coordinates
         self._volume_origin = self._volume_bounds[:, 0].copy(order='C').astype(np.float32)
 
-        print('Voxel volume size: {} x {} x {} - # voxels: {:,}'.format(
-            self._voxel_bounds[0],
-            self._voxel_bounds[1],
-            self._voxel_bounds[2],
-            self._voxel_bounds[0] * self._voxel_bounds[1] * self._voxel_bounds[2]))
+        # value a tsdf of 1 is stored as, and largest weight that can be stored
+        self._tsdf_scale = tsdf_scale
+        self._max_weight = max_weight
 
-        # Initialize pointers to voxel volume in memory
-        self._tsdf_volume = np.ones(self._voxel_bounds).astype(np.float32)
+        # get_mesh extracts the surface block by block and caches the result, integrate
+        # flags the blocks where the surface may have changed so only those are extracted again
+        self._mesh_block_size = int(mesh_block_size)
+        self._dirty_blocks = np.zeros(-(-self._voxel_bounds // self._mesh_block_size), dtype=bool)
+        self._block_meshes = {}
+        self._mesh_min_weight = None  # min_weight the cached block meshes were extracted with
 
-        # for computing the cumulative moving average of observations per voxel
-        self._weight_volume = np.zeros(self._voxel_bounds).astype(np.float32)
-        color_bounds = np.append(self._voxel_bounds, 3)
-        self._color_volume = np.zeros(color_bounds).astype(np.float32)  # rgb order
-
-        # Get voxel grid coordinates
-        xv, yv, zv = np.meshgrid(
-            range(self._voxel_bounds[0]),
-            range(self._voxel_bounds[1]),
-            range(self._voxel_bounds[2]),
-            indexing='ij')
-        self._voxel_coords = np.concatenate([
-            xv.reshape(1, -1),
-            yv.reshape(1, -1),
-            zv.reshape(1, -1)], axis=0).astype(int).T
+        # integration stats, None unless enabled with enable_stats
+        self._stats = None
+
+    def save(self, directory):
+        """Save the volume to a directory, as meta.json and one .npy file per voxel volume.
+
+        The metadata is written last, so a directory without meta.json holds no complete
+        checkpoint. Volumes loaded with mmap_mode='r+' from the same directory are flushed
+        in place instead of being written again, any other volume file is replaced.
+
+        Args:
+            directory (str): directory to save to, created if it does not exist.
+
+        Raises:
+            NameError: If directory cannot be created.
+        """
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            raise NameError('Invalid path')
+
+        for name, attribute in VOLUME_FILES.items():
+            path = os.path.join(directory, name + '.npy')
+            array = getattr(self, attribute)
+            if (isinstance(array, np.memmap) and array.filename == os.path.abspath(path)
+                    and array.mode in ('r+', 'w+')):
+                array.flush()
+            else:
+                # copy on write maps never reach their file, and the file they map must not
+                # be written over while it is read, so it is replaced by a new one
+                with open(path + '.tmp', 'wb') as f:
+                    np.save(f, array)
+                os.replace(path + '.tmp', path)
+
+        meta = {
+            'format': 1,
+            'volume_bounds': self._volume_bounds.tolist(),
+            'voxel_size': self._voxel_size,
+            'tsdf_dtype': self._tsdf_volume.dtype.name,
+            'weight_dtype': self._weight_volume.dtype.name,
+            'color_dtype': self._color_volume.dtype.name,
+            'mesh_block_size': self._mesh_block_size,
+        }
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load a volume saved with save.
+
+        The voxel volumes are memory mapped rather than read, so a volume opens in constant
+        time and the pages are only read from disk when they are accessed. Read only maps
+        can be shared by several processes.
+
+        Args:
+            directory (str): directory the volume was saved to.
+            mmap_mode (str, optional): how the voxel volumes are mapped, see numpy.load. 'r' is
+                read only (meshing, raycasting), 'r+' integrates into the saved files and 'c'
+                integrates into a private copy of the pages it changes. None reads the volumes
+                into memory. Defaults to 'r'.
+
+        Raises:
+            NameError: If directory does not hold a saved volume.
+            ValueError: If the saved volumes do not match the metadata.
+
+        Returns:
+            TSDFVolume: The loaded volume.
+        """
+        meta_path = os.path.join(directory, 'meta.json')
+        if not os.path.isfile(meta_path):
+            raise NameError('Invalid path')
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        volume = cls.__new__(cls)
+        volume._init_layout(np.array(meta['volume_bounds']), meta['voxel_size'], meta['tsdf_dtype'],
+                            meta['weight_dtype'], meta['color_dtype'], meta['mesh_block_size'])
+        for name, attribute in VOLUME_FILES.items():
+            setattr(volume, attribute, np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode))
+
+        expected = {
+            '_tsdf_volume': (tuple(volume._voxel_bounds), meta['tsdf_dtype']),
+            '_weight_volume': (tuple(volume._voxel_bounds), meta['weight_dtype']),
+            '_color_volume': (tuple(volume._voxel_bounds) + (3,), meta['color_dtype']),
+        }
+        for attribute, (shape, dtype) in expected.items():
+            array = getattr(volume, attribute)
+            if array.shape != shape or array.dtype != np.dtype(dtype):
+                raise ValueError('saved volumes do not match meta.json.')
+
+        # nothing is cached yet, every block is meshed on the first get_mesh
+        volume._dirty_blocks[:] = True
+        return volume
+
+    def get_voxel_coords(self, voxel_indices=None):
+        """Get voxel grid coordinates from flat voxel indices.
+
+        Args:
+            voxel_indices (numpy.array [n, ], optional): flat (C-order) indices into the voxel
+                grid. Defaults to None, meaning every voxel of the grid.
+
+        Returns:
+            numpy.array [n, 3]: Each row gives the 3D coordinates of a voxel.
+        """
+        if voxel_indices is None:
+            voxel_indices = np.arange(np.prod(self._voxel_bounds))
+        return np.stack(np.unravel_index(voxel_indices, self._voxel_bounds), axis=1)
+
+    def get_frustum_voxel_bounds(self, depth_image, camera_intrinsics, camera_pose):
+        """Compute the voxel-space bounding box of the camera frustum of an observation.
+
+        Args:
+            depth_image (numpy.array [h, w]): A z depth image.
+            camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+            camera_pose (numpy.array [4, 4] or Pose): SE3 transform representing pose (camera to world)
+
+        Returns:
+            numpy.array [3, ]: first voxel index inside the frustum along x, y and z.
+            numpy.array [3, ]: one past the last voxel index inside the frustum along x, y and z.
+                Empty along at least one axis when the frustum misses the volume.
+        """
+        return frustum_voxel_bounds(depth_image, camera_intrinsics, camera_pose, self._volume_origin,
+                                    self._voxel_size, self._voxel_bounds, self._truncation_margin)
 
     def get_volume(self):
         """Get the tsdf and color volumes.
 
+        Compact tsdf layouts are decoded into a float32 copy, the color volume is
+        returned in its storage type.
+
         Returns:
             numpy.array [l, w, h]: l, w, h are the dimensions of the voxel grid in voxel space.
                 Each entry contains the integrated tsdf value.
             numpy.array [l, w, h, 3]: l, w, h are the dimensions of the voxel grid in voxel space.
                 3 is the channel number in the order r, g, then b.
         """
-        return self._tsdf_volume, self._color_volume
+        if self._tsdf_scale == 1.0:
+            return self._tsdf_volume, self._color_volume
+        return self._tsdf_volume.astype(np.float32) / np.float32(self._tsdf_scale), self._color_volume
 
-    def get_mesh(self):
+    def get_mesh(self, num_workers=1, use_processes=True, min_weight=None):
         """ Run marching cubes over the constructed tsdf volume to get a mesh representation.
 
+        The volume is meshed in blocks of mesh_block_size^3 voxels. Only the blocks changed
+        by integrate since the previous call are extracted again, the others reuse their
+        cached mesh, and the block meshes are welded along their seams. The result does
+        not depend on the number of workers.
+
+        Args:
+            num_workers (int, optional): number of workers extracting blocks in parallel.
+                Defaults to 1, meaning the blocks are extracted in the calling thread.
+            use_processes (bool, optional): extract blocks in worker processes instead of
+                threads. skimage holds the GIL while running marching cubes, so threads
+                barely overlap. Defaults to True.
+            min_weight (float, optional): only extract the cubes whose eight corners have a
+                weight greater than min_weight, which removes the surfaces generated where
+                observed voxels meet unobserved ones. Defaults to None, meaning every cube
+                is extracted.
+
+        Raises:
+            ValueError: If num_workers is not positive.
+
         Returns:
             numpy.array [n, 3]: each row represents a 3D point.
             numpy.array [k, 3]: each row is a list of point indices used to render triangles.
             numpy.array [n, 3]: each row represents the normal vector for the corresponding 3D point.
             numpy.array [n, 3]: each row represents the color of the corresponding 3D point.
         """
-        tsdf_volume, color_vol = self.get_volume()
+        if num_workers < 1:
+            raise ValueError('num_workers must be positive.')
+        if min_weight != self._mesh_min_weight:
+            # the cached meshes were masked differently
+            self._mesh_min_weight = min_weight
+            self._block_meshes = {}
+            self._dirty_blocks[:] = True
 
-        # Marching cubes
-        voxel_points, triangles, normals, _ = measure.marching_cubes(tsdf_volume, level=0, method='lewiner')
-        points_ind = np.round(voxel_points).astype(int)
-        points = self.voxel_to_world(self._volume_origin, voxel_points, self._voxel_size)
+        blocks = []
+        block_inputs = []
+        for block in map(tuple, np.argwhere(self._dirty_blocks).tolist()):
+            block_input = self._get_block_tsdf(block)
+            if block_input is None:
+                self._block_meshes.pop(block, None)
+            else:
+                blocks.append(block)
+                block_inputs.append(block_input)
+        self._dirty_blocks[:] = False
+
+        read_mins = [read_min for read_min, _, _ in block_inputs]
+        tsdf_blocks = [tsdf_block for _, tsdf_block, _ in block_inputs]
+        masks = [mask for _, _, mask in block_inputs]
+        if num_workers > 1 and len(blocks) > 1:
+            if use_processes:
+                # forking is not safe once numba has started its worker threads
+                pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                pool = ThreadPoolExecutor(max_workers=num_workers)
+            with pool:
+                # a few tasks per worker balances the load without paying for a task per block
+                chunk_size = max(1, len(blocks) // (4 * num_workers))
+                block_meshes = list(pool.map(marching_cubes_block, tsdf_blocks, masks, chunksize=chunk_size))
+        else:
+            block_meshes = list(map(marching_cubes_block, tsdf_blocks, masks))
+
+        for block, read_min, (voxel_points, triangles, normals) in zip(blocks, read_mins, block_meshes):
+            if voxel_points is None:
+                self._block_meshes.pop(block, None)
+                continue
+            voxel_points = voxel_points + read_min
 
-        # Get vertex colors.
-        rgb_vals = color_vol[points_ind[:, 0], points_ind[:, 1], points_ind[:, 2]]
-        colors_r = rgb_vals[:, 0]
-        colors_g = rgb_vals[:, 1]
-        colors_b = rgb_vals[:, 2]
-        colors = np.floor(np.asarray([colors_r, colors_g, colors_b])).T
-        colors = colors.astype(np.uint8)
+            # Get vertex colors.
+            points_ind = np.round(voxel_points).astype(int)
+            rgb_vals = self._color_volume[points_ind[:, 0], points_ind[:, 1], points_ind[:, 2]]
+            colors = np.floor(rgb_vals).astype(np.uint8)
+            self._block_meshes[block] = (voxel_points, triangles, normals, colors)
+
+        # blocks in grid order, so the output does not depend on the order of updates
+        meshes = [self._block_meshes[block] for block in sorted(self._block_meshes)]
+        voxel_points, triangles, normals, colors = merge_meshes(meshes)
+        points = self.voxel_to_world(self._volume_origin, voxel_points, self._voxel_size)
 
         return points, triangles, normals, colors
 
+    def _get_block_tsdf(self, block):
+        """Read the tsdf values marching cubes needs to mesh the cubes owned by a mesh block.
+
+        A block owns the cubes whose lowest corner falls inside it. It is read with one
+        extra voxel on every side, so the cubes along its +x, +y and +z faces are complete
+        and the normals (tsdf gradients) at its vertices are the ones a pass over the whole
+        volume would compute.
+
+        Args:
+            block (tuple): block coordinates along x, y and z.
+
+        Returns:
+            numpy.array [3, ]: voxel index of the first value read along x, y and z.
+            numpy.array [l, w, h]: tsdf values around the block.
+            numpy.array [l, w, h]: marching cubes mask selecting the cubes of the block.
+                None is returned instead when the block cannot contain a surface.
+        """
+        block_min = np.array(block) * self._mesh_block_size
+        block_max = np.minimum(block_min + self._mesh_block_size + 1, self._voxel_bounds)
+        read_min = np.maximum(block_min - 1, 0)
+        read_max = np.minimum(block_max + 1, self._voxel_bounds)
+
+        region = tuple(slice(lo, hi) for lo, hi in zip(read_min, read_max))
+        tsdf_block = self._tsdf_volume[region].astype(np.float32)
+        if self._tsdf_scale != 1.0:
+            tsdf_block /= np.float32(self._tsdf_scale)
+        if not (tsdf_block.min() < 0 < tsdf_block.max()):
+            return None
+
+        # marching cubes tests the mask at the highest corner of each cube
+        mask = np.zeros(tsdf_block.shape, dtype=bool)
+        mask[tuple(slice(lo + 1, hi) for lo, hi in zip(block_min - read_min, block_max - read_min))] = True
+        if self._mesh_min_weight is not None:
+            mask &= observed_cube_mask(self._weight_volume[region], self._mesh_min_weight)
+            if not mask.any():
+                return None
+        return read_min, tsdf_block, mask
+
+    def enable_stats(self):
+        """Start recording the timings and voxel counts of every integrate and integrate_batch call.
+
+        The fused integration kernels cannot time their projection, validity test and
+        tsdf and color updates separately. While stats are enabled, every call runs an
+        extra read only pass that projects the visited voxels and counts the valid ones,
+        timed as the 'projection' stage, and the fused pass is timed as the 'fuse' stage.
+        When stats are disabled, integrate only tests a single attribute.
+
+        Returns:
+            IntegrationStats: the stats, kept and accumulated until disable_stats.
+        """
+        if self._stats is None:
+            self._stats = IntegrationStats()
+        return self._stats
+
+    def disable_stats(self):
+        """Stop recording stats and drop the recorded ones along with their subscribers.
+        """
+        self._stats = None
+
+    def get_stats(self):
+        """Get the recorded stats, with the memory usage of the volume refreshed.
+
+        Returns:
+            IntegrationStats: the stats, None when they are not enabled.
+        """
+        if self._stats is not None:
+            self._stats.memory_bytes = self.get_memory_usage()
+        return self._stats
+
+    def get_memory_usage(self):
+        """Get the number of bytes held by every array of the volume.
+
+        Returns:
+            dict: bytes of the tsdf, weight and color volumes, of the mesh block flags and of
+                the cached block meshes.
+        """
+        return {
+            'tsdf': self._tsdf_volume.nbytes,
+            'weight': self._weight_volume.nbytes,
+            'color': self._color_volume.nbytes,
+            'dirty_blocks': self._dirty_blocks.nbytes,
+            'block_meshes': sum(array.nbytes for mesh in self._block_meshes.values() for array in mesh),
+        }
+
+    def _check_writeable(self):
+        """Check the voxel volumes can be integrated into.
+
+        Raises:
+            ValueError: If the volume was loaded read only.
+        """
+        if not (self._tsdf_volume.flags.writeable and self._weight_volume.flags.writeable
+                and self._color_volume.flags.writeable):
+            raise ValueError("the volume was loaded read only, load it with mmap_mode='r+' or 'c'.")
+
+    def _get_mask_weight(self):
+        """Get the weight up to which the integration kernels flag voxels for get_mesh.
+
+        Returns:
+            float: min_weight of the last get_mesh call, -1 when it did not mask the mesh.
+        """
+        return -1.0 if self._mesh_min_weight is None else float(self._mesh_min_weight)
+
+    def get_point_cloud(self, min_weight=None):
+        """Get the surface points of the tsdf volume without building a mesh.
+
+        A point is interpolated on every voxel edge along which the tsdf changes sign,
+        which are the vertices marching cubes would generate. Normals are the normalized
+        tsdf gradient and colors those of the voxel nearest to each point.
+
+        Args:
+            min_weight (float, optional): only keep the points between two voxels with a
+                weight greater than min_weight. Defaults to None, meaning every point is kept.
+
+        Returns:
+            numpy.array [n, 3]: each row represents a 3D point.
+            numpy.array [n, 3]: each row represents the normal vector for the corresponding 3D point.
+            numpy.array [n, 3]: each row represents the color of the corresponding 3D point.
+        """
+        # the sign, the interpolation and the normalized gradient do not depend on the
+        # tsdf scale, so the kernels read the volume in its storage type
+        min_weight = -1.0 if min_weight is None else float(min_weight)
+        counts = count_zero_crossings_kernel(self._tsdf_volume, self._weight_volume, min_weight)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        voxel_points = np.empty((counts.sum(), 3), dtype=np.float32)
+        normals = np.zeros((counts.sum(), 3), dtype=np.float32)
+        colors = np.empty((counts.sum(), 3), dtype=np.uint8)
+        zero_crossings_kernel(self._tsdf_volume, self._weight_volume, self._color_volume, min_weight, offsets,
+                              voxel_points, normals, colors)
+
+        points = self.voxel_to_world(self._volume_origin, voxel_points, self._voxel_size)
+        return points, normals, colors
+
+    def raycast(self, camera_intrinsics, image_height, image_width, camera_pose):
+        """Render depth, normal and color images of the fused surface seen from a camera.
+
+        Only surfaces between observed voxels are rendered, the first one along each ray.
+
+        Args:
+            camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+            image_height (int): height of the rendered images in pixels.
+            image_width (int): width of the rendered images in pixels.
+            camera_pose (numpy.array [4, 4] or Pose): SE3 transform representing pose (camera to world)
+
+        Raises:
+            ValueError: If camera_pose is not a valid transform.
+
+        Returns:
+            numpy.array [h, w]: A z depth image in meters, 0 where no surface is hit.
+            numpy.array [h, w, 3]: unit normals of the surface in world coordinates, facing
+                the free space in front of it. 0 where no surface is hit.
+            numpy.array [h, w, 3]: An rgb image, 0 where no surface is hit.
+        """
+        camera_pose = Pose(camera_pose)
+        depth_image = np.zeros((image_height, image_width), dtype=np.float32)
+        normal_image = np.zeros((image_height, image_width, 3), dtype=np.float32)
+        color_image = np.zeros((image_height, image_width, 3), dtype=np.uint8)
+        raycast_kernel(
+            self._tsdf_volume,
+            self._weight_volume,
+            self._color_volume,
+            self._volume_origin,
+            self._voxel_size,
+            self._truncation_margin,
+            self._tsdf_scale,
+            surface_bricks_kernel(self._tsdf_volume, RAYCAST_BRICK_SIZE),
+            RAYCAST_BRICK_SIZE,
+            np.asarray(camera_intrinsics, dtype=np.float64),
+            camera_pose.matrix,
+            depth_image,
+            normal_image,
+            color_image)
+        return depth_image, normal_image, color_image
+
     """
     *******************************************************************************
     ****************************** ASSIGNMENT BEGINS ******************************
@@ -109,7 +1453,7 @@ class TSDFVolume:
     """
 
     @staticmethod
-    @njit(parallel=True)
+    @njit(parallel=True, cache=True)
     def voxel_to_world(volume_origin, voxel_coords, voxel_size):
         """ Convert from voxel coordinates to world coordinates
             (in effect scaling voxel_coords by voxel_size).
@@ -131,15 +1475,13 @@ class TSDFVolume:
         for i in prange(voxel_coords.shape[0]):
             # TODO:(DONE)
             #world_coordinate = world_origin + voxel_coordinate * voxel_size
-            points=[]
             for j in range(3):
-              points.append(volume_origin[j]+(voxel_coords[i][j]*voxel_size))
-            world_points[i]=points
+                world_points[i, j] = volume_origin[j] + voxel_coords[i, j] * voxel_size
         return world_points
 
     @staticmethod
-    @njit(parallel=True)
-    def get_new_tsdf_and_weights(tsdf_old, margin_distance, w_old, observation_weight):
+    def get_new_tsdf_and_weights(tsdf_old, margin_distance, w_old, observation_weight, tsdf_scale=1.0,
+                                 max_weight=None):
         """[summary]
 
         Args:
@@ -151,19 +1493,25 @@ class TSDFVolume:
                 of valid voxels.
             w_old (numpy.array [v, ]): old weight values.
             observation_weight (float): Weight to give each new observation.
+            tsdf_scale (float, optional): value a tsdf of 1 is stored as in tsdf_old,
+                see TSDF_SCALES. Defaults to 1.
+            max_weight (float, optional): largest weight that can be stored in w_old.
+                Defaults to None, the one of its type in MAX_WEIGHTS, so integer weights
+                saturate rather than wrap around.
 
         Returns:
-            numpy.array [v, ]: new tsdf values for entries in tsdf_old
-            numpy.array [v, ]: new weights to be used in the future.
+            numpy.array [v, ]: new tsdf values for entries in tsdf_old, stored like tsdf_old.
+            numpy.array [v, ]: new weights to be used in the future, stored like w_old.
         """
-        tsdf_new = np.empty_like(tsdf_old, dtype=np.float32)
-        w_new = np.empty_like(w_old, dtype=np.float32)
-
-        for i in prange(len(tsdf_old)):
-            # TODO:(DONE)
-            w_new[i]=w_old[i]+observation_weight
-            tsdf_new[i]=(w_old[i]*tsdf_old[i]+observation_weight*margin_distance[i])/w_new[i]
-        return tsdf_new, w_new
+        if max_weight is None:
+            if w_old.dtype in MAX_WEIGHTS:
+                max_weight = MAX_WEIGHTS[w_old.dtype]
+            elif np.issubdtype(w_old.dtype, np.integer):
+                max_weight = float(np.iinfo(w_old.dtype).max)
+            else:
+                max_weight = np.inf
+        return tsdf_and_weights_kernel(tsdf_old, margin_distance, w_old, float(observation_weight),
+                                       float(tsdf_scale), float(max_weight))
 
     def get_valid_points(self, depth_image, voxel_u, voxel_v, voxel_z):
         """ Compute a boolean array for indexing the voxel volume and other variables.
@@ -216,33 +1564,28 @@ class TSDFVolume:
         """ Compute the new RGB values for the color volume given the current values
         in the color volume, the RGB image pixels, and the old and new weights.
 
+        The colors are averaged like update_voxel does, normalized by w_old + observation_weight
+        rather than by w_new, which stops growing once integer weights saturate.
+
         Args:
             color_old (numpy.array [n, 3]): Old colors from self._color_volume in RGB.
             color_new (numpy.array [n, 3]): Newly observed colors from the image in RGB
             w_old (numpy.array [n, ]): Old weights from the self._weights_volume
-            w_new (numpy.array [n, ]): New weights from calling get_new_tsdf_and_weights
+            w_new (numpy.array [n, ]): New weights from calling get_new_tsdf_and_weights,
+                only kept for compatibility.
             observation_weight (float, optional):  The weight to assign for the current
                 observation. Defaults to 1.
         Returns:
-            valid_points numpy.array [n, 3]: The newly computed colors in RGB. Note that
-            the input color and output color should have the same dimensions.
+            numpy.array [n, 3]: The newly computed colors in RGB, whole values in [0, 255]
+            stored like color_old.
         """
+        w_old = np.asarray(w_old, dtype=np.float64)[:, None]
+        colors = (w_old * color_old + observation_weight * np.asarray(color_new, dtype=np.float64)) \
+            / (w_old + observation_weight)
+        return np.clip(np.floor(colors), 0, 255).astype(color_old.dtype)
 
-        # TODO:(DONE) Compute the new R, G, and B value by summing the old color
-        #  value weighted by the old weight, and the new color weighted by
-        #  observation weight. Finally normalize the sum by the new weight.
-        valid_points = np.empty_like(color_old,dtype=np.uint8)
-        for i in range(len(w_old)):
-          colors=[]
-          for j in range(3):
-            colors.append((w_old[i]*color_old[i][j]+observation_weight*color_new[i][j])/w_new[i])
-          valid_points[i]=colors
-
-        valid_points=np.clip(valid_points, 0, 255)
-
-        return valid_points
-
-    def integrate(self, color_image, depth_image, camera_intrinsics, camera_pose, observation_weight=1.):
+    def integrate(self, color_image, depth_image, camera_intrinsics, camera_pose, observation_weight=1.,
+                  band_only=False, pyramid_level=0):
         """Integrate an RGB-D observation into the TSDF volume, by updating the weight volume,
             tsdf volume, and color volume.
 
@@ -250,94 +1593,250 @@ class TSDFVolume:
             color_image (numpy.array [h, w, 3]): An rgb image.
             depth_image (numpy.array [h, w]): A z depth image.
             camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
-            camera_pose (numpy.array [4, 4]): SE3 transform representing pose (camera to world)
+            camera_pose (numpy.array [4, 4] or Pose): SE3 transform representing pose (camera to world)
             observation_weight (float, optional):  The weight to assign for the current
                 observation. Defaults to 1.
+            band_only (bool, optional): Only update the voxels along the rays of valid depth
+                pixels within the truncation margin of the measured depth, instead of every
+                voxel in the camera frustum. The cost then scales with the image resolution
+                rather than the volume size, but free space in front of the surface is not
+                carved. Defaults to False.
+            pyramid_level (int, optional): Integrate the images downsampled pyramid_level times
+                by image.build_pyramid, with the intrinsics scaled accordingly. Every level
+                quarters the pixels, trading resolution for throughput when integration falls
+                behind the sensor, mostly with band_only. Defaults to 0, the full resolution.
+
+        Raises:
+            ValueError: If the volume was loaded read only.
+            ValueError: If camera_pose is not a valid transform.
+            ValueError: If observation_weight is not a whole number and the weight volume
+                stores integers.
+            ValueError: If pyramid_level is negative.
         """
-        color_image = color_image.astype(np.float32)
+        # stats are only gathered when enabled, everything else stays off the hot path
+        frame = None if self._stats is None else FrameStats('band' if band_only else 'frustum')
 
-        # TODO: 1. Project the voxel grid coordinates to the world
-        #  space by calling `voxel_to_world`. Then, transform the points
-        #  in world coordinate to camera coordinates, which are in (u, v).
-        #  You might want to save the voxel z coordinate for later use.
-        
-        #Projected voxel grid
-        voxel_points=self.voxel_to_world(self._volume_origin,self._voxel_coords,self._voxel_size)
-        #world to camera
-        camera_points=transform_point3s(transform_inverse(camera_pose), voxel_points)
-        camera_voxel_z= camera_points[:, 2]
-        image_voxels= camera_to_image(camera_intrinsics,camera_points)
-        #z is the distance from camera to image
-        #camera to image 
-
-        # TODO: 2.
-        #  Get all of the valid points in the voxel grid by implementing
-        #  the helper get_valid_points. Be sure to pass in the correct parameters.
-        ## pass u and v from camera to image
-        #z id from camera coordinates
-        valid_points_bool=self.get_valid_points(depth_image,image_voxels[:,0], image_voxels[:,1], camera_voxel_z)
-        #print(sum(valid_points_bool))
-        # TODO: 3.
-        #  With the valid_points (Use to figure out which of them are valid from voxel_coords) array as your indexing array, index into
-        #  the self._voxel_coords variable to get the valid voxel x, y, and z all of the possible coordinates.
-        # self._tsdf_volume 
-        # which u v pixels to keep 
-        
-        valid_indices=self._voxel_coords[valid_points_bool]
+        self._check_writeable()
+        if self._max_weight != np.inf and observation_weight != int(observation_weight):
+            raise ValueError('observation_weight must be a whole number with integer weights.')
 
-        # TODO: 4. With the valid_points array as your indexing array,
-        #  get the valid pixels. Use those valid pixels to index into
-        #  the depth_image, and find the valid margin distance.
-        # Calculate depth differences
-        valid_pixels=image_voxels[valid_points_bool]
-        valid_camera_z=camera_voxel_z[valid_points_bool]
+        # validated once, the inverse and the frustum reuse it
+        camera_pose = Pose(camera_pose)
+        world_to_camera = camera_pose.inverse().matrix
+        camera_intrinsics = np.asarray(camera_intrinsics, dtype=np.float64)
+        if pyramid_level < 0:
+            raise ValueError('pyramid_level must not be negative.')
+        if pyramid_level > 0:
+            # imported on first use, opencv is slow to import and only needed for the pyramid
+            from image import build_pyramid
+            color_image, depth_image, camera_intrinsics = build_pyramid(
+                color_image, depth_image, camera_intrinsics, pyramid_level + 1)[-1]
+        if frame is not None:
+            frame.lap('setup')
 
-        margin_distance=depth_image[valid_pixels[:,1],valid_pixels[:,0]]-valid_camera_z
-        margin_distance = margin_distance/self._truncation_margin
-        margin_distance=np.clip(margin_distance,-1,1)
+        if band_only:
+            samples, valid = truncation_band_voxels(
+                depth_image, camera_intrinsics, camera_pose.matrix,
+                self._volume_origin, self._voxel_size, self._truncation_margin)
+            samples = samples[valid].reshape(-1, 3)
+            inside = np.all((samples >= 0) & (samples < self._voxel_bounds), axis=1)
+            voxel_indices = unique_indices(np.ravel_multi_index(samples[inside].T, self._voxel_bounds))
+            if frame is not None:
+                frame.lap('band')
+                frame.frustum_voxel_count = len(voxel_indices)
+                frame.valid_voxel_count = int(count_valid_voxel_indices_kernel(
+                    voxel_indices, self._voxel_bounds, self._volume_origin, self._voxel_size,
+                    self._truncation_margin, depth_image, camera_intrinsics, world_to_camera))
+                frame.lap('projection')
 
-        
+            integrate_voxels_kernel(
+                self._tsdf_volume,
+                self._weight_volume,
+                self._color_volume,
+                voxel_indices,
+                self._volume_origin,
+                self._voxel_size,
+                self._truncation_margin,
+                color_image,
+                depth_image,
+                camera_intrinsics,
+                world_to_camera,
+                float(observation_weight),
+                self._tsdf_scale,
+                self._max_weight,
+                self._dirty_blocks,
+                self._mesh_block_size,
+                self._get_mask_weight())
+            if frame is not None:
+                frame.lap('fuse')
+                self._stats.record(frame)
+            return
 
-        
+        # Only voxels inside the camera frustum can be updated, skip the rest of the grid
+        voxel_min, voxel_max = self.get_frustum_voxel_bounds(depth_image, camera_intrinsics, camera_pose)
+        if frame is not None:
+            frame.lap('frustum')
+        if np.any(voxel_max <= voxel_min):
+            if frame is not None:
+                self._stats.record(frame)
+            return
+        if frame is not None:
+            frame.frustum_voxel_count = int(np.prod(voxel_max - voxel_min))
+            frame.valid_voxel_count = int(count_valid_voxels_kernel(
+                voxel_min, voxel_max, self._volume_origin, self._voxel_size, self._truncation_margin,
+                depth_image, camera_intrinsics, world_to_camera))
+            frame.lap('projection')
 
-        
+        # The whole per-voxel chain (world -> camera projection, validity test,
+        # depth lookup, tsdf/weight update and color update) runs in a single
+        # parallel pass over the frustum that writes the volumes in place.
+        integrate_kernel(
+            self._tsdf_volume,
+            self._weight_volume,
+            self._color_volume,
+            voxel_min,
+            voxel_max,
+            self._volume_origin,
+            self._voxel_size,
+            self._truncation_margin,
+            color_image,
+            depth_image,
+            camera_intrinsics,
+            world_to_camera,
+            float(observation_weight),
+            self._tsdf_scale,
+            self._max_weight,
+            self._dirty_blocks,
+            self._mesh_block_size,
+            self._get_mask_weight())
+        if frame is not None:
+            frame.lap('fuse')
+            self._stats.record(frame)
 
-        #index into depth image by valid pixels - valid_camera_z / self.truncation_margin 
-        #then clip from -1 to 1
+    def integrate_batch(self, color_images, depth_images, camera_intrinsics, camera_poses,
+                        observation_weights=None):
+        """Integrate a batch of RGB-D observations into the TSDF volume.
 
-        # TODO: 5.
-        #  Compute the new weight volume and tsdf volume by calling
-        #  `get_new_tsdf_and_weights`. Then update the weight volume
-        #  and tsdf volume.
-        
-        tsdf_volume, weight_volume= self.get_new_tsdf_and_weights(
-            self._tsdf_volume[valid_indices[:,0],valid_indices[:,1],valid_indices[:,2]], 
-            margin_distance, 
-            self._weight_volume[valid_indices[:,0],valid_indices[:,1],valid_indices[:,2]], 
-            observation_weight)
-        
-        self._tsdf_volume[valid_indices[:,0],valid_indices[:,1],valid_indices[:,2]]=tsdf_volume
-        old_weight=self._weight_volume[valid_indices[:,0],valid_indices[:,1],valid_indices[:,2]]
-        self._weight_volume[valid_indices[:,0],valid_indices[:,1],valid_indices[:,2]]=weight_volume
-
-        # TODO: 6.
-        #  Compute the new colors for only the valid voxels by using
-        #  get_new_colors_with_weights, and update the current color volume
-        #  with the new colors. The color_old and color_new parameters can
-        #  be obtained by indexing the valid voxels in the color volume and
-        #  indexing the valid pixels in the rgb image.
-
-        new_colors=self.get_new_colors_with_weights(
-            self._color_volume[valid_indices[:,0],valid_indices[:,1],valid_indices[:,2]],
-            color_image[valid_pixels[:,1],valid_pixels[:,0]],
-            old_weight,
-            self._weight_volume[valid_indices[:,0],valid_indices[:,1],valid_indices[:,2]],
-            observation_weight)
-        
-        self._color_volume[valid_indices[:,0],valid_indices[:,1],valid_indices[:,2]]=new_colors
+        The result is the same as calling integrate on each frame in order, but the
+        volumes are traversed once for the whole batch.
+
+        Args:
+            color_images (numpy.array [f, h, w, 3]): rgb images.
+            depth_images (numpy.array [f, h, w]): z depth images.
+            camera_intrinsics (numpy.array [3, 3]): given as [[fu, 0, u0], [0, fv, v0], [0, 0, 1]]
+            camera_poses (numpy.array [f, 4, 4]): SE3 transforms representing pose (camera to world)
+            observation_weights (numpy.array [f, ], optional): The weight to assign for each
+                observation. Defaults to None, meaning a weight of 1 for every frame.
+
+        Raises:
+            ValueError: If the number of color images, depth images, poses and weights differ.
+            ValueError: If the volume was loaded read only.
+            ValueError: If a camera pose is not a valid transform.
+            ValueError: If an observation weight is not a whole number and the weight volume
+                stores integers.
+        """
+        frame = None if self._stats is None else FrameStats('batch', len(depth_images))
+        self._check_writeable()
+        color_images = np.ascontiguousarray(color_images)
+        depth_images = np.ascontiguousarray(depth_images)
+        camera_poses = np.asarray(camera_poses, dtype=np.float64)
+        camera_intrinsics = np.asarray(camera_intrinsics, dtype=np.float64)
+        frame_count = len(depth_images)
+        if observation_weights is None:
+            observation_weights = np.ones(frame_count)
+        observation_weights = np.asarray(observation_weights, dtype=np.float64)
+
+        if not (len(color_images) == len(camera_poses) == len(observation_weights) == frame_count):
+            raise ValueError('Expected the same number of color images, depth images, poses and weights.')
+        if self._max_weight != np.inf and np.any(observation_weights != np.round(observation_weights)):
+            raise ValueError('observation_weights must be whole numbers with integer weights.')
+        if frame_count == 0:
+            return
+
+        world_to_cameras = transform_inverse_batch(camera_poses)
+        if frame is not None:
+            frame.lap('setup')
+        voxel_min = np.empty((frame_count, 3), dtype=np.int64)
+        voxel_max = np.empty((frame_count, 3), dtype=np.int64)
+        for f in range(frame_count):
+            voxel_min[f], voxel_max[f] = self.get_frustum_voxel_bounds(
+                depth_images[f], camera_intrinsics, Pose(camera_poses[f], check=False))
+        if frame is not None:
+            frame.lap('frustum')
+            frame.frustum_voxel_count = int(np.clip(voxel_max - voxel_min, 0, None).prod(axis=1).sum())
+            frame.valid_voxel_count = int(sum(count_valid_voxels_kernel(
+                voxel_min[f], voxel_max[f], self._volume_origin, self._voxel_size, self._truncation_margin,
+                depth_images[f], camera_intrinsics, world_to_cameras[f]) for f in range(frame_count)))
+            frame.lap('projection')
+
+        integrate_batch_kernel(
+            self._tsdf_volume,
+            self._weight_volume,
+            self._color_volume,
+            voxel_min,
+            voxel_max,
+            self._volume_origin,
+            self._voxel_size,
+            self._truncation_margin,
+            color_images,
+            depth_images,
+            camera_intrinsics,
+            world_to_cameras,
+            observation_weights,
+            self._tsdf_scale,
+            self._max_weight,
+            self._dirty_blocks,
+            self._mesh_block_size,
+            self._get_mask_weight(),
+            16)  # 16^3 voxel tiles keep a tile and its image patches in cache
+        if frame is not None:
+            frame.lap('fuse')
+            self._stats.record(frame)
 
     """
     *******************************************************************************
     ******************************* ASSIGNMENT ENDS *******************************
     *******************************************************************************
     """
+
+
+def warmup(storage_dtypes=((np.float32, np.float32, np.float32),), depth_dtype=np.float64):
+    """Compile the numba kernels used per frame before the first frame arrives.
+
+    Kernels are cached on disk next to the sources, so the first process compiles them
+    and the next ones only load them. Either way the cost is paid here rather than in
+    the first call to integrate. Meshing does not need any compilation.
+
+    Args:
+        storage_dtypes (iterable, optional): (tsdf_dtype, weight_dtype, color_dtype) storage
+            types of the volumes to compile the kernels for, see TSDFVolume. Defaults to
+            float32 storage.
+        depth_dtype (numpy.dtype, optional): type of the depth images. Defaults to float64,
+            as returned by image.read_depth.
+    """
+    # a small camera looking down +z into a small volume, so no kernel is skipped
+    intrinsics = np.array([[4., 0., 2.], [0., 4., 2.], [0., 0., 1.]])
+    color_image = np.zeros((4, 4, 3), dtype=np.uint8)
+    depth_image = np.full((4, 4), 0.1, dtype=depth_dtype)
+    camera_pose = np.eye(4)
+    volume_bounds = np.array([[-0.1, 0.1], [-0.1, 0.1], [0., 0.2]])
+
+    for tsdf_dtype, weight_dtype, color_dtype in storage_dtypes:
+        with contextlib.redirect_stdout(io.StringIO()):  # silence the volume size report
+            volume = TSDFVolume(volume_bounds.copy(), 0.05, tsdf_dtype, weight_dtype, color_dtype)
+        volume.integrate(color_image, depth_image, intrinsics, camera_pose)
+        volume.integrate(color_image, depth_image, intrinsics, camera_pose, band_only=True)
+        volume.integrate_batch(color_image[None], depth_image[None], intrinsics, camera_pose[None])
+        volume.get_point_cloud()
+        volume.raycast(intrinsics, 4, 4, camera_pose)
+        volume.get_new_tsdf_and_weights(volume._tsdf_volume[0, 0], np.zeros(volume._voxel_bounds[2]),
+                                        volume._weight_volume[0, 0], 1., volume._tsdf_scale, volume._max_weight)
+        # get_mesh converts float64 vertices
+        volume.voxel_to_world(volume._volume_origin, np.zeros((1, 3)), volume._voxel_size)
+
+    # point cloud tooling, on whole and cropped images
+    points = depth_to_point_cloud(intrinsics, depth_image)
+    depth_to_point_cloud(intrinsics, depth_image, stride=2, color_image=color_image, camera_pose=camera_pose)
+    camera_to_image(intrinsics, points)
+    transform_point3s(camera_pose, points.astype(np.float32))
+    transform_point3s_batch(camera_pose[None], points)
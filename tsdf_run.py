@@ -1,4 +1,4 @@
-from image import read_rgb, read_depth
+from dataset import RGBDDataset
 import numpy as np
 import os
 from ply import Ply
@@ -8,24 +8,21 @@ import tsdf
 
 if __name__ == "__main__":
     # Set bounds based on max and min in each dimension in the world space.
-    image_count = 10
-    camera_intrensics = np.loadtxt("./data/camera-intrinsics.txt", delimiter=' ')
+    dataset = RGBDDataset("./data", frame_count=10, prefetch=4)
+    image_count = len(dataset)
+    camera_intrensics = dataset.get_camera_intrinsics()
     volume_bounds = np.array([[-0.75,  0.75], [-0.75, 0.75], [0., 0.8]])
 
     # Initialize voxel volume
     print("Initializing voxel volume...")
     tsdf_volume = tsdf.TSDFVolume(volume_bounds, voxel_size=0.01)
 
-    # Loop through RGB-D images and fuse them together
+    # Loop through RGB-D images and fuse them together, the dataset reads the
+    # next frames in the background while the current one is fused
     start_time = time.time()
-    for i in range(image_count):
+    for i, (color_image, depth_image, camera_pose) in enumerate(dataset):
         print("Fusing frame %d/%d"%(i+1, image_count))
 
-        # Read RGB-D image and camera pose
-        color_image = read_rgb("./data/frame-%06d.color.png"%(i))
-        depth_image = read_depth("./data/frame-%06d.depth.png"%(i))
-        camera_pose = np.loadtxt("./data/frame-%06d.pose.txt"%(i))
-
         # Integrate observation into voxel volume (assume color aligned with depth)
         tsdf_volume.integrate(color_image, depth_image, camera_intrensics, camera_pose, observation_weight=1.)
 
@@ -40,5 +37,6 @@ if __name__ == "__main__":
 
     # Get point cloud from voxel volume and save to disk (can be viewed with Meshlab)
     print("Saving point cloud to point_cloud.ply...")
+    points, normals, colors = tsdf_volume.get_point_cloud()
     pc = Ply(points=points, normals=normals, colors=colors)
     pc.write(os.path.join('supplemental', 'point_cloud.ply'))
@@ -0,0 +1,489 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy as np
+from skimage import measure
+from tsdf import *
+
+
+class TestTSDFVolume(unittest.TestCase):
+    """Unit test tsdf.py.
+    """
+
+    def setUp(self):
+        # a 64x48 camera looking down +z at a plane 0.5m away
+        self.camera_intrinsics = np.array([[60., 0., 32.],
+                                           [0., 60., 24.],
+                                           [0., 0., 1.]])
+        self.depth_image = np.full((48, 64), 0.5)
+        self.depth_image[:8, :8] = 0.  # missing depth
+        self.color_image = np.zeros((48, 64, 3), dtype=np.uint8)
+        self.color_image[..., 0] = np.arange(64, dtype=np.uint8)[None, :] * 3
+        self.color_image[..., 1] = np.arange(48, dtype=np.uint8)[:, None] * 5
+        self.color_image[..., 2] = 200
+        self.camera_pose = np.eye(4)
+        self.camera_pose[:3, 3] = [0.013, -0.021, 0.004]
+        self.volume_bounds = np.array([[-0.3, 0.3], [-0.2, 0.2], [0.3, 0.7]])
+
+    def test_integrate(self):
+        """Test TSDFVolume.integrate against the step by step reference.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        reference = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+
+        for observation_weight in [1., 0.5]:
+            volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics,
+                             self.camera_pose, observation_weight=observation_weight)
+            self._reference_integrate(reference, self.color_image, self.depth_image,
+                                      self.camera_intrinsics, self.camera_pose, observation_weight)
+
+        self.assertTrue(np.allclose(volume._tsdf_volume, reference._tsdf_volume, atol=1e-5))
+        self.assertTrue(np.allclose(volume._weight_volume, reference._weight_volume))
+        self.assertTrue(np.allclose(volume._color_volume, reference._color_volume))
+
+        # the plane lies inside the volume, so there must be observed voxels on both sides
+        self.assertTrue((volume._tsdf_volume[volume._weight_volume > 0] > 0).any())
+        self.assertTrue((volume._tsdf_volume[volume._weight_volume > 0] < 0).any())
+
+    def test_integrate_rotated(self):
+        """Test TSDFVolume.integrate updates the same voxels as the reference whatever the camera orientation.
+        """
+        volume_bounds = np.array([[-0.6, 0.6], [-0.4, 0.4], [-0.6, 0.6]])
+        for angle in [0., np.pi / 5, np.pi / 4]:
+            camera_pose = np.eye(4)
+            camera_pose[[[0], [2]], [0, 2]] = [[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]]
+            volume = TSDFVolume(volume_bounds.copy(), voxel_size=0.02)
+            reference = TSDFVolume(volume_bounds.copy(), voxel_size=0.02)
+            volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, camera_pose)
+            self._reference_integrate(reference, self.color_image, self.depth_image, self.camera_intrinsics,
+                                      camera_pose, 1.)
+
+            self.assertTrue(np.array_equal(volume._weight_volume > 0, reference._weight_volume > 0))
+            self.assertTrue(np.allclose(volume._tsdf_volume, reference._tsdf_volume, atol=1e-5))
+
+            # a rotated frustum box holds voxels far behind the deepest observation, they are not updated
+            voxel_min, voxel_max = volume.get_frustum_voxel_bounds(
+                self.depth_image, self.camera_intrinsics, camera_pose)
+            voxel_coords = volume.get_voxel_coords()
+            in_box = np.all((voxel_coords >= voxel_min) & (voxel_coords < voxel_max), axis=1)
+            voxel_points = volume.voxel_to_world(volume._volume_origin, voxel_coords[in_box], volume._voxel_size)
+            camera_z = transform_point3s(transform_inverse(camera_pose), voxel_points)[:, 2]
+            self.assertEqual(angle > 0, (camera_z > 0.5 + volume._truncation_margin + 0.1).any())
+
+    def test_integrate_band_only(self):
+        """Test TSDFVolume.integrate restricted to the truncation band.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        band = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+        band.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose, band_only=True)
+
+        # only voxels around the surface are touched, with the same values as a full update
+        updated = band._weight_volume > 0
+        self.assertTrue(updated.any())
+        free_space = (volume._weight_volume > 0) & (volume._tsdf_volume >= 1)
+        self.assertLess(updated[free_space].sum(), 0.25 * free_space.sum())
+        self.assertTrue(np.allclose(band._tsdf_volume[updated], volume._tsdf_volume[updated]))
+        self.assertTrue(np.allclose(band._color_volume[updated], volume._color_volume[updated]))
+
+        # and all of the surface voxels are found
+        surface = (volume._weight_volume > 0) & (np.abs(volume._tsdf_volume) < 0.5)
+        self.assertTrue(updated[surface].all())
+
+    def test_integrate_pyramid_level(self):
+        """Test TSDFVolume.integrate on a downsampled pyramid level.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        coarse = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+        coarse.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose,
+                         pyramid_level=2)
+
+        # a plane is a plane at any resolution, only voxels near the image border may differ
+        observed = (volume._weight_volume > 0) & (coarse._weight_volume > 0)
+        self.assertGreater(observed.sum(), 0.9 * (volume._weight_volume > 0).sum())
+        self.assertTrue(np.allclose(coarse._tsdf_volume[observed], volume._tsdf_volume[observed], atol=1e-5))
+        self.assertTrue(np.allclose(coarse._color_volume[observed], volume._color_volume[observed], atol=12))
+
+        with self.assertRaises(ValueError):
+            coarse.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose,
+                             pyramid_level=-1)
+
+    def test_integrate_compact_storage(self):
+        """Test TSDFVolume.integrate with compact volume storage types.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        compact = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02,
+                             tsdf_dtype=np.int16, weight_dtype=np.uint8, color_dtype=np.uint8)
+        self.assertEqual(compact._tsdf_volume.nbytes + compact._weight_volume.nbytes + compact._color_volume.nbytes,
+                         6 * np.prod(compact._voxel_bounds))
+
+        for _ in range(3):
+            volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+            compact.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+        tsdf_volume, color_volume = volume.get_volume()
+        compact_tsdf_volume, compact_color_volume = compact.get_volume()
+        self.assertEqual(compact_tsdf_volume.dtype, np.float32)
+        self.assertTrue(np.allclose(compact_tsdf_volume, tsdf_volume, atol=1e-4))
+        self.assertTrue(np.array_equal(compact._weight_volume, volume._weight_volume))
+        self.assertTrue(np.array_equal(compact_color_volume, color_volume))
+
+        with self.assertRaises(ValueError):
+            compact.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose,
+                              observation_weight=0.5)
+        with self.assertRaises(ValueError):
+            TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02, tsdf_dtype=np.uint8)
+
+    def test_get_new_tsdf_and_weights(self):
+        """Test TSDFVolume.get_new_tsdf_and_weights on compact storage types.
+        """
+        tsdf_old = np.array([32767, 0, -16384], dtype=np.int16)
+        w_old = np.array([0, 1, 255], dtype=np.uint8)
+        margin_distance = np.array([-1., 0.5, 1.])
+
+        tsdf_new, w_new = TSDFVolume.get_new_tsdf_and_weights(tsdf_old, margin_distance, w_old, 1., 32767., 255.)
+        self.assertEqual(tsdf_new.dtype, np.int16)
+        self.assertEqual(w_new.dtype, np.uint8)
+        self.assertTrue(np.array_equal(tsdf_new, [-32767, 8192, np.round((255 * -0.5 + 1.) / 256 * 32767)]))
+        self.assertTrue(np.array_equal(w_new, [1, 2, 255]))
+
+        # integer weights saturate by default instead of wrapping around
+        _, w_new = TSDFVolume.get_new_tsdf_and_weights(tsdf_old, margin_distance, w_old, 1., 32767.)
+        self.assertTrue(np.array_equal(w_new, [1, 2, 255]))
+
+    def test_get_new_colors_with_weights(self):
+        """Test TSDFVolume.get_new_colors_with_weights on saturated uint8 weights.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        color_old = np.array([[255, 255, 255], [0, 100, 200]], dtype=np.uint8)
+        color_new = np.array([[255, 255, 255], [255, 100, 0]], dtype=np.uint8)
+        w_old = np.array([255, 255], dtype=np.uint8)
+        colors = volume.get_new_colors_with_weights(color_old, color_new, w_old, w_old)
+        self.assertEqual(colors.dtype, np.uint8)
+        self.assertTrue(np.array_equal(colors, [[255, 255, 255], [0, 100, 199]]))
+
+    def test_integrate_batch(self):
+        """Test TSDFVolume.integrate_batch against integrating frame by frame.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        batch = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+
+        camera_poses = np.stack([self.camera_pose] * 3)
+        camera_poses[1, :3, 3] += [0.05, 0., -0.02]
+        camera_poses[2, :3, :3] = [[np.cos(0.1), 0., np.sin(0.1)], [0., 1., 0.], [-np.sin(0.1), 0., np.cos(0.1)]]
+        depth_images = np.stack([self.depth_image, self.depth_image + 0.03, self.depth_image - 0.02])
+        color_images = np.stack([self.color_image, 255 - self.color_image, self.color_image // 2])
+        observation_weights = [1., 2., 0.5]
+
+        for f in range(3):
+            volume.integrate(color_images[f], depth_images[f], self.camera_intrinsics, camera_poses[f],
+                             observation_weight=observation_weights[f])
+        batch.integrate_batch(color_images, depth_images, self.camera_intrinsics, camera_poses,
+                              observation_weights=observation_weights)
+
+        self.assertTrue(np.array_equal(batch._tsdf_volume, volume._tsdf_volume))
+        self.assertTrue(np.array_equal(batch._weight_volume, volume._weight_volume))
+        self.assertTrue(np.array_equal(batch._color_volume, volume._color_volume))
+
+        with self.assertRaises(ValueError):
+            batch.integrate_batch(color_images[:2], depth_images, self.camera_intrinsics, camera_poses)
+
+    def test_get_mesh(self):
+        """Test TSDFVolume.get_mesh only extracts the blocks changed since the previous call.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02, mesh_block_size=8)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+        points, triangles, normals, colors = volume.get_mesh()
+
+        # the same surface as a single pass over the whole volume
+        full_points, full_triangles, _, _ = measure.marching_cubes(volume._tsdf_volume, level=0, method='lewiner')
+        full_points = volume.voxel_to_world(volume._volume_origin, full_points, volume._voxel_size)
+        self.assertTrue((np.abs(points[:, 2] - 0.504) < 1e-3).any())
+        self.assertEqual(len(triangles), len(full_triangles))
+        self.assertTrue(np.allclose(np.unique(points.round(4), axis=0), np.unique(full_points.round(4), axis=0)))
+        self.assertEqual(len(np.unique(points.round(5), axis=0)), len(points))
+        self.assertFalse(volume._dirty_blocks.any())
+
+        # a second observation of a small patch only dirties the blocks around it
+        depth_image = np.zeros_like(self.depth_image)
+        depth_image[20:28, 28:36] = 0.45
+        volume.integrate(self.color_image, depth_image, self.camera_intrinsics, self.camera_pose)
+        self.assertTrue(volume._dirty_blocks.any())
+        self.assertFalse(volume._dirty_blocks.all())
+        points, triangles, normals, colors = volume.get_mesh()
+
+        # and gives the same mesh as extracting every block again
+        volume._dirty_blocks[:] = True
+        volume._block_meshes = {}
+        expected = volume.get_mesh()
+        for actual, expected in zip((points, triangles, normals, colors), expected):
+            self.assertTrue(np.array_equal(actual, expected))
+
+    def test_get_mesh_observed(self):
+        """Test TSDFVolume.get_mesh restricted to observed voxels.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02, mesh_block_size=8)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+        # without the mask, surfaces appear where the observed band behind the plane
+        # meets unobserved voxels
+        points, _, _, _ = volume.get_mesh()
+        self.assertTrue((np.abs(points[:, 2] - 0.504) > 0.01).any())
+
+        points, triangles, _, _ = volume.get_mesh(min_weight=0)
+        self.assertGreater(len(triangles), 0)
+        self.assertTrue(np.allclose(points[:, 2], 0.504, atol=1e-3))
+
+        # the edge of a surface seen in the left half of the image is masked until the
+        # free space next to it is observed through the right half
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02, mesh_block_size=4)
+        depth_image = self.depth_image.copy()
+        depth_image[:, 32:] = 0.
+        volume.integrate(self.color_image, depth_image, self.camera_intrinsics, self.camera_pose)
+        volume.get_mesh(min_weight=0)
+        depth_image = np.full_like(self.depth_image, 0.65)
+        depth_image[:, :32] = 0.
+        volume.integrate(self.color_image, depth_image, self.camera_intrinsics, self.camera_pose)
+        points, triangles, normals, colors = volume.get_mesh(min_weight=0)
+
+        volume._dirty_blocks[:] = True
+        volume._block_meshes = {}
+        expected = volume.get_mesh(min_weight=0)
+        for actual, expected_array in zip((points, triangles, normals, colors), expected):
+            self.assertTrue(np.array_equal(actual, expected_array))
+
+    def test_get_mesh_parallel(self):
+        """Test TSDFVolume.get_mesh gives the same mesh with a pool of workers.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02, mesh_block_size=4)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+        expected = volume.get_mesh()
+
+        for use_processes in [False, True]:
+            volume._dirty_blocks[:] = True
+            volume._block_meshes = {}
+            mesh = volume.get_mesh(num_workers=2, use_processes=use_processes)
+            for actual, expected_array in zip(mesh, expected):
+                self.assertTrue(np.array_equal(actual, expected_array))
+
+        with self.assertRaises(ValueError):
+            volume.get_mesh(num_workers=0)
+
+    def test_get_point_cloud(self):
+        """Test TSDFVolume.get_point_cloud against the vertices of get_mesh.
+        """
+        for tsdf_dtype in [np.float32, np.int16]:
+            volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02, tsdf_dtype=tsdf_dtype)
+            volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+            points, normals, colors = volume.get_point_cloud()
+            mesh_points, _, _, mesh_colors = volume.get_mesh()
+            order, mesh_order = np.lexsort(points.T), np.lexsort(mesh_points.T)
+            self.assertTrue(np.allclose(points[order], mesh_points[mesh_order], atol=1e-6))
+            self.assertTrue(np.array_equal(colors[order], mesh_colors[mesh_order]))
+            self.assertTrue(np.allclose(np.linalg.norm(normals, axis=1), 1))
+
+            # only the plane is left between observed voxels
+            points, normals, colors = volume.get_point_cloud(min_weight=0)
+            self.assertGreater(len(points), 0)
+            self.assertTrue(np.allclose(points[:, 2], 0.504, atol=1e-3))
+            self.assertTrue((normals[:, 2] > 0.7).all())
+
+    def test_raycast(self):
+        """Test TSDFVolume.raycast renders the integrated plane back.
+        """
+        for tsdf_dtype in [np.float32, np.int16]:
+            volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02, tsdf_dtype=tsdf_dtype)
+            volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+            depth_image, normal_image, color_image = volume.raycast(self.camera_intrinsics, 48, 64, self.camera_pose)
+
+            # away from the image borders and the missing depth, every ray hits the plane
+            hit = depth_image > 0
+            self.assertTrue(hit[12:-4, 12:-4].all())
+            self.assertFalse(hit[:8, :8].any())
+            self.assertTrue(np.allclose(depth_image[hit], 0.5, atol=2e-3))
+            # facing the camera, except where the observed surface ends
+            self.assertTrue(np.allclose(normal_image[14:-6, 14:-6], [0., 0., -1.], atol=1e-3))
+            self.assertTrue(np.all(color_image[hit][:, 2] == 200))
+            self.assertLess(np.abs(color_image[hit].astype(int) - self.color_image[hit]).mean(), 5)
+
+            # nothing to see looking away from the plane
+            camera_pose = self.camera_pose.copy()
+            camera_pose[:3, :3] = np.diag([1., -1., -1.])
+            depth_image, _, _ = volume.raycast(self.camera_intrinsics, 48, 64, camera_pose)
+            self.assertFalse((depth_image > 0).any())
+
+    def test_save_load(self):
+        """Test TSDFVolume.save and TSDFVolume.load, memory mapped and in memory.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02, tsdf_dtype=np.int16, weight_dtype=np.uint8,
+                            color_dtype=np.uint8, mesh_block_size=8)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+        volume.save(directory)
+        expected_mesh = volume.get_mesh()
+
+        # read only maps can be meshed but not integrated into
+        loaded = TSDFVolume.load(directory)
+        self.assertIsInstance(loaded._tsdf_volume, np.memmap)
+        self.assertTrue(np.array_equal(loaded._volume_bounds, volume._volume_bounds))
+        for actual, expected in zip(loaded.get_mesh(), expected_mesh):
+            self.assertTrue(np.array_equal(actual, expected))
+        with self.assertRaises(ValueError):
+            loaded.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+        # resuming in place gives the volume an uninterrupted run would
+        volume.integrate(self.color_image, self.depth_image + 0.01, self.camera_intrinsics, self.camera_pose)
+        for mmap_mode in [None, 'c', 'r+']:
+            resumed = TSDFVolume.load(directory, mmap_mode=mmap_mode)
+            resumed.integrate(self.color_image, self.depth_image + 0.01, self.camera_intrinsics, self.camera_pose)
+            self.assertTrue(np.array_equal(resumed._tsdf_volume, volume._tsdf_volume))
+            self.assertTrue(np.array_equal(resumed._weight_volume, volume._weight_volume))
+            self.assertTrue(np.array_equal(resumed._color_volume, volume._color_volume))
+
+        # only the last one wrote to the saved files
+        resumed.save(directory)
+        self.assertTrue(np.array_equal(TSDFVolume.load(directory)._tsdf_volume, volume._tsdf_volume))
+
+        # copy on write maps are saved over the files they map
+        volume.integrate(self.color_image, self.depth_image - 0.01, self.camera_intrinsics, self.camera_pose)
+        resumed = TSDFVolume.load(directory, mmap_mode='c')
+        resumed.integrate(self.color_image, self.depth_image - 0.01, self.camera_intrinsics, self.camera_pose)
+        resumed.save(directory)
+        reloaded = TSDFVolume.load(directory)
+        self.assertTrue(np.array_equal(reloaded._tsdf_volume, volume._tsdf_volume))
+        self.assertTrue(np.array_equal(reloaded._weight_volume, volume._weight_volume))
+        self.assertTrue(np.array_equal(reloaded._color_volume, volume._color_volume))
+
+        with self.assertRaises(NameError):
+            TSDFVolume.load(os.path.join(directory, 'missing'))
+
+    def test_stats(self):
+        """Test TSDFVolume.enable_stats records timings and voxel counts of every integration path.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+        self.assertIsNone(volume.get_stats())
+
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        frames = []
+        stats = volume.enable_stats()
+        stats.subscribe(frames.append)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+        # every voxel counted as valid was updated once
+        frame = frames[0]
+        self.assertEqual(frame.mode, 'frustum')
+        self.assertEqual(list(frame.stage_seconds), ['setup', 'frustum', 'projection', 'fuse'])
+        self.assertEqual(frame.valid_voxel_count, np.count_nonzero(volume._weight_volume))
+        self.assertGreaterEqual(frame.frustum_voxel_count, frame.valid_voxel_count)
+
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose, band_only=True)
+        volume.integrate_batch(self.color_image[None].repeat(2, axis=0), self.depth_image[None].repeat(2, axis=0),
+                               self.camera_intrinsics, self.camera_pose[None].repeat(2, axis=0))
+        self.assertEqual([frame.mode for frame in frames], ['frustum', 'band', 'batch'])
+        self.assertLess(frames[1].valid_voxel_count, frame.valid_voxel_count)
+        self.assertEqual(frames[2].valid_voxel_count, 2 * frame.valid_voxel_count)
+
+        stats = volume.get_stats()
+        self.assertEqual(stats.call_count, 3)
+        self.assertEqual(stats.frame_count, 4)
+        self.assertEqual(stats.valid_voxel_count, sum(frame.valid_voxel_count for frame in frames))
+        self.assertEqual(stats.memory_bytes['tsdf'], volume._tsdf_volume.nbytes)
+        self.assertEqual(stats.as_dict()['last_frame'], frames[2].as_dict())
+
+        stats.unsubscribe(frames.append)
+        volume.integrate(self.color_image, self.depth_image, self.camera_intrinsics, self.camera_pose)
+        self.assertEqual(len(frames), 3)
+        self.assertEqual(stats.call_count, 4)
+        volume.disable_stats()
+        self.assertIsNone(volume.get_stats())
+
+    def test_warmup(self):
+        """Test warmup compiles the integration kernels without importing scikit-image.
+        """
+        warmup(storage_dtypes=[(np.int16, np.uint8, np.uint8)])
+        self.assertTrue(len(integrate_kernel.signatures) > 0)
+        self.assertTrue(len(integrate_voxels_kernel.signatures) > 0)
+        self.assertTrue(len(integrate_batch_kernel.signatures) > 0)
+
+        # this module imports skimage itself, check in a fresh interpreter
+        code = 'import sys, tsdf; tsdf.warmup(); sys.exit("skimage" in sys.modules)'
+        self.assertEqual(subprocess.call([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stdout=subprocess.DEVNULL), 0)
+
+    def test_get_voxel_coords(self):
+        """Test TSDFVolume.get_voxel_coords.
+        """
+        volume = TSDFVolume(self.volume_bounds.copy(), voxel_size=0.02)
+        self.assertFalse(hasattr(volume, '_voxel_coords'))
+
+        xv, yv, zv = np.meshgrid(
+            range(volume._voxel_bounds[0]),
+            range(volume._voxel_bounds[1]),
+            range(volume._voxel_bounds[2]),
+            indexing='ij')
+        voxel_coords = np.stack([xv.ravel(), yv.ravel(), zv.ravel()], axis=1)
+
+        self.assertTrue(np.array_equal(volume.get_voxel_coords(), voxel_coords))
+        self.assertTrue(np.array_equal(volume.get_voxel_coords(np.array([5, 0, 1234])), voxel_coords[[5, 0, 1234]]))
+
+    def test_get_frustum_voxel_bounds(self):
+        """Test TSDFVolume.get_frustum_voxel_bounds.
+        """
+        volume = TSDFVolume(np.array([[-2., 2.], [-2., 2.], [-1., 3.]]), voxel_size=0.05)
+        voxel_min, voxel_max = volume.get_frustum_voxel_bounds(
+            self.depth_image, self.camera_intrinsics, self.camera_pose)
+
+        # every voxel that projects into the image within the observed depth range is inside
+        voxel_coords = volume.get_voxel_coords()
+        voxel_points = volume.voxel_to_world(volume._volume_origin, voxel_coords, volume._voxel_size)
+        camera_points = transform_point3s(transform_inverse(self.camera_pose), voxel_points)
+        in_front = (camera_points[:, 2] > 0) & (camera_points[:, 2] <= 0.5 + volume._truncation_margin)
+        image_points = camera_to_image(self.camera_intrinsics, camera_points[in_front])
+        in_image = ((image_points[:, 0] >= 0) & (image_points[:, 0] < 64)
+                    & (image_points[:, 1] >= 0) & (image_points[:, 1] < 48))
+        visible = voxel_coords[in_front][in_image]
+
+        self.assertTrue((visible >= voxel_min).all() and (visible < voxel_max).all())
+        self.assertLess(np.prod(voxel_max - voxel_min), 0.1 * np.prod(volume._voxel_bounds))
+
+        # nothing to visit without depth
+        voxel_min, voxel_max = volume.get_frustum_voxel_bounds(
+            np.zeros((48, 64)), self.camera_intrinsics, self.camera_pose)
+        self.assertTrue(np.any(voxel_max <= voxel_min))
+
+    def _reference_integrate(self, volume, color_image, depth_image, camera_intrinsics,
+                             camera_pose, observation_weight):
+        """Integrate a frame by chaining the TSDFVolume helper methods over every voxel.
+        """
+        voxel_coords = volume.get_voxel_coords()
+
+        voxel_points = volume.voxel_to_world(volume._volume_origin, voxel_coords, volume._voxel_size)
+        camera_points = transform_point3s(transform_inverse(camera_pose), voxel_points)
+        image_points = camera_to_image(camera_intrinsics, camera_points)
+        valid = volume.get_valid_points(depth_image, image_points[:, 0], image_points[:, 1], camera_points[:, 2])
+
+        # voxels further than the truncation margin behind the deepest observation are left alone
+        valid &= camera_points[:, 2] <= depth_image.max() + volume._truncation_margin
+
+        x, y, z = voxel_coords[valid].T
+        u, v = image_points[valid].T
+        margin_distance = np.clip((depth_image[v, u] - camera_points[valid, 2]) / volume._truncation_margin, -1, 1)
+
+        w_old = volume._weight_volume[x, y, z]
+        tsdf_new, w_new = volume.get_new_tsdf_and_weights(
+            volume._tsdf_volume[x, y, z], margin_distance, w_old, observation_weight)
+        volume._color_volume[x, y, z] = volume.get_new_colors_with_weights(
+            volume._color_volume[x, y, z], color_image[v, u].astype(np.float32), w_old, w_new, observation_weight)
+        volume._tsdf_volume[x, y, z] = tsdf_new
+        volume._weight_volume[x, y, z] = w_new
+
+
+if __name__ == '__main__':
+    unittest.main()